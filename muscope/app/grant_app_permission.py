@@ -15,7 +15,7 @@ import subprocess
 import sys
 
 from muscope.models import User
-from orminator import session_manager_from_db_uri
+from muscope.util.db import session_manager_from_db_uri
 
 
 def get_args(argv):
@@ -82,20 +82,21 @@ import os
 import re
 import sys
 
-from irods.keywords import FORCE_FLAG_KW
-from irods.session import iRODSSession
-
-import pandas as pd
 import sqlalchemy as sa
 
-import muscope
 import muscope.models as models
 import muscope.util as util
+import muscope.util.download_cache as download_cache
+import muscope.util.irods as irods
+import muscope.util.parse_cache as parse_cache
+import muscope.util.sample_attr as sample_attr
 
+import muscope.cruise.reference_data as reference_data
 import muscope.cruise.sample_iddb as sample_iddb
+import muscope.cruise.spreadsheet as spreadsheet
 import muscope.cruise.station_db as station_db
 
-from orminator import session_manager_from_db_uri
+from muscope.util.db import session_manager_from_db_uri
 
 
 def get_args(argv):
@@ -111,6 +112,11 @@ def get_args(argv):
                             help='load database')
     arg_parser.add_argument('--file-limit', required=False, type=int, default=None,
                             help='maximum number of files to process')
+    arg_parser.add_argument('--sample-id-db-uri', required=False, default='sqlite://',
+                            help='sample id database URI, the default is in memory, '
+                                 'e.g. sqlite:///sample_iddb.sqlite3 keeps it on disk')
+    arg_parser.add_argument('--rebuild-station-db', required=False, action='store_true', default=False,
+                            help='rebuild the station database from all core spreadsheets')
 
     args = arg_parser.parse_args(argv)
     print('command line args: {}'.format(args))
@@ -121,12 +127,13 @@ def get_args(argv):
 def main(argv):
     args = get_args(argv)
 
-    # these are temporary SQLite databases
-    sample_id_db_uri = 'sqlite:///sample_iddb.sqlite3'
+    # the sample id database is temporary
+    # the station database is kept between runs and updated when the core spreadsheets change
+    sample_id_db_uri = args.sample_id_db_uri
     station_db_uri = 'sqlite:///stations.sqlite3'
 
     sample_iddb.build(sample_id_db_uri)
-    station_db.build(station_db_uri)
+    station_db.build(station_db_uri, rebuild=args.rebuild_station_db)
 
     muscope_collection_paths = args.collections.split(',')
     print('collection paths:\n\t{}'.format('\n\t'.join(muscope_collection_paths)))
@@ -159,8 +166,9 @@ def main(argv):
 
 def process_muscope_collection(muscope_collection_path, attribute_file_pattern, db_uri, sample_id_db_uri, station_db_uri, load_data, file_limit):
     """
-    List the contents of the argument (a collection) and recursively list the contents of subcollections.
-    When a data object is found look for a function that can parse it based on its name.
+    List the contents of the argument (a collection) and recursively list the contents of subcollections
+    one time. When a data object is found look for the rules to parse it based on its name. Then
+    look for sample data files in the same listing.
 
     :param muscope_collection_path: (str) start the search for attribute spreadsheets here
     :param attribute_file_pattern:  (str) process attribute spreadsheets matching this pattern
@@ -180,126 +188,115 @@ def process_muscope_collection(muscope_collection_path, attribute_file_pattern,
     loaded_file_paths = []
     unrecognized_file_paths = []
 
-    #
-    # parse attribute spreadsheets
-    # insert attributes
-    #
-    unprocessed_collection_paths = [muscope_collection_path]
-    while len(unprocessed_collection_paths) > 0:
-        c = unprocessed_collection_paths.pop(0)
-        print('processing collection "{}"\n'.format(c))
-
-        with iRODSSession(irods_env_file=os.path.expanduser('~/.irods/irods_environment.json')) as irods_session, \
-                session_manager_from_db_uri(sample_id_db_uri) as sample_db_session:
-
-            muscope_collection = irods_session.collections.get(c)
-
-            for muscope_data_object in muscope_collection.data_objects:
-                #print('found data object {} in {}'.format(muscope_data_object.name, muscope_collection.path))
-
-                attribute_file_match = attribute_file_re.search(muscope_data_object.name)
-
-                if attribute_file_match is None:
-                    print('{} does not match attribute file pattern "{}"'.format(
-                        muscope_data_object.name,
-                        attribute_file_pattern))
-                else:
-                    print('found an attribute file {}'.format(muscope_data_object.path))
-                    conjectured_parse_function_name = \
-                        'parse_' + \
-                        muscope_data_object.name.replace('.', '__').replace('-', '_')
-                    print('looking for parse function with name "{}"'.format(conjectured_parse_function_name))
-                    if conjectured_parse_function_name in sys.modules[__name__].__dict__:
-                        parse_function = sys.modules[__name__].__dict__[conjectured_parse_function_name]
-
-                        local_attribute_file_fp = os.path.join(
-                            os.path.dirname(muscope.__file__),
-                            'downloads',
-                            muscope_data_object.name)
-
-                        print('copying attribute file "{}" to "{}"'.format(
-                            muscope_data_object.path,
-                            local_attribute_file_fp))
-
-                        irods_session.data_objects.get(
-                            muscope_data_object.path,
-                            local_attribute_file_fp,
-                            **{FORCE_FLAG_KW: True})
-
-                        #
-                        # parse an attribute spreadsheet into a pandas.DataFrame
-                        #
-                        attr_df = parse_function(local_attribute_file_fp)
-                        print('attributes:\n{}'.format(attr_df.head()))
-
-                        load_attributes(
-                            attr_df,
-                            db_uri=db_uri,
-                            sample_id_db_uri=sample_id_db_uri,
-                            station_db_uri=station_db_uri,
-                            load_data=load_data)
-
+    with irods.irods_session_manager() as irods_session:
+        #
+        # list the collection tree once
+        # both passes below work from this snapshot
+        #
+        print('listing collection "{}"'.format(muscope_collection_path))
+        muscope_catalog = irods.build_catalog(irods_session, muscope_collection_path)
+        print('found {} data object(s) in {} collection(s)'.format(
+            len(muscope_catalog),
+            len(muscope_catalog.collection_paths())))
+
+        #
+        # parse attribute spreadsheets
+        # insert attributes
+        #
+        with session_manager_from_db_uri(db_uri) as session, \
+                session_manager_from_db_uri(station_db_uri) as station_session:
+            # investigators, cruises, stations and sample attribute types are read once for all spreadsheets
+            reference_cache = reference_data.ReferenceDataCache(session=session, station_session=station_session)
+
+            for c, subcollections, data_objects in muscope_catalog.breadth_first():
+                print('processing collection "{}"\n'.format(c))
+
+                for muscope_data_object in data_objects:
+                    #print('found data object {} in {}'.format(muscope_data_object.name, c))
+
+                    attribute_file_match = attribute_file_re.search(muscope_data_object.name)
+
+                    if attribute_file_match is None:
+                        print('{} does not match attribute file pattern "{}"'.format(
+                            muscope_data_object.name,
+                            attribute_file_pattern))
                     else:
-                        print('    no parse function by that name')
-                        unrecognized_file_paths.append(muscope_data_object.path)
+                        print('found an attribute file {}'.format(muscope_data_object.path))
+                        spreadsheet_rules = spreadsheet.find_attribute_spreadsheet_rules(muscope_data_object.name)
+                        if spreadsheet_rules is not None:
+                            print('found parse rules "{}"'.format(spreadsheet_rules.family))
+
+                            # the catalog has the checksum and modify time so an
+                            # unchanged attribute file will not be downloaded again
+                            with download_cache.get_download_cache().local_file(
+                                    irods_session,
+                                    muscope_data_object) as local_attribute_file_fp:
+
+                                #
+                                # parse an attribute spreadsheet into a pandas.DataFrame
+                                #
+                                attr_df = parse_cache.get_parse_cache().parse(
+                                    spreadsheet.parse_attribute_spreadsheet,
+                                    local_attribute_file_fp,
+                                    source_key=download_cache.cache_key(muscope_data_object),
+                                    depends_on=spreadsheet_rules.dependencies(),
+                                    source_path=muscope_data_object.path,
+                                    family=spreadsheet_rules.family)
+                            print('attributes:\n{}'.format(attr_df.head()))
+
+                            load_attributes(
+                                attr_df,
+                                reference_cache=reference_cache,
+                                sample_id_db_uri=sample_id_db_uri,
+                                load_data=load_data)
+
+                        else:
+                            print('    no parse rules for this file')
+                            unrecognized_file_paths.append(muscope_data_object.path)
 
-            # add sub collections to the list of collections to continue the
-            # recursive search for attribute spreadsheets
-            for subcollection in muscope_collection.subcollections:
-                print('adding subcollection path "{}"'.format(subcollection.path))
-                unprocessed_collection_paths.append(subcollection.path)
+                for subcollection in subcollections:
+                    print('subcollection path "{}"'.format(subcollection.path))
 
     print('done with attribute files')
 
     #
     # handle sample data files
     #
-    unprocessed_collection_paths = [muscope_collection_path]
-    while len(unprocessed_collection_paths) > 0:
-        c = unprocessed_collection_paths.pop(0)
-        print('processing collection "{}"\n'.format(c))
+    matched_data_files = []
+    with session_manager_from_db_uri(sample_id_db_uri) as sample_db_session:
+        file_limit_reached = False
+        for c, subcollections, data_objects in muscope_catalog.breadth_first():
+            print('processing collection "{}"\n'.format(c))
 
-        with iRODSSession(irods_env_file=os.path.expanduser('~/.irods/irods_environment.json')) as irods_session, \
-                session_manager_from_db_uri(sample_id_db_uri) as sample_db_session:
-            muscope_collection = irods_session.collections.get(c)
+            sample_file_table = sample_iddb.find_sample_names_for_sample_file_names(
+                [muscope_data_object.name for muscope_data_object in data_objects],
+                session=sample_db_session)
 
-            for muscope_data_object in muscope_collection.data_objects:
+            for muscope_data_object in data_objects:
 
                 ##data_file_match = data_file_endings.search(muscope_data_object.name)
-                sample_for_data_file = sample_iddb.find_sample_name_for_sample_file_name(
-                    muscope_data_object.name,
-                    session=sample_db_session)
+                sample_for_data_file = sample_file_table.get(muscope_data_object.name, None)
 
                 if sample_for_data_file is None:
                     print('nothing to do with file "{}"'.format(muscope_data_object.path))
+                elif (file_limit is not None) and len(processed_file_paths) >= file_limit:
+                    print('reached file limit {}'.format(file_limit))
+                    file_limit_reached = True
+                    break
                 else:
-                    try:
-                        if (file_limit is not None) and len(processed_file_paths) >= file_limit:
-                            print('reached file limit {}'.format(file_limit))
-                            unprocessed_collection_paths = []
-                            break
-                        else:
-                            processed_file_paths.append(muscope_data_object.path)
-
-                            load_data_file(
-                                muscope_data_object,
-                                db_uri=db_uri,
-                                sample_db_uri=sample_id_db_uri,
-                                load_data=load_data)
-                            loaded_file_paths.append(muscope_data_object.path)
+                    processed_file_paths.append(muscope_data_object.path)
+                    matched_data_files.append(
+                        (muscope_data_object, sample_for_data_file.sample_name, sample_for_data_file.data_type))
 
-                            # I need some space
-                            print()
+            if file_limit_reached:
+                break
 
-                    except util.FileNameException as fne:
-                        print(fne)
-                        unrecognized_file_paths.append(muscope_data_object.path)
-
-            # add sub collections to the list of collections to continue the
-            # recursive search for sample data files
-            for subcollection in muscope_collection.subcollections:
-                print('adding subcollection path "{}"'.format(subcollection.path))
-                unprocessed_collection_paths.append(subcollection.path)
+    registered_file_paths, failed_file_paths = register_data_files(
+        matched_data_files,
+        db_uri=db_uri,
+        sample_db_uri=sample_id_db_uri)
+    loaded_file_paths.extend(registered_file_paths)
+    unrecognized_file_paths.extend(failed_file_paths)
 
     print('loaded {} file path(s):\n\t{}'.format(
         len(loaded_file_paths),
@@ -311,7 +308,7 @@ def process_muscope_collection(muscope_collection_path, attribute_file_pattern,
     with session_manager_from_db_uri(sample_id_db_uri) as sample_db_session:
         unprocessed_sample_files = sample_iddb.get_unprocessed_sample_files(session=sample_db_session)
 
-        if len(unprocessed_collection_paths) == 0:
+        if len(unprocessed_sample_files) == 0:
             print('All sample files have been processed.')
         else:
             print('Unprocessed sample files:\n\t{}'.format('\n\t'.join([
@@ -449,16 +446,24 @@ def parse_data_file_path_or_name(path_or_name):
 """
 
 
-def load_attributes(core_attr_df, db_uri, sample_id_db_uri, station_db_uri, load_data):
-    with session_manager_from_db_uri(db_uri) as session, \
-            session_manager_from_db_uri(sample_id_db_uri) as sample_iddb_session, \
-            session_manager_from_db_uri(station_db_uri) as station_session:
+def load_attributes(core_attr_df, reference_cache, sample_id_db_uri, load_data, sample_attr_batch_size=1000):
+    """
+    Insert the samples and sample attributes of one parsed attribute spreadsheet and commit them.
+
+    :param core_attr_df: (pandas.DataFrame) a parsed attribute spreadsheet
+    :param reference_cache: (reference_data.ReferenceDataCache) shared by every spreadsheet in a run, its
+                            muSCOPE database session is used to insert rows
+    :param sample_id_db_uri: (str) temporary SQLite database URI
+    :param load_data: (bool) insert database rows if True
+    :param sample_attr_batch_size: (int) number of sample attributes inserted per statement
+    """
+    session = reference_cache.session
+    with session_manager_from_db_uri(sample_id_db_uri) as sample_iddb_session:
 
         sample_attributes_present = dict()
         for column_header in core_attr_df.columns:
             ##print(column_header)
-            sample_attr_type = session.query(models.Sample_attr_type).filter(
-                models.Sample_attr_type.type_ == column_header).one_or_none()
+            sample_attr_type = reference_cache.find_sample_attr_type(column_header)
             if sample_attr_type is None:
                 print('** no sample_attr_type for column header "{}"'.format(column_header))
             else:
@@ -469,6 +474,18 @@ def load_attributes(core_attr_df, db_uri, sample_id_db_uri, station_db_uri, load
         print('found the following sample attribute types:\n\t{}'.format(
             '\n\t'.join([v.type_ for k, v in sorted(sample_attributes_present.items())])))
 
+        # look up every sample in the spreadsheet at once
+        sample_rows_df = core_attr_df[core_attr_df.sample_name.astype(str) != 'nan']
+        sample_table = find_samples(
+            sample_keys=zip(
+                sample_rows_df.station.astype(int),
+                sample_rows_df.cast_num.astype(int),
+                sample_rows_df.sample_name),
+            session=session)
+        new_samples = []
+        sample_file_rows = []
+        sample_attr_writer = sample_attr.SampleAttrWriter(session=session, batch_size=sample_attr_batch_size)
+
         # many but NOT ALL attribute spreadsheets have an even number of rows for each sample
         for r1, sample_file_r1_row in core_attr_df.iterrows():
             print('sample with sample_name "{}"'.format(sample_file_r1_row.sample_name))
@@ -479,12 +496,10 @@ def load_attributes(core_attr_df, db_uri, sample_id_db_uri, station_db_uri, load
             else:
                 # this row has a sample name
 
-                investigator = session.query(models.Investigator).filter(
-                    models.Investigator.last_name == sample_file_r1_row.pi).one()
+                investigator = reference_cache.find_investigator(sample_file_r1_row.pi)
 
                 cruise_name = sample_file_r1_row.cruise_name
-                cruise_query_result = session.query(models.Cruise).filter(
-                    models.Cruise.cruise_name == cruise_name).one_or_none()
+                cruise_query_result = reference_cache.find_cruise(cruise_name)
                 if cruise_query_result is None:
                     print('cruise "{}" is not in the database'.format(cruise_name))
                     # start date and end date will have to be entered manually
@@ -493,6 +508,8 @@ def load_attributes(core_attr_df, db_uri, sample_id_db_uri, station_db_uri, load
                         session.add(cruise)
                     else:
                         print('  cruise will not be loaded')
+                    # later rows with the same cruise name get this cruise
+                    reference_cache.add_cruise(cruise)
                 else:
                     cruise = cruise_query_result
 
@@ -500,10 +517,9 @@ def load_attributes(core_attr_df, db_uri, sample_id_db_uri, station_db_uri, load
                 cast_number = int(sample_file_r1_row.cast_num)
                 print('  on row {} station_number is "{}" and cast number is "{}"'.format(r1, station_number, cast_number))
 
-                station = station_db.find_station(
+                station = reference_cache.find_station(
                     cruise_name=cruise.cruise_name,
-                    station_number=station_number,
-                    session=station_session)
+                    station_number=station_number)
 
                 if station_number == 0:
                     # this is a net tow
@@ -523,29 +539,23 @@ def load_attributes(core_attr_df, db_uri, sample_id_db_uri, station_db_uri, load
                 else:
                     data_type = 'Reads'
 
-                sample_iddb.insert_sample_file_name_and_sample_name(
-                    sample_file_name=sample_file_r1_row.seq_name,
-                    data_type=data_type,
-                    sample_name=sample_file_r1_row.sample_name,
-                    session=sample_iddb_session)
+                sample_file_rows.append(
+                    (sample_file_r1_row.seq_name, sample_file_r1_row.sample_name, data_type))
 
                 # if sample_name is empty on the next row then assume that row is also part of the current sample
                 # this happens, for example, when there are forward and reverse read files
                 print('next row sample_name: "{}"'.format(core_attr_df.loc[r1 + 1].sample_name))
-                if str(core_attr_df.loc[r1 + 1].sample_name) == 'nan':
+                # a blank row at the end of the spreadsheet has no file name
+                if str(core_attr_df.loc[r1 + 1].sample_name) == 'nan' \
+                        and str(core_attr_df.loc[r1 + 1].seq_name) != 'nan':
                     print('associating file "{}" with sample name "{}"'.format(
                         core_attr_df.loc[r1 + 1].seq_name,
                         sample_file_r1_row.sample_name))
-                    sample_iddb.insert_sample_file_name_and_sample_name(
-                        sample_file_name=core_attr_df.loc[r1 + 1].seq_name,
-                        data_type=data_type,
-                        sample_name=sample_file_r1_row.sample_name,
-                        session=sample_iddb_session)
+                    sample_file_rows.append(
+                        (core_attr_df.loc[r1 + 1].seq_name, sample_file_r1_row.sample_name, data_type))
 
-                sample_query_result = session.query(models.Sample).filter(
-                    models.Sample.station_number == station_number,
-                    models.Sample.cast_number == cast_number,
-                    models.Sample.sample_name == sample_file_r1_row.sample_name).one_or_none()
+                sample_key = (station_number, cast_number, str(sample_file_r1_row.sample_name))
+                sample_query_result = sample_table.get(sample_key, None)
 
                 if sample_query_result is None:
                     print('** sample "{}":"{}" does not exist in the database'.format(
@@ -570,7 +580,9 @@ def load_attributes(core_attr_df, db_uri, sample_id_db_uri, station_db_uri, load
                             cast_number=cast_number,
                             sample_name=sample_file_r1_row.sample_name)
                         sample.investigator_list.append(investigator)
-                        session.add(sample)
+                        # later rows for the same sample get this sample
+                        sample_table[sample_key] = sample
+                        new_samples.append(sample)
                     else:
                         print('  sample will not be loaded')
                         sample = None
@@ -595,11 +607,9 @@ def load_attributes(core_attr_df, db_uri, sample_id_db_uri, station_db_uri, load
                     print('\t{}'.format('\n\t'.join(sorted(['{}: "{}"'.format(a.sample_attr_type.type_, a.value) for a in sample.sample_attr_list]))))
 
                     for column_header, column_sample_attr_type in sorted(sample_attributes_present.items()):
-                        sample_attrs_with_column_attr_type = [
-                            a
-                            for a
-                            in sample.sample_attr_list
-                            if a.sample_attr_type == column_sample_attr_type]
+                        sample_attrs_with_column_attr_type = sample_attr_writer.existing_sample_attrs(
+                            sample,
+                            column_sample_attr_type)
                         if len(sample_attrs_with_column_attr_type) == 0:
                             print('  sample has {} attribute(s) with sample attribute type "{}"'.format(
                                 len(sample_attrs_with_column_attr_type), column_sample_attr_type.type_))
@@ -617,9 +627,7 @@ def load_attributes(core_attr_df, db_uri, sample_id_db_uri, station_db_uri, load
                             elif len(sample_attrs_with_column_attr_type) == 0:
                                 # add a new sample attribute
                                 print('    need to add value "{}" from column "{}"'.format(attr_value, column_header))
-                                sample_attr = models.Sample_attr(value=attr_value)
-                                sample_attr.sample = sample
-                                sample_attr.sample_attr_type = column_sample_attr_type
+                                sample_attr_writer.add(sample, column_sample_attr_type, attr_value)
                             elif len(sample_attrs_with_column_attr_type) == 1:
                                 # everything is ok
                                 pass
@@ -627,9 +635,53 @@ def load_attributes(core_attr_df, db_uri, sample_id_db_uri, station_db_uri, load
                                 # is something wrong?
                                 print(sample_attrs_with_column_attr_type)
                                 raise Exception('too many attributes with the same type?')
+
+        sample_iddb.upsert_sample_file_names(sample_file_rows, session=sample_iddb_session)
+
+        print('inserting {} new sample(s)'.format(len(new_samples)))
+        session.add_all(new_samples)
+        sample_attr_writer.flush()
+        # the session is shared by every spreadsheet so commit each one as it is loaded
+        session.commit()
         print('all rows have been parsed')
 
 
+def find_samples(sample_keys, session, chunk_size=500):
+    """
+    Find the samples for (station_number, cast_number, sample_name) keys with one query per chunk of sample
+    names. The sample files and sample attributes are loaded with the samples.
+
+    :param sample_keys: iterable of (station_number, cast_number, sample_name)
+    :param session: SQLAlchemy session for the muSCOPE database
+    :param chunk_size: (int) number of sample names in each query
+    :return: dict of (station_number, cast_number, sample_name) -> models.Sample for keys found in the database
+    """
+    sample_key_set = {
+        (int(station_number), int(cast_number), str(sample_name))
+        for station_number, cast_number, sample_name
+        in sample_keys}
+    sample_names = sorted({sample_name for _, _, sample_name in sample_key_set})
+
+    sample_table = dict()
+    for c in range(0, len(sample_names), chunk_size):
+        sample_query = session.query(models.Sample).filter(
+            models.Sample.sample_name.in_(sample_names[c:c+chunk_size])).options(
+                sa.orm.subqueryload(models.Sample.sample_file_list),
+                sa.orm.subqueryload(models.Sample.sample_attr_list).joinedload(models.Sample_attr.sample_attr_type))
+        for sample in sample_query.all():
+            sample_key = (sample.station_number, sample.cast_number, sample.sample_name)
+            if sample_key not in sample_key_set:
+                pass
+            elif sample_key in sample_table:
+                raise sa.orm.exc.MultipleResultsFound(
+                    'more than one sample with station {}, cast {} and sample name "{}"'.format(*sample_key))
+            else:
+                sample_table[sample_key] = sample
+
+    print('found {} of {} sample(s) in the database'.format(len(sample_table), len(sample_key_set)))
+    return sample_table
+
+
 file_type_table = {
     re.compile(r'contigs\.fastq'): 'Assembly',
     re.compile(r'genes\.fna'): 'Annotation Genes',
@@ -665,534 +717,138 @@ def get_sample_file_type(data_object_name):
             '\n\t'.join([t for t in matched_file_types])))
 
 
-def load_data_file(muscope_data_object, db_uri, sample_db_uri, load_data):
-    print('loading data file "{}"'.format(muscope_data_object.path))
-
-    with session_manager_from_db_uri(db_uri=db_uri) as db_session, \
-            session_manager_from_db_uri(sample_db_uri) as sample_db_session:
-        print('searching for sample file "{}"'.format(muscope_data_object.name))
-        try:
-            s = sample_iddb.find_sample_name_for_sample_file_name(
-                muscope_data_object.name,
-                sample_db_session)
-
-            sample = db_session.query(
-                models.Sample).filter(
-                    models.Sample.sample_name == s.sample_name).one_or_none()
-
-            if sample is None:
-                # the BATS files should be ignored, for example
-                error_msg = 'ERROR: failed to find sample with name "{}" for file "{} in {}"'.format(
-                    s.sample_name,
-                    muscope_data_object.name,
-                    db_uri)
-                print(error_msg)
-            else:
-                sample_file_query_result = db_session.query(
-                    models.Sample_file).filter(
-                        models.Sample_file.sample == sample,
-                        models.Sample_file.file_ == muscope_data_object.path).one_or_none()
-
-                if s.data_type is not None:
-                    sample_file_type = s.data_type
-                else:
-                    sample_file_type = get_sample_file_type(muscope_data_object.name)
-                print('sample file type is "{}"'.format(sample_file_type))
-
-                if sample_file_query_result is None:
-                    print('inserting sample_file "{}"'.format(muscope_data_object.path))
-                    sample_file = models.Sample_file(file_=muscope_data_object.path)
-
-                    sample_file.sample_file_type = db_session.query(
-                        models.Sample_file_type).filter(models.Sample_file_type.type_ == sample_file_type).one()
-
-                    sample_file.sample = sample
-                else:
-                    sample_file = sample_file_query_result
-                    print('sample_file "{}" is already in the database'.format(muscope_data_object.path))
-                    print('  file type is "{}"'.format(sample_file.sample_file_type.type_))
-                    print('  setting file type to "{}"'.format(sample_file_type))
-                    sample_file.sample_file_type = db_session.query(
-                        models.Sample_file_type).filter(models.Sample_file_type.type_ == sample_file_type).one()
-
-                sample_iddb.mark_sample_file_processed(os.path.basename(sample_file.file_), sample_db_session)
-
-        except sa.orm.exc.MultipleResultsFound as mrf:
-            # this probably means we have found one or more rows with mismatched cruise and sample
-            # this is an error I caused earlier
-            print('repairing sample "{}"'.format(s.sample_name))
-            bad_samples = []
-            sample_query_result = db_session.query(models.Sample).filter(
-                models.Sample.sample_name == s.sample_name).all()
-            print('found multiple samples with sample name "{}"'.format(s.sample_name))
-            for sample in sample_query_result:
-                if sample.cast.station.cruise.cruise_name == 'HOT268':
-                    print('this is probably a bad sample and it will be deleted:')
-                    bad_samples.append(sample)
-                else:
-                    print('this is probably a good sample:')
-
-                print('    cruise: "{}" sample id: "{}" sample name: "{}"'.format(
-                      sample.cast.station.cruise.cruise_name,
-                      sample.sample_id,
-                      sample.sample_name))
-
-            for bad_sample in bad_samples:
-                for bad_sample_attr in bad_sample.sample_attr_list:
-                    db_session.delete(bad_sample_attr)
-                db_session.delete(bad_sample)
-
-
-def parse_attributes(spreadsheet_fp):
-    core_attr_plus_data_df = pd.read_excel(
-        spreadsheet_fp,
-        sheet_name='core attributes + data',
-        skiprows=(0, 2)
-    )
-    core_attr_plus_data_df.rename(columns={'depth_sample': 'depth'}, inplace=True)
-
-    return core_attr_plus_data_df
-
-
-def parse_Armbrust_HL2A_EukTxnDiel_seq_attrib__xls(spreadsheet_fp):
-    """Nothing peculiar about this file.
-    :param spreadsheet_fp:
-    :return: core_attr_plus_data_df pandas.DataFrame
-    """
-    return parse_attributes(spreadsheet_fp)
-
-
-def parse_Caron_HL2A_18Sdiel_seq_attrib_v2__xls(spreadsheet_fp):
-    """Some parts of this file need adjustment.
-    :param spreadsheet_fp:
-    :return:
+def register_data_files(matched_data_files, db_uri, sample_db_uri, batch_size=500):
     """
-
-    core_attr_plus_data_df = parse_attributes(spreadsheet_fp)
-
-    # column 10 header is on the wrong line
-    column_10_header = core_attr_plus_data_df.columns[9]
-    core_attr_plus_data_df.rename(columns={'depth_sample': 'depth', column_10_header: 'seq_name'}, inplace=True)
-
-    # entries in the 'station' column look like 'S47' but we want just the number
-    core_attr_plus_data_df.station = [
-        (s if isinstance(s, float) else float(s[1:]))
-        for s
-        in core_attr_plus_data_df.station]
-
-    # entries in the 'cast' column look like 'C1' but we want just the number
-    core_attr_plus_data_df.cast_num = [
-        (c if isinstance(c, float) else float(c[1:]))
-        for c
-        in core_attr_plus_data_df.cast_num]
-
-    return core_attr_plus_data_df
-
-
-def parse_Caron_HL2A_VertProf_seq_attrib_v3__xls(spreadsheet_fp):
-    """Copy sample_name to rows with R1 file name.
-    :param spreadsheet_fp:
-    :return:
-    """
-
-    core_attr_plus_data_df = parse_attributes(spreadsheet_fp)
-
-    for (r1, row1), (r2, row2) in util.grouper(core_attr_plus_data_df.iterrows(), n=2):
-        if r1 == 0:
-            # skip row 0
-            pass
-        else:
-            # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
-            column_names = list(core_attr_plus_data_df.columns)
-            for attr_name in column_names:
-                print('row {} attr "{}" is "{}"'.format(r1, attr_name, core_attr_plus_data_df.loc[r1, attr_name]))
-                if str(core_attr_plus_data_df.loc[r1, attr_name]) in ('nan', 'NaT'):
-                    print('  copy "{}" from previous sample'.format(core_attr_plus_data_df.loc[r1-2, attr_name]))
-                    core_attr_plus_data_df.loc[r1, attr_name] = core_attr_plus_data_df.loc[r1-2, attr_name]
-                else:
-                    pass
-
-    return core_attr_plus_data_df
-
-
-def parse_Caron_HL3_VertProf_seq_attrib_v3__xls(spreadsheet_fp):
-    """Nothing to adjust here.
-    :param spreadsheet_fp:
-    :return:
-    """
-    core_attr_plus_data_df = parse_attributes(spreadsheet_fp)
-
-    for (r1, row1), (r2, row2) in util.grouper(core_attr_plus_data_df.iterrows(), n=2):
-        if r1 == 0:
-            # skip row 0
-            pass
-        else:
-            # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
-            column_names = list(core_attr_plus_data_df.columns)
-            for attr_name in column_names:
-                print('row {} attr "{}" is "{}"'.format(r1, attr_name, core_attr_plus_data_df.loc[r1, attr_name]))
-                if str(core_attr_plus_data_df.loc[r1, attr_name]) in ('nan', 'NaT'):
-                    print('  copy "{}" from previous sample'.format(core_attr_plus_data_df.loc[r1-2, attr_name]))
-                    core_attr_plus_data_df.loc[r1, attr_name] = core_attr_plus_data_df.loc[r1-2, attr_name]
-                else:
-                    pass
-
-    return core_attr_plus_data_df
-
-
-def parse_Caron_HOT273_18Ssizefrac_seq_assoc_data_v2__xls(spreadsheet_fp):
-    """Need to adjust the cruise name column and add collection time.
-    :param spreadsheet_fp:
-    :return:
-    """
-    core_attr_plus_data_df = parse_attributes(spreadsheet_fp)
-
-    # the cruise name column is just '273'
-    ##core_attr_plus_data_df.cruise_name = 'HOT273'
-    core_attr_plus_data_df.cruise_name = ['HOT{}'.format(n) for n in core_attr_plus_data_df.cruise_name]
-
-    # the spreadsheet does not have collection_time
-    core_attr_plus_data_df['collection_time'] = datetime.time(hour=0, minute=0, second=0)
-
-    # return a dummy dataframe to fit in with the parse/load function scheme
-    return core_attr_plus_data_df
-
-
-def parse_Caron_HOTquarterly_18Sv4_seq_assoc_data_v2__xls(spreadsheet_fp):
-    """Need to add 'HOT' to the cruise name.
-    :param spreadsheet_fp:
-    :return:
-    """
-    core_attr_plus_data_df = parse_attributes(spreadsheet_fp)
-
-    # the cruise name column is just '273'
-    core_attr_plus_data_df.cruise_name = ['HOT{}'.format(n) for n in core_attr_plus_data_df.cruise_name]
-
-    ## the spreadsheet does not have collection_time
-    #core_attr_plus_data_df['collection_time'] = datetime.time(hour=0, minute=0, second=0)
-
-    return core_attr_plus_data_df
-
-
-def parse_Chisholm_HOT__BATS_seq_attrib__xls(spreadsheet_fp):
-    """Remove BATS cruises.
-    :param spreadsheet_fp:
-    :return:
-    """
-    core_attr_plus_data_df = parse_attributes(spreadsheet_fp)
-
-    # this spreadsheet is missing the 'seq_name' column header
-    core_attr_plus_data_df.rename(columns={'Unnamed: 9': 'seq_name'}, inplace=True)
-
-    # cut off the BATS
-    print('removing BATS cruises!')
-    core_attr_plus_data_df = core_attr_plus_data_df.iloc[:132, :]
-
-    return core_attr_plus_data_df
-
-
-def parse_Chisholm_HOT263__283_Vesicle_seq_attrib_v2__xls(spreadsheet_fp):
-    return parse_attributes(spreadsheet_fp)
-
-
-def parse_Church_HOT201_222_Tricho16S_seq_assoc_v2__xls(spreadsheet_fp):
+    Insert or update a Sample_file row for each data file. Samples, existing sample files and sample file types
+    are looked up with one query per batch and each batch is written in one transaction.
+
+    :param matched_data_files: list of (data object, sample name, data type or None)
+    :param db_uri:             (str) SQLAlchemy database URI for muSCOPE database
+    :param sample_db_uri:      (str) SQLAlchemy database URI for the sample id database
+    :param batch_size:         (int) number of data files in each transaction
+    :return: list of registered file paths, list of file paths that failed
     """
-    This spreadsheet has 'net tow' in the cast_num column. These will be changed to '0'.
-    The cruise_name column has only numbers. 'HOT' will be prepended to them.
-    The depth column is missing some values. For now use 175.
-    The collection_time column is empty. '00:00:00' will be used.
-
-    :param spreadsheet_fp:
-    :return:
-    """
-    core_attr_plus_data_df = parse_attributes(spreadsheet_fp)
-
-    for (r1, row1), (r2, row2) in util.grouper(core_attr_plus_data_df.iterrows(), n=2):
-        # replace 'net tow' with '0' in the cast_num column
-        if core_attr_plus_data_df.loc[r1, 'cast_num'] == 'net tow':
-            core_attr_plus_data_df.loc[r1, 'cast_num'] = 0
-
-        # add 'HOT' to cruise_name
-        core_attr_plus_data_df.loc[r1, 'cruise_name'] = \
-            'HOT' + str(int(core_attr_plus_data_df.loc[r1, 'cruise_name']))
-
-        # use 999 for missing sample depth and change it to null with the admin console
-        if str(core_attr_plus_data_df.loc[r1, 'depth']) == 'nan':
-            core_attr_plus_data_df.loc[r1, 'depth'] = 999
-
-        if r1 == 0:
-            # copy time from first date column to first time column
-            core_attr_plus_data_df.loc[0, 'collection_time'] = core_attr_plus_data_df.collection_date[0].time()
-        else:
-            # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
-            column_names = list(core_attr_plus_data_df.columns)
-            # do not copy over missing values in the depth column
-            column_names.remove('depth')
-            for attr_name in column_names:
-                print('row {} attr "{}" is "{}"'.format(r1, attr_name, core_attr_plus_data_df.loc[r1, attr_name]))
-                if str(core_attr_plus_data_df.loc[r1, attr_name]) in ('nan', 'NaT'):
-                    print('  copy "{}" from previous sample'.format(core_attr_plus_data_df.loc[r1 - 2, attr_name]))
-                    core_attr_plus_data_df.loc[r1, attr_name] = core_attr_plus_data_df.loc[r1 - 2, attr_name]
-                else:
-                    pass
-
-    return core_attr_plus_data_df
-
-
-def parse_DeLong_HL2A_DNAdiel_seq_assoc_data_v3__xls(spreadsheet_fp):
-    return parse_attributes(spreadsheet_fp)
-
-
-def parse_DeLong_HL2A_0__2frac_diel_seq_assoc_data_v3__xls(spreadsheet_fp):
-    return parse_attributes(spreadsheet_fp)
-
-
-def parse_DeLong_HL2A_RNAdiel_seq_assoc_data_v3__xls(spreadsheet_fp):
-    return parse_attributes(spreadsheet_fp)
-
-
-def parse_Dyhrman_HL4_incubation_seq_assoc_data_v5__xls(spreadsheet_fp):
-    core_attr_plus_data_df = parse_attributes(spreadsheet_fp)
-
-    for (r1, row1), (r2, row2), (r3, row3), (r4, row4) in util.grouper(core_attr_plus_data_df.iterrows(), n=4):
-        print(row1.seq_name)
-        if row1.data_type == 'mRNA reads':
-            core_attr_plus_data_df.loc[r1, 'data_type'] = 'mRNA Reads'
-        else:
-            raise Exception()
-        if row3.data_type == 'total RNA reads':
-            core_attr_plus_data_df.loc[r3, 'data_type'] = 'Total RNA Reads'
-        else:
-            raise Exception()
-
-        # append .gz to file names
-        if str(row1.seq_name).endswith('.fastq'):
-            core_attr_plus_data_df.loc[r1, 'seq_name'] = row1.seq_name + '.gz'
-        else:
-            pass
-        if str(row2.seq_name).endswith('.fastq'):
-            core_attr_plus_data_df.loc[r2, 'seq_name'] = row2.seq_name + '.gz'
-        else:
-            pass
-        if str(row3.seq_name).endswith('.fastq'):
-            core_attr_plus_data_df.loc[r3, 'seq_name'] = row3.seq_name + '.gz'
-        else:
-            pass
-        if str(row4.seq_name).endswith('.fastq'):
-            core_attr_plus_data_df.loc[r4, 'seq_name'] = row4.seq_name + '.gz'
-        else:
-            pass
-
-        # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
-        column_names = list(core_attr_plus_data_df.columns)
-        for attr_name in column_names:
-            #print('row {} attr "{}" is "{}"'.format(r3, attr_name, core_attr_plus_data_df.loc[r3, attr_name]))
-            if str(core_attr_plus_data_df.loc[r3, attr_name]) in ('nan', 'NaT'):
-                #print('  copy "{}" from previous sample'.format(core_attr_plus_data_df.loc[r1, attr_name]))
-                core_attr_plus_data_df.loc[r3, attr_name] = core_attr_plus_data_df.loc[r1, attr_name]
-            else:
-                pass
-
-    return core_attr_plus_data_df
-
-
-def parse_Dyhrman_HL2A_incubation_seq_assoc_data_v5__xls(spreadsheet_fp):
-    core_attr_plus_data_df = parse_attributes(spreadsheet_fp)
-
-    # 2 related samples appear in groups of 4 rows
-    # the first sample is usually "mRNA"
-    # the second sample is usually "totalRNA"
-
-    # the "totalRNA" sample row is missing information that is duplicated
-    # by its corresponding "mRNA" sample so this function will copy that
-    # information to the "totalRNA" row
-
-    # but there are a few cases of isolated "totalRNA" samples
-    # that do have all the information already
-    for (r1, row1), (r2, row2) in util.grouper(core_attr_plus_data_df.iterrows(), n=2):
-        # remove .fastq.tar from sample names
-        if str(row1.sample_name).endswith('.fastq.tar'):
-            core_attr_plus_data_df.loc[r1, 'sample_name'] = row1.sample_name[:-10]
-        else:
-            pass
-
-        # append .gz to file names
-        if str(row1.seq_name).endswith('.fastq'):
-            core_attr_plus_data_df.loc[r1, 'seq_name'] = row1.seq_name + '.gz'
-        else:
-            pass
-        if str(row2.seq_name).endswith('.fastq'):
-            core_attr_plus_data_df.loc[r2, 'seq_name'] = row2.seq_name + '.gz'
-        else:
-            pass
-
-        # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
-        for attr_name in core_attr_plus_data_df.columns:
-            #print('row {} attr "{}" is "{}"'.format(r1, attr_name, core_attr_plus_data_df.loc[r1, attr_name]))
-            if str(core_attr_plus_data_df.loc[r1, attr_name]) in ('nan', 'NaT') and r1 > 0:
-                #print('  copy "{}" from previous sample'.format(core_attr_plus_data_df.loc[r1 - 2, attr_name]))
-                core_attr_plus_data_df.loc[r1, attr_name] = core_attr_plus_data_df.loc[r1 - 2, attr_name]
-            else:
-                pass
-
-    return core_attr_plus_data_df
-
-
-def parse_Dyhrman_HL2A_RNAdiel_seq_assoc_data_v5__xls(spreadsheet_fp):
-    core_attr_plus_data_df = parse_attributes(spreadsheet_fp)
-
-    # change column name 'gene_name' to 'data_type' for now
-    ##column_headers = list(core_attr_plus_data_df.columns)
-    ##n = column_headers.index('gene_name')
-    ##column_headers[n] = 'data_type'
-    ##core_attr_plus_data_df.columns = column_headers
-
-    for (r1, row1), (r2, row2), (r3, row3), (r4, row4) in util.grouper(core_attr_plus_data_df.iterrows(), n=4):
-        # remove .fastq.tar from sample names
-        if str(row1.sample_name).endswith('.fastq.tar'):
-            core_attr_plus_data_df.loc[r1, 'sample_name'] = row1.sample_name[:-10]
-        else:
-            pass
-
-        if row1.data_type == 'mRNA reads':
-            core_attr_plus_data_df.loc[r1, 'data_type'] = 'mRNA Reads'
-        else:
-            raise Exception()
-        if row3.data_type == 'total RNA reads':
-            core_attr_plus_data_df.loc[r3, 'data_type'] = 'Total RNA Reads'
-        else:
-            raise Exception()
-
-        # append .gz to file names
-        if str(row1.seq_name).endswith('.fastq'):
-            core_attr_plus_data_df.loc[r1, 'seq_name'] = row1.seq_name + '.gz'
-        else:
-            pass
-        if str(row2.seq_name).endswith('.fastq'):
-            core_attr_plus_data_df.loc[r2, 'seq_name'] = row2.seq_name + '.gz'
-        else:
-            pass
-        if str(row3.seq_name).endswith('.fastq'):
-            core_attr_plus_data_df.loc[r3, 'seq_name'] = row3.seq_name + '.gz'
-        else:
-            pass
-        if str(row4.seq_name).endswith('.fastq'):
-            core_attr_plus_data_df.loc[r4, 'seq_name'] = row4.seq_name + '.gz'
-        else:
-            pass
-
-        # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
-        column_names = list(core_attr_plus_data_df.columns)
-        for attr_name in column_names:
-            #print('row {} attr "{}" is "{}"'.format(r3, attr_name, core_attr_plus_data_df.loc[r3, attr_name]))
-            if str(core_attr_plus_data_df.loc[r3, attr_name]) in ('nan', 'NaT'):
-                #print('  copy "{}" from previous sample'.format(core_attr_plus_data_df.loc[r1, attr_name]))
-                core_attr_plus_data_df.loc[r3, attr_name] = core_attr_plus_data_df.loc[r1, attr_name]
-            else:
-                pass
-
-    return core_attr_plus_data_df
-
-
-def parse_Dyhrman_HL2A_Tricho_seq_attrib_v2__xls(spreadsheet_fp):
-    core_attr_plus_data_df = parse_attributes(spreadsheet_fp)
-
-    for (r1, row1), (r2, row2) in util.grouper(core_attr_plus_data_df.iterrows(), n=2):
-        # set station and cast to 0
-        core_attr_plus_data_df.loc[r1, 'station'] = 0
-        core_attr_plus_data_df.loc[r1, 'cast_num'] = 0
-        core_attr_plus_data_df.loc[r2, 'station'] = 0
-        core_attr_plus_data_df.loc[r2, 'cast_num'] = 0
-
-        # append .gz to file names
-        if str(row1.seq_name).endswith('.fastq'):
-            core_attr_plus_data_df.loc[r1, 'seq_name'] = row1.seq_name + '.gz'
-        else:
-            pass
-        if str(row2.seq_name).endswith('.fastq'):
-            core_attr_plus_data_df.loc[r2, 'seq_name'] = row2.seq_name + '.gz'
-        else:
-            pass
-
-        if core_attr_plus_data_df.loc[r1, 'data_type'] == 'reads':
-            core_attr_plus_data_df.loc[r1, 'data_type'] = 'Reads'
-        else:
-            raise Exception()
-        if core_attr_plus_data_df.loc[r2, 'data_type'] == 'reads':
-            core_attr_plus_data_df.loc[r2, 'data_type'] = 'Reads'
+    registered_file_paths = []
+    failed_file_paths = []
+    for b in range(0, len(matched_data_files), batch_size):
+        batch = matched_data_files[b:b+batch_size]
+        print('registering data files {} to {} of {}'.format(b + 1, b + len(batch), len(matched_data_files)))
+
+        with session_manager_from_db_uri(db_uri=db_uri) as db_session, \
+                session_manager_from_db_uri(sample_db_uri) as sample_db_session:
+
+            samples_by_name = dict()
+            for sample in db_session.query(models.Sample).filter(
+                    models.Sample.sample_name.in_({sample_name for _, sample_name, _ in batch})).all():
+                samples_by_name.setdefault(sample.sample_name, []).append(sample)
+
+            sample_files_by_path = dict()
+            for sample_file in db_session.query(models.Sample_file).filter(
+                    models.Sample_file.file_.in_([muscope_data_object.path for muscope_data_object, _, _ in batch])).options(
+                        sa.orm.joinedload(models.Sample_file.sample_file_type)).all():
+                sample_files_by_path.setdefault(sample_file.file_, []).append(sample_file)
+
+            sample_file_types = {
+                sample_file_type.type_: sample_file_type
+                for sample_file_type
+                in db_session.query(models.Sample_file_type).all()}
+
+            processed_sample_file_names = []
+            for muscope_data_object, sample_name, data_type in batch:
+                print('registering data file "{}"'.format(muscope_data_object.path))
+                try:
+                    sample_list = samples_by_name.get(sample_name, [])
+                    if len(sample_list) > 1:
+                        # later files with this sample name will find the surviving sample
+                        sample_list = repair_samples(sample_name, sample_list, db_session)
+                        samples_by_name[sample_name] = sample_list
+
+                    if len(sample_list) == 0:
+                        # the BATS files should be ignored, for example
+                        error_msg = 'ERROR: failed to find sample with name "{}" for file "{} in {}"'.format(
+                            sample_name,
+                            muscope_data_object.name,
+                            db_uri)
+                        print(error_msg)
+                    elif len(sample_list) > 1:
+                        print('ERROR: found {} samples with name "{}" for file "{}" after repair'.format(
+                            len(sample_list),
+                            sample_name,
+                            muscope_data_object.name))
+                    else:
+                        sample = sample_list[0]
+                        sample_file_query_result = [
+                            sample_file
+                            for sample_file
+                            in sample_files_by_path.get(muscope_data_object.path, [])
+                            if sample_file.sample == sample]
+
+                        if data_type is not None:
+                            sample_file_type = data_type
+                        else:
+                            sample_file_type = get_sample_file_type(muscope_data_object.name)
+                        print('sample file type is "{}"'.format(sample_file_type))
+                        if sample_file_type not in sample_file_types:
+                            raise sa.orm.exc.NoResultFound('no sample file type "{}"'.format(sample_file_type))
+
+                        if len(sample_file_query_result) == 0:
+                            print('inserting sample_file "{}"'.format(muscope_data_object.path))
+                            sample_file = models.Sample_file(file_=muscope_data_object.path)
+                            sample_file.sample_file_type = sample_file_types[sample_file_type]
+                            sample_file.sample = sample
+                            db_session.add(sample_file)
+                            sample_files_by_path.setdefault(sample_file.file_, []).append(sample_file)
+                        elif len(sample_file_query_result) == 1:
+                            sample_file = sample_file_query_result[0]
+                            print('sample_file "{}" is already in the database'.format(muscope_data_object.path))
+                            print('  file type is "{}"'.format(sample_file.sample_file_type.type_))
+                            print('  setting file type to "{}"'.format(sample_file_type))
+                            sample_file.sample_file_type = sample_file_types[sample_file_type]
+                        else:
+                            raise sa.orm.exc.MultipleResultsFound(
+                                'found {} sample files with path "{}"'.format(
+                                    len(sample_file_query_result), muscope_data_object.path))
+
+                        processed_sample_file_names.append(os.path.basename(sample_file.file_))
+                        registered_file_paths.append(muscope_data_object.path)
+
+                except util.FileNameException as fne:
+                    print(fne)
+                    failed_file_paths.append(muscope_data_object.path)
+                except sa.orm.exc.MultipleResultsFound as mrf:
+                    print(mrf)
+                    failed_file_paths.append(muscope_data_object.path)
+
+            sample_iddb.mark_sample_files_processed(processed_sample_file_names, sample_db_session)
+
+    return registered_file_paths, failed_file_paths
+
+
+def repair_samples(sample_name, sample_list, db_session):
+    """Delete the bad samples in sample_list and return the list of samples that are kept."""
+    # this probably means we have found one or more rows with mismatched cruise and sample
+    # this is an error I caused earlier
+    print('repairing sample "{}"'.format(sample_name))
+    bad_samples = []
+    print('found multiple samples with sample name "{}"'.format(sample_name))
+    for sample in sample_list:
+        if sample.cast.station.cruise.cruise_name == 'HOT268':
+            print('this is probably a bad sample and it will be deleted:')
+            bad_samples.append(sample)
         else:
-            raise Exception()
-
-        # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
-        column_names = list(core_attr_plus_data_df.columns)
-        for attr_name in column_names:
-            # print('row {} attr "{}" is "{}"'.format(r3, attr_name, core_attr_plus_data_df.loc[r3, attr_name]))
-            if str(core_attr_plus_data_df.loc[r1, attr_name]) in ('nan', 'NaT') and r1 > 0:
-                # print('  copy "{}" from previous sample'.format(core_attr_plus_data_df.loc[r1, attr_name]))
-                core_attr_plus_data_df.loc[r1, attr_name] = core_attr_plus_data_df.loc[r1 - 2, attr_name]
-            else:
-                pass
+            print('this is probably a good sample:')
 
-    # convert to decimal degrees
-    for (r1, row1), (r2, row2) in util.grouper(core_attr_plus_data_df.iterrows(), n=2):
-        # print(core_attr_plus_data_df.loc[r1, 'latitude'])
-        lat1, lat2 = core_attr_plus_data_df.loc[r1, 'latitude'].split()
-        core_attr_plus_data_df.loc[r1, 'latitude'] = float(lat1) + (float(lat2) / 60)
+        print('    cruise: "{}" sample id: "{}" sample name: "{}"'.format(
+              sample.cast.station.cruise.cruise_name,
+              sample.sample_id,
+              sample.sample_name))
 
-        lon1, lon2 = core_attr_plus_data_df.loc[r1, 'longitude'].split()
-        core_attr_plus_data_df.loc[r1, 'longitude'] = -1.0 * float(lon1) + (float(lon2) / 60)
-
-    # these start out empty but get filled in by the attribute copy loop above
-    core_attr_plus_data_df.loc[12, 'latitude'] = None
-    core_attr_plus_data_df.loc[12, 'longitude'] = None
-    core_attr_plus_data_df.loc[14, 'latitude'] = None
-    core_attr_plus_data_df.loc[14, 'longitude'] = None
-
-    return core_attr_plus_data_df
-
-
-def parse_Dyhrman_MS_incubation_assoc_data_v5__xls(spreadsheet_fp):
-    core_attr_plus_data_df = parse_attributes(spreadsheet_fp)
-
-    # 2 related samples appear in groups of 4 rows
-    # the first sample is usually "mRNA"
-    # the second sample is usually "totalRNA"
-
-    # parse time strings such as '12:45:00' and '1245'
-    # the first 3 collection times are datetime objects, the remaining collection times are just strings like "1205"
-    time_re = re.compile(r'^(?P<hour>\d{1,2}):?(?P<minute>\d{1,2})(:(?P<second>)\d{1,2})?$')
-
-    for (r1, row1), (r2, row2), (r3, row3), (r4, row4) in util.grouper(core_attr_plus_data_df.iterrows(), n=4):
-        # change the cruise name to MESO-SCOPE
-        core_attr_plus_data_df.loc[r1, 'cruise_name'] = 'MESO-SCOPE'
-
-        if row1.data_type == 'mRNA reads':
-            core_attr_plus_data_df.loc[r1, 'data_type'] = 'mRNA Reads'
-        else:
-            raise Exception()
-        if row3.data_type == 'total RNA reads':
-            core_attr_plus_data_df.loc[r3, 'data_type'] = 'Total RNA Reads'
-        else:
-            raise Exception()
-
-        # convert the strings in collection_time to datetime.time objects
-        ##print('"{}"'.format(row1.collection_time))
-        collection_time_match = time_re.search(str(row1.collection_time))
-        core_attr_plus_data_df.loc[row1.name, 'collection_time'] = datetime.time(
-            hour=int(collection_time_match.group('hour')),
-            minute=int(collection_time_match.group('minute')))
-
-        # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
-        column_names = list(core_attr_plus_data_df.columns)
-        for attr_name in column_names:
-            #print('row {} attr "{}" is "{}"'.format(r3, attr_name, core_attr_plus_data_df.loc[r3, attr_name]))
-            if str(core_attr_plus_data_df.loc[r3, attr_name]) in ('nan', 'NaT'):
-                #print('  copy "{}" from previous sample'.format(core_attr_plus_data_df.loc[r1, attr_name]))
-                core_attr_plus_data_df.loc[r3, attr_name] = core_attr_plus_data_df.loc[r1, attr_name]
-            else:
-                pass
+    for bad_sample in bad_samples:
+        for bad_sample_attr in bad_sample.sample_attr_list:
+            db_session.delete(bad_sample_attr)
+        db_session.delete(bad_sample)
 
-    return core_attr_plus_data_df
+    return [sample for sample in sample_list if sample not in bad_samples]
 
 
 def cli():
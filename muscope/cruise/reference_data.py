@@ -0,0 +1,100 @@
+"""
+Lookup tables for the reference rows used by load_attributes.
+
+Investigators, cruises and sample attribute types from the muSCOPE database and stations
+from the station database are read with one query per table when a ReferenceDataCache is
+created. Lookups that miss the tables fall back to a single query so rows added by another
+process are found, and rows inserted by the loader are registered with add_cruise.
+process_muscope_collection creates one ReferenceDataCache for every spreadsheet in a run.
+"""
+import sqlalchemy as sa
+
+import muscope.models as models
+import muscope.cruise.station_db as station_db
+
+
+class ReferenceDataCache:
+    def __init__(self, session, station_session):
+        """
+
+        :param session: SQLAlchemy session for the muSCOPE database
+        :param station_session: SQLAlchemy session for the station database
+        """
+        self.session = session
+        self.station_session = station_session
+
+        self.investigators = dict()
+        for investigator in session.query(models.Investigator).all():
+            self.investigators.setdefault(investigator.last_name, []).append(investigator)
+
+        self.cruises = {
+            cruise.cruise_name: cruise
+            for cruise
+            in session.query(models.Cruise).all()}
+
+        self.sample_attr_types = {
+            sample_attr_type.type_: sample_attr_type
+            for sample_attr_type
+            in session.query(models.Sample_attr_type).all()}
+
+        self.stations = {
+            (station.cruise_name, station.station_number): station
+            for station
+            in station_session.query(station_db.Station).all()}
+
+        print('reference data: {} investigator(s), {} cruise(s), {} sample attribute type(s), {} station(s)'.format(
+            sum(len(i) for i in self.investigators.values()),
+            len(self.cruises),
+            len(self.sample_attr_types),
+            len(self.stations)))
+
+    def find_investigator(self, last_name):
+        """Return the one investigator with last_name like Query.one()."""
+        if last_name not in self.investigators:
+            self.investigators[last_name] = self.session.query(models.Investigator).filter(
+                models.Investigator.last_name == last_name).all()
+
+        investigator_list = self.investigators[last_name]
+        if len(investigator_list) == 0:
+            raise sa.orm.exc.NoResultFound('no investigator with last name "{}"'.format(last_name))
+        elif len(investigator_list) > 1:
+            raise sa.orm.exc.MultipleResultsFound('more than one investigator with last name "{}"'.format(last_name))
+        else:
+            return investigator_list[0]
+
+    def find_cruise(self, cruise_name):
+        """Return the cruise with cruise_name or None."""
+        if cruise_name not in self.cruises:
+            cruise = self.session.query(models.Cruise).filter(
+                models.Cruise.cruise_name == cruise_name).one_or_none()
+            if cruise is None:
+                # do not cache the miss, the cruise may be added later
+                return None
+            else:
+                self.cruises[cruise_name] = cruise
+        return self.cruises[cruise_name]
+
+    def add_cruise(self, cruise):
+        """Register a cruise created by the loader so later rows find it."""
+        self.cruises[cruise.cruise_name] = cruise
+
+    def find_sample_attr_type(self, type_):
+        """Return the sample attribute type with type_ or None."""
+        if type_ not in self.sample_attr_types:
+            sample_attr_type = self.session.query(models.Sample_attr_type).filter(
+                models.Sample_attr_type.type_ == type_).one_or_none()
+            if sample_attr_type is None:
+                return None
+            else:
+                self.sample_attr_types[type_] = sample_attr_type
+        return self.sample_attr_types[type_]
+
+    def find_station(self, cruise_name, station_number):
+        """Return the station like station_db.find_station()."""
+        station_key = (cruise_name, station_number)
+        if station_key not in self.stations:
+            self.stations[station_key] = station_db.find_station(
+                cruise_name=cruise_name,
+                station_number=station_number,
+                session=self.station_session)
+        return self.stations[station_key]
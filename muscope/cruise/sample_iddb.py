@@ -1,3 +1,9 @@
+"""
+A temporary database mapping sample file names to sample names.
+
+The default URI 'sqlite://' keeps the database in memory for one run of the loader.
+Use a SQLite file URI such as 'sqlite:///sample_iddb.sqlite3' to keep it on disk.
+"""
 import os
 import urllib.parse
 
@@ -5,6 +11,8 @@ import sqlalchemy as sa
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, Boolean, Integer, String
 
+import muscope.util.db as db
+
 Base = declarative_base()
 
 
@@ -31,13 +39,13 @@ class SampleFileNameToSampleName(Base):
     sample_name = Column(String)
 
     data_type = Column(String)
-    processed = Column(Boolean)
+    processed = Column(Boolean, index=True)
 
     sa.UniqueConstraint('sample_name', 'sample_file_identifier')
 
 
 def get_engine(db_uri):
-    return sa.create_engine(db_uri, echo=False)
+    return db.get_engine(db_uri)
 
 
 def create_tables(db_uri):
@@ -45,13 +53,18 @@ def create_tables(db_uri):
     Base.metadata.create_all(engine)
 
 
-def build(db_uri):
-    o = urllib.parse.urlparse(db_uri)
-    # remove the leading /
-    db_file_path = o.path[1:]
-    print('sample id db: "{}"'.format(db_file_path))
-    if os.path.exists(db_file_path):
-        os.remove(db_file_path)
+def build(db_uri='sqlite://'):
+    # close pooled connections to the old database, this also discards an in-memory database
+    db.dispose_engine(db_uri)
+    if db.is_in_memory_sqlite(db_uri):
+        print('sample id db: in memory')
+    else:
+        o = urllib.parse.urlparse(db_uri)
+        # remove the leading /
+        db_file_path = o.path[1:]
+        print('sample id db: "{}"'.format(db_file_path))
+        if os.path.exists(db_file_path):
+            os.remove(db_file_path)
     create_tables(db_uri)
 
 
@@ -104,3 +117,60 @@ def find_sample_name_for_sample_file_name(sample_file_name, session):
 def get_unprocessed_sample_files(session):
     return session.query(SampleFileNameToSampleName).filter(
         SampleFileNameToSampleName.processed == False).all()
+
+
+def distinct_sample_file_names(sample_file_names):
+    """Return the sorted distinct sample file names. Values that are not strings, for example NaN from
+    a blank spreadsheet cell, are not sample file names and are left out.
+    """
+    return sorted({n for n in sample_file_names if isinstance(n, str)})
+
+
+def find_sample_names_for_sample_file_names(sample_file_names, session, chunk_size=500):
+    """Return a dict of sample_file_name -> SampleFileNameToSampleName for the names found in the database."""
+    sample_file_names = distinct_sample_file_names(sample_file_names)
+    sample_file_table = dict()
+    for c in range(0, len(sample_file_names), chunk_size):
+        for s in session.query(SampleFileNameToSampleName).filter(
+                SampleFileNameToSampleName.sample_file_name.in_(sample_file_names[c:c+chunk_size])).all():
+            sample_file_table[s.sample_file_name] = s
+    return sample_file_table
+
+
+def mark_sample_files_processed(sample_file_names, session, chunk_size=500):
+    sample_file_names = distinct_sample_file_names(sample_file_names)
+    print('mark {} sample file(s) processed'.format(len(sample_file_names)))
+    for c in range(0, len(sample_file_names), chunk_size):
+        session.query(SampleFileNameToSampleName).filter(
+            SampleFileNameToSampleName.sample_file_name.in_(sample_file_names[c:c+chunk_size])).update(
+                {SampleFileNameToSampleName.processed: True},
+                synchronize_session=False)
+
+
+def upsert_sample_file_names(sample_file_rows, session, chunk_size=500):
+    """Insert (sample_file_name, sample_name, data_type) rows for sample file names that are not
+    in the database yet. Like insert_sample_file_name_and_sample_name the first row for a sample file
+    name is kept. Rows without a sample file name, for example from a blank spreadsheet row, are skipped.
+
+    :return: (int) number of rows inserted
+    """
+    new_rows = dict()
+    for sample_file_name, sample_name, data_type in sample_file_rows:
+        if not isinstance(sample_file_name, str):
+            print('skipping sample file name "{}" for sample "{}"'.format(sample_file_name, sample_name))
+        elif sample_file_name not in new_rows:
+            new_rows[sample_file_name] = {
+                'sample_file_name': sample_file_name,
+                'sample_name': sample_name,
+                'data_type': data_type,
+                'processed': False}
+
+    for existing_sample_file_name in find_sample_names_for_sample_file_names(
+            new_rows.keys(), session=session, chunk_size=chunk_size):
+        del new_rows[existing_sample_file_name]
+
+    insert_rows = list(new_rows.values())
+    for c in range(0, len(insert_rows), chunk_size):
+        session.execute(SampleFileNameToSampleName.__table__.insert(), insert_rows[c:c+chunk_size])
+    print('inserted {} sample file name(s)'.format(len(insert_rows)))
+    return len(insert_rows)
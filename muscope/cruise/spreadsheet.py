@@ -0,0 +1,533 @@
+"""
+Helpers for normalizing muSCOPE attribute spreadsheets.
+
+Many attribute spreadsheets list each sample on a fixed number of rows, for example
+one row for the R1 file and one row for the R2 file, and leave cells empty when the
+value is the same as the previous sample. The functions here fill those cells with
+whole-column operations.
+
+Each family of attribute spreadsheets has a SpreadsheetRules object listing the
+operations that normalize it, for example renaming columns or filling empty cells.
+Add a new spreadsheet version by adding its rules to attribute_spreadsheet_rules.
+"""
+import datetime
+import re
+
+import numpy as np
+import pandas as pd
+
+
+def fill_from_previous_sample(df, stride, offset=0, lag=None, exclude_columns=()):
+    """Fill empty (NaN, NaT, None) cells in rows offset, offset + stride, offset + 2*stride, ...
+    with the value in the same column lag rows above. The DataFrame is modified in place.
+
+    When lag is stride (the default) a filled value can be copied again to the next
+    sample, just as if the rows were filled one at a time from the top:
+
+        fill_from_previous_sample(df, stride=2)
+
+    fills empty cells in rows 2, 4, 6, ... from rows 0, 2, 4, ...
+
+    When lag is less than stride each row is filled from a row in its own group:
+
+        fill_from_previous_sample(df, stride=4, offset=2, lag=2)
+
+    fills empty cells in rows 2, 6, 10, ... from rows 0, 4, 8, ...
+
+    Rows are selected by position. The DataFrame index must be unique.
+
+    :param df: pandas.DataFrame
+    :param stride: (int) number of rows per sample
+    :param offset: (int) position of the first row to fill
+    :param lag: (int) distance from each row to the row it is filled from, the default is stride
+    :param exclude_columns: do not fill these columns
+    :return: df
+    """
+    lag = stride if lag is None else lag
+    if lag > stride:
+        raise ValueError('lag {} is greater than stride {}'.format(lag, stride))
+
+    columns = [c for c in df.columns if c not in exclude_columns]
+    target_positions = np.arange(offset, len(df), stride)
+
+    if lag == stride:
+        # forward fill down the rows offset, offset + stride, ...
+        target_df = df.iloc[target_positions][columns]
+        filled_df = target_df.ffill()
+    else:
+        target_positions = target_positions[target_positions >= lag]
+        target_df = df.iloc[target_positions][columns]
+        source_df = df.iloc[target_positions - lag][columns]
+        source_df.index = target_df.index
+        filled_df = target_df.where(target_df.notna(), source_df)
+
+    # only write the cells that change
+    changed = target_df.isna() & filled_df.notna()
+    for column in changed.columns[changed.any(axis=0).values]:
+        changed_index = changed.index[changed[column].values]
+        df.loc[changed_index, column] = filled_df.loc[changed_index, column]
+
+    return df
+
+
+def parse_attributes(spreadsheet_fp):
+    core_attr_plus_data_df = pd.read_excel(
+        spreadsheet_fp,
+        sheet_name='core attributes + data',
+        skiprows=(0, 2)
+    )
+    core_attr_plus_data_df.rename(columns={'depth_sample': 'depth'}, inplace=True)
+
+    return core_attr_plus_data_df
+
+
+def set_values(df, index, column, values):
+    """Assign values to df.loc[index, column] changing the column to dtype object if the values do not fit."""
+    try:
+        df.loc[index, column] = values
+    except (TypeError, ValueError):
+        df[column] = df[column].astype(object)
+        df.loc[index, column] = values
+
+
+class SpreadsheetOperation:
+    """One normalization step applied to a parsed attribute spreadsheet.
+
+    Operations that take a rows argument apply only to those rows, given either as
+    a slice such as slice(0, None, 2) for every other row starting with the first
+    or as a list of row positions. The default is all rows.
+    """
+    def __init__(self, rows=None):
+        self.rows = slice(None) if rows is None else rows
+
+    def __repr__(self):
+        return '{}({})'.format(
+            self.__class__.__name__,
+            ', '.join('{}={!r}'.format(k, v) for k, v in sorted(vars(self).items())))
+
+    def selected_index(self, df):
+        return df.index[self.rows]
+
+    def apply(self, df):
+        raise NotImplementedError()
+
+
+class RenameColumns(SpreadsheetOperation):
+    """Rename columns. A key can be a column name or a column position."""
+    def __init__(self, columns):
+        super().__init__()
+        self.columns = columns
+
+    def apply(self, df):
+        return df.rename(
+            columns={
+                (df.columns[k] if isinstance(k, int) else k): v
+                for k, v
+                in self.columns.items()})
+
+
+class HeadRows(SpreadsheetOperation):
+    """Keep only the first row_count rows."""
+    def __init__(self, row_count):
+        super().__init__()
+        self.row_count = row_count
+
+    def apply(self, df):
+        return df.iloc[:self.row_count, :].copy()
+
+
+class SetValue(SpreadsheetOperation):
+    """Set every selected cell of a column to one value. The column is created if necessary."""
+    def __init__(self, column, value, rows=None):
+        super().__init__(rows)
+        self.column = column
+        self.value = value
+
+    def apply(self, df):
+        if self.column not in df.columns or self.rows == slice(None):
+            df[self.column] = [self.value] * len(df)
+        else:
+            set_values(df, self.selected_index(df), self.column, self.value)
+        return df
+
+
+class ReplaceValues(SpreadsheetOperation):
+    """Replace values in a column, for example 'net tow' with 0.
+
+    If strict is True every selected cell must hold one of the values to be replaced.
+    """
+    def __init__(self, column, replacements, rows=None, strict=False):
+        super().__init__(rows)
+        self.column = column
+        self.replacements = replacements
+        self.strict = strict
+
+    def apply(self, df):
+        index = self.selected_index(df)
+        values = df.loc[index, self.column]
+        if self.strict:
+            unexpected = values[~values.isin(list(self.replacements)).values]
+            if len(unexpected) > 0:
+                raise ValueError('unexpected values in column "{}":\n{}'.format(self.column, unexpected))
+        for old_value, new_value in self.replacements.items():
+            set_values(df, index[(values == old_value).values], self.column, new_value)
+        return df
+
+
+class FillMissing(SpreadsheetOperation):
+    """Put a value in the empty cells of a column."""
+    def __init__(self, column, value, rows=None):
+        super().__init__(rows)
+        self.column = column
+        self.value = value
+
+    def apply(self, df):
+        index = self.selected_index(df)
+        set_values(df, index[df.loc[index, self.column].isna().values], self.column, self.value)
+        return df
+
+
+class PrefixColumn(SpreadsheetOperation):
+    """Put a prefix on every value in a column, for example 'HOT' on a cruise number.
+
+    If as_int is True the values are converted to integers first so 273.0 becomes 'HOT273'.
+    """
+    def __init__(self, column, prefix, rows=None, as_int=False):
+        super().__init__(rows)
+        self.column = column
+        self.prefix = prefix
+        self.as_int = as_int
+
+    def apply(self, df):
+        index = self.selected_index(df)
+        values = df.loc[index, self.column]
+        if self.as_int:
+            values = values.astype(float).astype(int)
+        set_values(df, index, self.column, (self.prefix + values.astype(str)).values)
+        return df
+
+
+class AppendSuffix(SpreadsheetOperation):
+    """Append a suffix to the values in a column that end with a given string, for example
+    '.gz' to file names ending with '.fastq'.
+    """
+    def __init__(self, column, ends_with, suffix, rows=None):
+        super().__init__(rows)
+        self.column = column
+        self.ends_with = ends_with
+        self.suffix = suffix
+
+    def apply(self, df):
+        index = self.selected_index(df)
+        values = df.loc[index, self.column]
+        matched = values.astype(str).str.endswith(self.ends_with).values
+        set_values(df, index[matched], self.column, (values[matched] + self.suffix).values)
+        return df
+
+
+class RemoveSuffix(SpreadsheetOperation):
+    """Remove a suffix from the values in a column that end with it."""
+    def __init__(self, column, suffix, rows=None):
+        super().__init__(rows)
+        self.column = column
+        self.suffix = suffix
+
+    def apply(self, df):
+        index = self.selected_index(df)
+        values = df.loc[index, self.column]
+        matched = values.astype(str).str.endswith(self.suffix).values
+        set_values(df, index[matched], self.column, values[matched].str[:-len(self.suffix)].values)
+        return df
+
+
+class StripPrefix(SpreadsheetOperation):
+    """Convert text such as 'S47' or 'C1' to a number by removing the first character.
+    Values that are already numbers are not changed.
+    """
+    def __init__(self, column):
+        super().__init__()
+        self.column = column
+
+    def apply(self, df):
+        values = df[self.column]
+        if values.dtype.kind != 'f':
+            text = values.where(values.map(lambda v: isinstance(v, str)))
+            df[self.column] = pd.to_numeric(text.str[1:]).fillna(pd.to_numeric(values, errors='coerce'))
+        return df
+
+
+class ParseTime(SpreadsheetOperation):
+    """Convert values such as '12:45:00', '12:45' and '1245' to datetime.time."""
+    time_re = re.compile(r'^(?P<hour>\d{1,2}):?(?P<minute>\d{1,2})(:(?P<second>)\d{1,2})?$')
+
+    def __init__(self, column, rows=None):
+        super().__init__(rows)
+        self.column = column
+
+    def apply(self, df):
+        index = self.selected_index(df)
+        time_parts = df.loc[index, self.column].astype(str).str.extract(self.time_re)
+        unparsed = time_parts.hour.isna()
+        if unparsed.any():
+            raise ValueError('failed to parse times in column "{}":\n{}'.format(
+                self.column, df.loc[index[unparsed.values], self.column]))
+        set_values(
+            df,
+            index,
+            self.column,
+            [
+                datetime.time(hour=hour, minute=minute)
+                for hour, minute
+                in zip(time_parts.hour.astype(int), time_parts.minute.astype(int))])
+        return df
+
+
+class TimeFromDate(SpreadsheetOperation):
+    """Copy the time of day from a datetime column to a time column."""
+    def __init__(self, date_column, time_column, rows=None):
+        super().__init__(rows)
+        self.date_column = date_column
+        self.time_column = time_column
+
+    def apply(self, df):
+        index = self.selected_index(df)
+        set_values(df, index, self.time_column, list(pd.to_datetime(df.loc[index, self.date_column]).dt.time))
+        return df
+
+
+class DegreeMinuteToDecimal(SpreadsheetOperation):
+    """Convert text such as '22 45.0' (degrees and decimal minutes) to decimal degrees
+    degree_sign * degrees + minutes / 60.
+    """
+    def __init__(self, column, rows=None, degree_sign=1.0):
+        super().__init__(rows)
+        self.column = column
+        self.degree_sign = degree_sign
+
+    def apply(self, df):
+        index = self.selected_index(df)
+        degree_minute = df.loc[index, self.column].str.split(expand=True)
+        if degree_minute.shape[1] != 2 or degree_minute.isna().any(axis=None):
+            raise ValueError('failed to parse degrees and minutes in column "{}":\n{}'.format(
+                self.column, df.loc[index, self.column]))
+        decimal_degrees = \
+            self.degree_sign * pd.to_numeric(degree_minute[0]) + pd.to_numeric(degree_minute[1]) / 60
+        set_values(df, index, self.column, decimal_degrees.values)
+        return df
+
+
+class FillFromPreviousSample(SpreadsheetOperation):
+    """Fill empty cells from a previous row with fill_from_previous_sample."""
+    def __init__(self, stride, offset=0, lag=None, exclude_columns=()):
+        super().__init__()
+        self.stride = stride
+        self.offset = offset
+        self.lag = lag
+        self.exclude_columns = exclude_columns
+
+    def apply(self, df):
+        return fill_from_previous_sample(
+            df,
+            stride=self.stride,
+            offset=self.offset,
+            lag=self.lag,
+            exclude_columns=self.exclude_columns)
+
+
+class SpreadsheetRules:
+    """The file name pattern and normalization operations for one family of attribute spreadsheets."""
+    def __init__(self, family, file_name_pattern, operations=()):
+        """
+
+        :param family: (str) a unique name for the spreadsheet family
+        :param file_name_pattern: (str) regular expression matching the entire file name,
+                                  it must not have named groups
+        :param operations: sequence of SpreadsheetOperation applied in order after parse_attributes
+        """
+        self.family = family
+        self.file_name_pattern = file_name_pattern
+        self.operations = tuple(operations)
+
+    def __repr__(self):
+        return 'SpreadsheetRules(family={!r}, file_name_pattern={!r}, operations={!r})'.format(
+            self.family, self.file_name_pattern, self.operations)
+
+    def dependencies(self):
+        """Return the rules and the code they run so muscope.util.parse_cache can tell when they change."""
+        return (self, SpreadsheetRules.normalize, SpreadsheetOperation, parse_attributes, fill_from_previous_sample,
+                set_values) \
+            + tuple(sorted({type(o) for o in self.operations}, key=lambda t: t.__name__))
+
+    def normalize(self, core_attr_plus_data_df):
+        for operation in self.operations:
+            core_attr_plus_data_df = operation.apply(core_attr_plus_data_df)
+        return core_attr_plus_data_df
+
+    def parse(self, spreadsheet_fp):
+        return self.normalize(parse_attributes(spreadsheet_fp))
+
+
+class SpreadsheetRuleRegistry:
+    """Find the rules for a spreadsheet file name with one precompiled regular expression."""
+    def __init__(self, rules_list):
+        self.rules = {rules.family: rules for rules in rules_list}
+        self.rules_for_group = {'rules_{}'.format(i): rules for i, rules in enumerate(rules_list)}
+        self.file_name_re = re.compile('|'.join(
+            '(?P<{}>{})'.format(group, rules.file_name_pattern)
+            for group, rules
+            in self.rules_for_group.items()))
+
+    def find(self, file_name):
+        """Return the SpreadsheetRules for file_name or None."""
+        file_name_match = self.file_name_re.fullmatch(file_name)
+        if file_name_match is None:
+            return None
+        else:
+            return self.rules_for_group[file_name_match.lastgroup]
+
+
+every_other_row = slice(0, None, 2)
+first_of_4_rows = slice(0, None, 4)
+third_of_4_rows = slice(2, None, 4)
+
+attribute_spreadsheet_rules = SpreadsheetRuleRegistry([
+    SpreadsheetRules(
+        'Armbrust_HL2A_EukTxnDiel_seq_attrib',
+        r'Armbrust_HL2A_EukTxnDiel_seq_attrib\.xls'),
+    SpreadsheetRules(
+        'Caron_HL2A_18Sdiel_seq_attrib_v2',
+        r'Caron_HL2A_18Sdiel_seq_attrib_v2\.xls',
+        [
+            # column 10 header is on the wrong line
+            RenameColumns({9: 'seq_name'}),
+            # entries in the 'station' column look like 'S47' but we want just the number
+            StripPrefix('station'),
+            # entries in the 'cast' column look like 'C1' but we want just the number
+            StripPrefix('cast_num'),
+        ]),
+    SpreadsheetRules(
+        'Caron_HL2A_VertProf_seq_attrib_v3',
+        r'Caron_HL2A_VertProf_seq_attrib_v3\.xls',
+        [
+            FillFromPreviousSample(stride=2),
+        ]),
+    SpreadsheetRules(
+        'Caron_HL3_VertProf_seq_attrib_v3',
+        r'Caron_HL3_VertProf_seq_attrib_v3\.xls',
+        [
+            FillFromPreviousSample(stride=2),
+        ]),
+    SpreadsheetRules(
+        'Caron_HOT273_18Ssizefrac_seq_assoc_data_v2',
+        r'Caron_HOT273_18Ssizefrac_seq_assoc_data_v2\.xls',
+        [
+            # the cruise name column is just '273'
+            PrefixColumn('cruise_name', 'HOT'),
+            # the spreadsheet does not have collection_time
+            SetValue('collection_time', datetime.time(hour=0, minute=0, second=0)),
+        ]),
+    SpreadsheetRules(
+        'Caron_HOTquarterly_18Sv4_seq_assoc_data_v2',
+        r'Caron_HOTquarterly_18Sv4_seq_assoc_data_v2\.xls',
+        [
+            PrefixColumn('cruise_name', 'HOT'),
+        ]),
+    SpreadsheetRules(
+        'Chisholm_HOT.BATS_seq_attrib',
+        r'Chisholm_HOT\.BATS_seq_attrib\.xls',
+        [
+            # this spreadsheet is missing the 'seq_name' column header
+            RenameColumns({'Unnamed: 9': 'seq_name'}),
+            # cut off the BATS cruises
+            HeadRows(132),
+        ]),
+    SpreadsheetRules(
+        'Chisholm_HOT263.283_Vesicle_seq_attrib_v2',
+        r'Chisholm_HOT263\.283_Vesicle_seq_attrib_v2\.xls'),
+    SpreadsheetRules(
+        'Church_HOT201-222_Tricho16S_seq_assoc_v2',
+        r'Church_HOT201[-_]222_Tricho16S_seq_assoc_v2\.xls',
+        [
+            # only the first row of each sample is adjusted
+            ReplaceValues('cast_num', {'net tow': 0}, rows=every_other_row),
+            PrefixColumn('cruise_name', 'HOT', rows=every_other_row, as_int=True),
+            # use 999 for missing sample depth and change it to null with the admin console
+            FillMissing('depth', 999, rows=every_other_row),
+            TimeFromDate('collection_date', 'collection_time', rows=[0]),
+            # do not copy over missing values in the depth column
+            FillFromPreviousSample(stride=2, exclude_columns=('depth', )),
+        ]),
+    SpreadsheetRules(
+        'DeLong_HL2A_DNAdiel_seq_assoc_data_v3',
+        r'DeLong_HL2A_DNAdiel_seq_assoc_data_v3\.xls'),
+    SpreadsheetRules(
+        'DeLong_HL2A_0.2frac_diel_seq_assoc_data_v3',
+        r'DeLong_HL2A_0\.2frac_diel_seq_assoc_data_v3\.xls'),
+    SpreadsheetRules(
+        'DeLong_HL2A_RNAdiel_seq_assoc_data_v3',
+        r'DeLong_HL2A_RNAdiel_seq_assoc_data_v3\.xls'),
+    SpreadsheetRules(
+        'Dyhrman_HL4_incubation_seq_assoc_data_v5',
+        r'Dyhrman_HL4_incubation_seq_assoc_data_v5\.xls',
+        [
+            # 2 related samples appear in groups of 4 rows
+            ReplaceValues('data_type', {'mRNA reads': 'mRNA Reads'}, rows=first_of_4_rows, strict=True),
+            ReplaceValues('data_type', {'total RNA reads': 'Total RNA Reads'}, rows=third_of_4_rows, strict=True),
+            AppendSuffix('seq_name', '.fastq', '.gz'),
+            FillFromPreviousSample(stride=4, offset=2, lag=2),
+        ]),
+    SpreadsheetRules(
+        'Dyhrman_HL2A_incubation_seq_assoc_data_v5',
+        r'Dyhrman_HL2A_incubation_seq_assoc_data_v5\.xls',
+        [
+            RemoveSuffix('sample_name', '.fastq.tar', rows=every_other_row),
+            AppendSuffix('seq_name', '.fastq', '.gz'),
+            FillFromPreviousSample(stride=2),
+        ]),
+    SpreadsheetRules(
+        'Dyhrman_HL2A_RNAdiel_seq_assoc_data_v5',
+        r'Dyhrman_HL2A_RNAdiel_seq_assoc_data_v5\.xls',
+        [
+            RemoveSuffix('sample_name', '.fastq.tar', rows=first_of_4_rows),
+            ReplaceValues('data_type', {'mRNA reads': 'mRNA Reads'}, rows=first_of_4_rows, strict=True),
+            ReplaceValues('data_type', {'total RNA reads': 'Total RNA Reads'}, rows=third_of_4_rows, strict=True),
+            AppendSuffix('seq_name', '.fastq', '.gz'),
+            FillFromPreviousSample(stride=4, offset=2, lag=2),
+        ]),
+    SpreadsheetRules(
+        'Dyhrman_HL2A_Tricho_seq_attrib_v2',
+        r'Dyhrman_HL2A_Tricho_seq_attrib_v2\.xls',
+        [
+            SetValue('station', 0),
+            SetValue('cast_num', 0),
+            AppendSuffix('seq_name', '.fastq', '.gz'),
+            ReplaceValues('data_type', {'reads': 'Reads'}, strict=True),
+            FillFromPreviousSample(stride=2),
+            # the longitude conversion matches the values already in the database
+            DegreeMinuteToDecimal('latitude', rows=every_other_row),
+            DegreeMinuteToDecimal('longitude', rows=every_other_row, degree_sign=-1.0),
+            # these start out empty but get filled in by FillFromPreviousSample
+            SetValue('latitude', None, rows=[12, 14]),
+            SetValue('longitude', None, rows=[12, 14]),
+        ]),
+    SpreadsheetRules(
+        'Dyhrman_MS_incubation_assoc_data_v5',
+        r'Dyhrman_MS_incubation_assoc_data_v5\.xls',
+        [
+            SetValue('cruise_name', 'MESO-SCOPE', rows=first_of_4_rows),
+            ReplaceValues('data_type', {'mRNA reads': 'mRNA Reads'}, rows=first_of_4_rows, strict=True),
+            ReplaceValues('data_type', {'total RNA reads': 'Total RNA Reads'}, rows=third_of_4_rows, strict=True),
+            # the first 3 collection times are datetime objects, the remaining collection times are strings like "1205"
+            ParseTime('collection_time', rows=first_of_4_rows),
+            FillFromPreviousSample(stride=4, offset=2, lag=2),
+        ]),
+])
+
+
+def find_attribute_spreadsheet_rules(file_name):
+    return attribute_spreadsheet_rules.find(file_name)
+
+
+def parse_attribute_spreadsheet(spreadsheet_fp, family):
+    """Parse an attribute spreadsheet and apply the rules for its family."""
+    return attribute_spreadsheet_rules.rules[family].parse(spreadsheet_fp)
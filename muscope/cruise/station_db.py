@@ -7,12 +7,12 @@ import sqlalchemy as sa
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, Integer, Float, String
 
-from irods.keywords import FORCE_FLAG_KW
-from irods.session import iRODSSession
+import muscope.util.db as db
+import muscope.util.download_cache as download_cache
+import muscope.util.irods as irods
+import muscope.util.parse_cache as parse_cache
 
-import muscope
-
-from orminator import session_manager_from_db_uri
+from muscope.util.db import session_manager_from_db_uri
 
 
 Base = declarative_base()
@@ -28,11 +28,63 @@ class Station(Base):
     latitude = Column(Float)
     longitude = Column(Float)
 
+    # path of the spreadsheet this station came from
+    source_path = Column(String, index=True)
+
     sa.UniqueConstraint('cruise_name', 'station_number')
 
 
+# the spreadsheets that have been loaded
+class StationSource(Base):
+    __tablename__ = 'station_source'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    path = Column(String, unique=True)
+    # muscope.util.download_cache.cache_key() of the spreadsheet
+    source_key = Column(String)
+
+
+# every station found in every spreadsheet, table station has one of these for each station
+class SourceStation(Base):
+    __tablename__ = 'source_station'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    source_id = Column(Integer, sa.ForeignKey('station_source.id'), index=True)
+    cruise_name = Column(String)
+    station_number = Column(Integer)
+    latitude = Column(Float)
+    longitude = Column(Float)
+
+    __table_args__ = (sa.Index('ix_source_station_key', 'cruise_name', 'station_number'), )
+
+
+# increment SCHEMA_VERSION when the tables change so old station databases are rebuilt
+SCHEMA_VERSION = 2
+
+
+class StationDbInfo(Base):
+    __tablename__ = 'station_db_info'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    schema_version = Column(Integer)
+
+
+# (cruise_name, station_number, latitude, longitude)
+fixed_stations = (
+    # station 0
+    ('No name', 0, 0, 0),
+    # temporarily insert some HOT cruise stations for Church HOT 201-222 (???)
+    ('HOT233', 2, 22.45, -158.0),
+    ('HOT234', 2, 22.45, -158.0),
+    ('HOT267', 2, 22.45, -158.0),
+)
+
+
 def get_engine(db_uri):
-    return sa.create_engine(db_uri, echo=False)
+    return db.get_engine(db_uri)
 
 
 def create_db(db_uri):
@@ -55,79 +107,213 @@ def find_station(cruise_name, station_number, session):
         Station.station_number == station_number).one()
 
 
-def build(db_uri):
+def parse_watercolumn_spreadsheet(spreadsheet_fp, skiprows):
+    return pd.read_excel(
+        spreadsheet_fp,
+        skiprows=skiprows)
+
+
+def extract_stations(watercolumn_df):
+    """Return a pandas.DataFrame with one row for each (cruise_name, station_number) in a water column
+    spreadsheet. The first bottle row for each station gives its latitude and longitude.
+    """
+    stations_df = pd.DataFrame({
+        # the MESO-SCOPE cruise is called 'MS' in the spreadsheets
+        # but we want to call it 'MESO-SCOPE' in the database
+        'cruise_name': watercolumn_df.iloc[:, 0].replace({'MS': 'MESO-SCOPE'}),
+        'station_number': watercolumn_df.station.astype(int),
+        'latitude': watercolumn_df.latitude.astype(float),
+        # the spreadsheets have degrees west
+        'longitude': -1.0 * watercolumn_df.longitude.astype(float)})
+
+    return stations_df.drop_duplicates(subset=['cruise_name', 'station_number']).reset_index(drop=True)
+
+
+def get_schema_version(db_uri):
+    """Return the schema version recorded in the station database or None."""
+    if StationDbInfo.__tablename__ not in sa.inspect(get_engine(db_uri)).get_table_names():
+        return None
+    with session_manager_from_db_uri(db_uri) as db_session:
+        station_db_info = db_session.query(StationDbInfo).one_or_none()
+        return None if station_db_info is None else station_db_info.schema_version
+
+
+def build(db_uri, rebuild=False):
+    """
+    Bring the station database up to date with the water column spreadsheets in /iplant/home/scope/data/core.
+    Only spreadsheets that are new or have changed since the last build are downloaded and parsed.
+    See update_station_sources for how stations are updated.
+
+    Use rebuild=True to start over.
+
+    :param db_uri: (str) SQLite database URI
+    :param rebuild: (bool) delete the database and load every spreadsheet if True
+    """
     o = urllib.parse.urlparse(db_uri)
     # remove the leading /
     db_file_path = o.path[1:]
     print('station db: "{}"'.format(db_file_path))
-    if os.path.exists(db_file_path):
-        os.remove(db_file_path)
+
+    if rebuild or get_schema_version(db_uri) != SCHEMA_VERSION:
+        print('creating a new station db')
+        # close pooled connections to the old file
+        db.dispose_engine(db_uri)
+        if os.path.exists(db_file_path):
+            os.remove(db_file_path)
 
     create_db(db_uri)
 
     with session_manager_from_db_uri(db_uri) as db_session:
-        # insert station 0
-        insert_station(cruise_name='No name', station_number=0, latitude=0, longitude=0, session=db_session)
-
-        # temporarily insert some HOT cruise stations for Church HOT 201-222 (???)
-        insert_station(cruise_name='HOT233', station_number=2, latitude=22.45, longitude=-158.0, session=db_session)
-        insert_station(cruise_name='HOT234', station_number=2, latitude=22.45, longitude=-158.0, session=db_session)
-        insert_station(cruise_name='HOT267', station_number=2, latitude=22.45, longitude=-158.0, session=db_session)
-
-        with iRODSSession(irods_env_file=os.path.expanduser('~/.irods/irods_environment.json')) as irods_session:
+        if db_session.query(StationDbInfo).one_or_none() is None:
+            db_session.add(StationDbInfo(schema_version=SCHEMA_VERSION))
+
+        # these stations do not come from a spreadsheet
+        for cruise_name, station_number, latitude, longitude in fixed_stations:
+            station_query_result = db_session.query(Station).filter(
+                Station.cruise_name == cruise_name,
+                Station.station_number == station_number).one_or_none()
+            if station_query_result is None:
+                insert_station(
+                    cruise_name=cruise_name,
+                    station_number=station_number,
+                    latitude=latitude,
+                    longitude=longitude,
+                    session=db_session)
+
+        with irods.irods_session_manager() as irods_session:
             scope_data_core_collection = irods_session.collections.get('/iplant/home/scope/data/core')
             print('loading station and cast data into "{}"'.format(db_uri))
-            for data_object in scope_data_core_collection.data_objects:
-                print('\t{}'.format(data_object.path))
-
-                downloads_dp = os.path.join(
-                    os.path.dirname(muscope.__file__),
-                    'downloads')
 
-                if not os.path.exists(downloads_dp):
-                    os.mkdir(downloads_dp)
+            station_sources = {
+                station_source.path: station_source
+                for station_source
+                in db_session.query(StationSource).all()}
+            changed_data_objects = []
+            removed_source_paths = []
+            for data_object in scope_data_core_collection.data_objects:
+                station_source = station_sources.pop(data_object.path, None)
+                if station_source is None:
+                    print('\tnew spreadsheet "{}"'.format(data_object.path))
+                    changed_data_objects.append(data_object)
+                elif station_source.source_key != download_cache.cache_key(data_object):
+                    print('\tchanged spreadsheet "{}"'.format(data_object.path))
+                    removed_source_paths.append(data_object.path)
+                    changed_data_objects.append(data_object)
+                else:
+                    print('\tunchanged spreadsheet "{}"'.format(data_object.path))
 
-                # get the file
-                local_file_fp = os.path.join(
-                    downloads_dp,
-                    data_object.name)
+            # spreadsheets that are no longer in the collection
+            for removed_station_source in station_sources.values():
+                print('\tremoved spreadsheet "{}"'.format(removed_station_source.path))
+                removed_source_paths.append(removed_station_source.path)
 
-                irods_session.data_objects.get(
-                    data_object.path,
-                    local_file_fp,
-                    **{FORCE_FLAG_KW: True})
+            new_sources = []
+            for data_object in changed_data_objects:
+                print('\t{}'.format(data_object.path))
 
                 # MS_watercolumn.xlsx is a little different from the others
-                if os.path.basename(local_file_fp).startswith('MS_'):
+                if data_object.name.startswith('MS_'):
                     ##print('why it is "{}"'.format(local_file_fp))
                     skiprows = (1, )
                 else:
                     skiprows = (0, 2)
 
-                watercolumn_df = pd.read_excel(
-                    local_file_fp,
-                    skiprows=skiprows)
-
-                for r, row in watercolumn_df.iterrows():
-
-                    # the MESO-SCOPE cruise is called 'MS' in the spreadsheets
-                    # but we want to call it 'MESO-SCOPE' in the database
-                    cruise_name = row[0]
-                    if cruise_name == 'MS':
-                        cruise_name = 'MESO-SCOPE'
-
-                    station_query_result = db_session.query(Station).filter(
-                        Station.cruise_name == cruise_name,
-                        Station.station_number == row.station).one_or_none()
-                    if station_query_result is None:
-                        s = Station(
-                            cruise_name=cruise_name,
-                            station_number=int(row.station),
-                            latitude=row.latitude,
-                            longitude=(-1.0 * row.longitude))
-                        db_session.add(s)
+                # get the file unless an unchanged copy has been downloaded already
+                with download_cache.get_download_cache().local_file(irods_session, data_object) as local_file_fp:
+                    watercolumn_df = parse_cache.get_parse_cache().parse(
+                        parse_watercolumn_spreadsheet,
+                        local_file_fp,
+                        source_key=download_cache.cache_key(data_object),
+                        source_path=data_object.path,
+                        skiprows=skiprows)
+
+                stations_df = extract_stations(watercolumn_df)
+                print('\t  found {} station(s) in {} row(s)'.format(len(stations_df), len(watercolumn_df)))
+                new_sources.append((data_object.path, download_cache.cache_key(data_object), stations_df))
+
+            update_station_sources(new_sources, removed_source_paths, db_session)
 
     with session_manager_from_db_uri(db_uri) as db_session:
-        print('inserted {} stations'.format(db_session.query(Station).count()))
+        print('station db has {} stations'.format(db_session.query(Station).count()))
         #for station in db_session.query(Station).all():
         #    print('cruise "{0.cruise_name}" station {0.station_number} lat/long {0.latitude}/{0.longitude}'.format(station))
+
+
+def station_key_filter(mapped_class, station_keys):
+    """Return a filter for rows of mapped_class with (cruise_name, station_number) in station_keys."""
+    station_numbers_by_cruise = dict()
+    for cruise_name, station_number in station_keys:
+        station_numbers_by_cruise.setdefault(cruise_name, set()).add(station_number)
+    return sa.or_(*[
+        sa.and_(
+            mapped_class.cruise_name == cruise_name,
+            mapped_class.station_number.in_(sorted(station_numbers)))
+        for cruise_name, station_numbers
+        in sorted(station_numbers_by_cruise.items())])
+
+
+def update_station_sources(new_sources, removed_source_paths, db_session):
+    """
+    Remove the stations of spreadsheets that changed or disappeared and add the stations of new or changed
+    spreadsheets. Every station found in every spreadsheet is kept in table source_station. Table station
+    has one row for each (cruise_name, station_number) taken from the spreadsheet with the first path that
+    has it, so a station shared by two spreadsheets stays when one of them changes or is removed, and an
+    incremental update gives the same stations as a rebuild. The fixed stations are never replaced.
+
+    :param new_sources: list of (spreadsheet path, source key, stations_df from extract_stations)
+    :param removed_source_paths: list of spreadsheet paths to remove, a changed spreadsheet is removed
+                                 and then added again
+    :param db_session: station database session
+    """
+    affected_station_keys = set()
+
+    for removed_source_path in removed_source_paths:
+        station_source = db_session.query(StationSource).filter(
+            StationSource.path == removed_source_path).one_or_none()
+        if station_source is not None:
+            affected_station_keys.update(
+                db_session.query(SourceStation.cruise_name, SourceStation.station_number).filter(
+                    SourceStation.source_id == station_source.id).all())
+            removed_station_count = db_session.query(SourceStation).filter(
+                SourceStation.source_id == station_source.id).delete(synchronize_session=False)
+            print('\t  removed {} station(s) from "{}"'.format(removed_station_count, removed_source_path))
+            db_session.delete(station_source)
+    db_session.flush()
+
+    for source_path, source_key, stations_df in new_sources:
+        station_source = StationSource(path=source_path, source_key=source_key)
+        db_session.add(station_source)
+        db_session.flush()
+        source_stations_df = stations_df[['cruise_name', 'station_number', 'latitude', 'longitude']].copy()
+        source_stations_df['source_id'] = station_source.id
+        if len(source_stations_df) > 0:
+            db_session.execute(
+                SourceStation.__table__.insert(),
+                source_stations_df.astype(object).to_dict('records'))
+        affected_station_keys.update(zip(stations_df.cruise_name, stations_df.station_number))
+
+    # the fixed stations are not replaced by stations from spreadsheets
+    affected_station_keys -= {(cruise_name, station_number) for cruise_name, station_number, _, _ in fixed_stations}
+    affected_station_keys = {(cruise_name, int(station_number)) for cruise_name, station_number in affected_station_keys}
+    if len(affected_station_keys) == 0:
+        return
+
+    # rebuild the station rows for every affected station from the remaining sources
+    db_session.query(Station).filter(
+        station_key_filter(Station, affected_station_keys)).delete(synchronize_session=False)
+    station_rows = dict()
+    for source_station, source_path in db_session.query(SourceStation, StationSource.path).join(
+            StationSource, SourceStation.source_id == StationSource.id).filter(
+                station_key_filter(SourceStation, affected_station_keys)).order_by(StationSource.path):
+        station_key = (source_station.cruise_name, source_station.station_number)
+        if station_key not in station_rows:
+            station_rows[station_key] = {
+                'cruise_name': source_station.cruise_name,
+                'station_number': source_station.station_number,
+                'latitude': source_station.latitude,
+                'longitude': source_station.longitude,
+                'source_path': source_path}
+    if len(station_rows) > 0:
+        db_session.execute(Station.__table__.insert(), list(station_rows.values()))
+    print('\t  updated {} station(s), {} no longer in any spreadsheet'.format(
+        len(station_rows), len(affected_station_keys) - len(station_rows)))
@@ -0,0 +1,180 @@
+"""
+Nearest-station lookup for arrays of coordinates.
+
+StationIndex holds station (or sample) positions as unit vectors on the sphere so the
+nearest station to a point is the one with the largest dot product. Queries are answered
+for whole arrays of points at once, a chunk of points at a time so the scratch arrays never
+have more than max_chunk_elements (points x entries) elements, optionally limited to a
+maximum distance, a time window and the same cruise. Time windows need an index with times,
+such as one built with StationIndex.from_samples. The station database has no times so an
+index built with StationIndex.from_station_db can not be used with max_time_delta.
+
+For example, to find the station within 5km of each net tow sample:
+
+    station_index = StationIndex.from_station_db(station_db_uri)
+    nearest_df = station_index.nearest(latitudes, longitudes, max_distance_km=5.0)
+"""
+import numpy as np
+import pandas as pd
+
+import muscope.cruise.station_db as station_db
+from muscope.util.db import session_manager_from_db_uri
+
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def unit_vectors(latitudes, longitudes):
+    """Return an (n, 3) array of unit vectors for latitudes and longitudes in decimal degrees."""
+    latitudes = np.radians(np.asarray(latitudes, dtype=float))
+    longitudes = np.radians(np.asarray(longitudes, dtype=float))
+    return np.column_stack((
+        np.cos(latitudes) * np.cos(longitudes),
+        np.cos(latitudes) * np.sin(longitudes),
+        np.sin(latitudes)))
+
+
+def to_seconds(times):
+    """Convert datetimes to float seconds, missing times become NaN."""
+    seconds = pd.to_datetime(pd.Series(times)).astype('datetime64[ns]').values.astype('int64') / 1e9
+    seconds[pd.isna(pd.Series(times)).values] = np.nan
+    return seconds
+
+
+class StationIndex:
+    def __init__(
+            self, cruise_names, station_numbers, latitudes, longitudes, times=None, chunk_size=1024,
+            max_chunk_elements=2**22):
+        """
+        Entries without latitude or longitude are left out.
+
+        :param cruise_names: sequence of cruise names
+        :param station_numbers: sequence of station numbers
+        :param latitudes: sequence of latitudes in decimal degrees
+        :param longitudes: sequence of longitudes in decimal degrees
+        :param times: optional sequence of datetimes, required for time window queries
+        :param chunk_size: (int) number of query points compared with all entries at a time
+        :param max_chunk_elements: (int) the chunk size is reduced for large indexes so each chunk compares at
+                                   most this many (point, entry) pairs
+        """
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        has_position = np.isfinite(latitudes) & np.isfinite(longitudes)
+
+        self.stations_df = pd.DataFrame({
+            'cruise_name': np.asarray(cruise_names, dtype=object)[has_position],
+            'station_number': np.asarray(station_numbers)[has_position],
+            'latitude': latitudes[has_position],
+            'longitude': longitudes[has_position]})
+        self.vectors = unit_vectors(self.stations_df.latitude, self.stations_df.longitude)
+        if times is None:
+            self.times = None
+        else:
+            self.stations_df['time'] = pd.to_datetime(pd.Series(times)[has_position].values)
+            self.times = to_seconds(self.stations_df.time)
+        # each chunk makes a few float arrays with one element per (point, entry) pair
+        self.chunk_size = max(1, min(chunk_size, max_chunk_elements // max(1, len(self.stations_df))))
+
+    def __len__(self):
+        return len(self.stations_df)
+
+    @classmethod
+    def from_station_db(cls, db_uri, **kwargs):
+        """Build an index of the stations in the station database. Stations have no times so the index can
+        not be queried with max_time_delta, use from_samples for time windows.
+        """
+        with session_manager_from_db_uri(db_uri) as session:
+            stations = session.query(station_db.Station).all()
+            return cls(
+                cruise_names=[s.cruise_name for s in stations],
+                station_numbers=[s.station_number for s in stations],
+                latitudes=[np.nan if s.latitude is None else s.latitude for s in stations],
+                longitudes=[np.nan if s.longitude is None else s.longitude for s in stations],
+                **kwargs)
+
+    @classmethod
+    def from_samples(cls, samples, **kwargs):
+        """Build an index of sample positions and collection times from models.Sample objects."""
+        def to_float(value):
+            return np.nan if value is None else float(value)
+
+        samples = list(samples)
+        return cls(
+            cruise_names=[s.cruise.cruise_name if s.cruise is not None else None for s in samples],
+            station_numbers=[s.station_number for s in samples],
+            latitudes=[to_float(s.latitude_start) for s in samples],
+            longitudes=[to_float(s.longitude_start) for s in samples],
+            times=[s.collection_start for s in samples],
+            **kwargs)
+
+    def nearest(self, latitudes, longitudes, times=None, cruise_names=None, max_distance_km=None, max_time_delta=None):
+        """
+        Find the nearest entry to each point.
+
+        :param latitudes: sequence of latitudes in decimal degrees
+        :param longitudes: sequence of longitudes in decimal degrees
+        :param times: optional sequence of datetimes, required with max_time_delta
+        :param cruise_names: optional sequence of cruise names, only entries from the same cruise are considered
+        :param max_distance_km: (float) optional, entries farther away are not considered
+        :param max_time_delta: (datetime.timedelta or pandas.Timedelta) optional, entries with times farther
+                               from the point's time are not considered
+        :return: pandas.DataFrame with one row per point and columns station_index (-1 if nothing was found),
+                 cruise_name, station_number, distance_km and time_delta (seconds, NaN if no times)
+        """
+        query_vectors = unit_vectors(latitudes, longitudes)
+        point_count = query_vectors.shape[0]
+
+        if max_time_delta is not None:
+            if self.times is None:
+                raise ValueError(
+                    'max_time_delta requires an index with times, an index built from the station database '
+                    'has no times so use StationIndex.from_samples for time windows')
+            elif times is None:
+                raise ValueError('max_time_delta requires times for the points')
+            max_time_delta_seconds = pd.Timedelta(max_time_delta).total_seconds()
+        if times is not None:
+            query_times = to_seconds(times)
+        if cruise_names is not None:
+            query_cruise_names = np.asarray(cruise_names, dtype=object)
+            station_cruise_names = self.stations_df.cruise_name.to_numpy(dtype=object)
+
+        station_index = np.full(point_count, -1, dtype=int)
+        best_dot = np.full(point_count, -np.inf)
+        for c in range(0, point_count, self.chunk_size):
+            chunk = slice(c, c + self.chunk_size)
+            dot = query_vectors[chunk] @ self.vectors.T
+            # points without a position match nothing
+            dot[~np.isfinite(dot)] = -np.inf
+            if max_distance_km is not None:
+                dot[dot < np.cos(max_distance_km / EARTH_RADIUS_KM)] = -np.inf
+            if max_time_delta is not None:
+                time_delta = np.abs(query_times[chunk, np.newaxis] - self.times[np.newaxis, :])
+                dot[~(time_delta <= max_time_delta_seconds)] = -np.inf
+            if cruise_names is not None:
+                dot[query_cruise_names[chunk, np.newaxis] != station_cruise_names[np.newaxis, :]] = -np.inf
+
+            if dot.shape[1] > 0:
+                chunk_best = dot.argmax(axis=1)
+                best_dot[chunk] = dot[np.arange(dot.shape[0]), chunk_best]
+                station_index[chunk] = np.where(np.isfinite(best_dot[chunk]), chunk_best, -1)
+
+        found = station_index >= 0
+        if len(self) == 0:
+            found_index = station_index
+            found_cruise_names = np.full(point_count, None, dtype=object)
+            found_station_numbers = station_index
+        else:
+            found_index = np.where(found, station_index, 0)
+            found_cruise_names = self.stations_df.cruise_name.to_numpy(dtype=object)[found_index]
+            found_station_numbers = self.stations_df.station_number.values[found_index]
+        nearest_df = pd.DataFrame({
+            'station_index': station_index,
+            'cruise_name': np.where(found, found_cruise_names, None),
+            'station_number': np.where(found, found_station_numbers, -1),
+            'distance_km': np.where(found, EARTH_RADIUS_KM * np.arccos(np.clip(best_dot, -1.0, 1.0)), np.nan)})
+        if times is not None and self.times is not None:
+            nearest_df['time_delta'] = np.where(found, query_times - self.times[found_index], np.nan)
+        else:
+            nearest_df['time_delta'] = np.nan
+
+        return nearest_df
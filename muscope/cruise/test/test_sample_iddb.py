@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+import muscope.cruise.sample_iddb as sample_iddb
+from muscope.util.db import session_manager_from_db_uri
+
+
+def test_upsert_sample_file_names_blank_trailing_row():
+    core_attr_df = pd.DataFrame({
+        'sample_name': ['S1', np.nan, 'S2', np.nan],
+        'seq_name': ['S1_R1.fastq', 'S1_R2.fastq', 'S2_R1.fastq', np.nan]})
+    # rows collected the way load_attributes collects them, the last spreadsheet row is blank
+    sample_file_rows = []
+    for r in (0, 2):
+        for seq_name in core_attr_df.seq_name[r:r+2]:
+            sample_file_rows.append((seq_name, core_attr_df.sample_name[r], 'Reads'))
+
+    db_uri = 'sqlite://'
+    sample_iddb.build(db_uri)
+    with session_manager_from_db_uri(db_uri) as session:
+        assert sample_iddb.upsert_sample_file_names(sample_file_rows, session) == 3
+        # the same rows again insert nothing
+        assert sample_iddb.upsert_sample_file_names(sample_file_rows, session) == 0
+
+        sample_file_table = sample_iddb.find_sample_names_for_sample_file_names(
+            [name for name, _, _ in sample_file_rows], session)
+        assert {n: s.sample_name for n, s in sample_file_table.items()} == {
+            'S1_R1.fastq': 'S1', 'S1_R2.fastq': 'S1', 'S2_R1.fastq': 'S2'}
+
+        sample_iddb.mark_sample_files_processed(['S1_R1.fastq', float('nan')], session)
+        assert sorted(s.sample_file_name for s in sample_iddb.get_unprocessed_sample_files(session)) == [
+            'S1_R2.fastq', 'S2_R1.fastq']
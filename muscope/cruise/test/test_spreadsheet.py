@@ -0,0 +1,354 @@
+import datetime
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import muscope.util as util
+from muscope.cruise.spreadsheet import fill_from_previous_sample, find_attribute_spreadsheet_rules, \
+    PrefixColumn, ReplaceValues, SpreadsheetOperation, SpreadsheetRules
+from muscope.util.parse_cache import parser_version
+
+
+def legacy_fill_from_previous_sample_n2(core_attr_plus_data_df, exclude_columns=()):
+    """The fill loop from parse_Caron_HL2A_VertProf_seq_attrib_v3__xls."""
+    for (r1, row1), (r2, row2) in util.grouper(core_attr_plus_data_df.iterrows(), n=2):
+        if r1 == 0:
+            # skip row 0
+            pass
+        else:
+            # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
+            column_names = [c for c in core_attr_plus_data_df.columns if c not in exclude_columns]
+            for attr_name in column_names:
+                if str(core_attr_plus_data_df.loc[r1, attr_name]) in ('nan', 'NaT'):
+                    core_attr_plus_data_df.loc[r1, attr_name] = core_attr_plus_data_df.loc[r1-2, attr_name]
+                else:
+                    pass
+
+    return core_attr_plus_data_df
+
+
+def legacy_fill_from_previous_sample_n4(core_attr_plus_data_df):
+    """The fill loop from parse_Dyhrman_MS_incubation_assoc_data_v5__xls."""
+    for (r1, row1), (r2, row2), (r3, row3), (r4, row4) in util.grouper(core_attr_plus_data_df.iterrows(), n=4):
+        # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
+        column_names = list(core_attr_plus_data_df.columns)
+        for attr_name in column_names:
+            if str(core_attr_plus_data_df.loc[r3, attr_name]) in ('nan', 'NaT'):
+                core_attr_plus_data_df.loc[r3, attr_name] = core_attr_plus_data_df.loc[r1, attr_name]
+            else:
+                pass
+
+    return core_attr_plus_data_df
+
+
+def legacy_parse_Caron_HL2A_VertProf_seq_attrib_v3__xls(core_attr_plus_data_df):
+    """parse_Caron_HL2A_VertProf_seq_attrib_v3__xls from before the parse rules, given the parsed spreadsheet."""
+    for (r1, row1), (r2, row2) in util.grouper(core_attr_plus_data_df.iterrows(), n=2):
+        if r1 == 0:
+            # skip row 0
+            pass
+        else:
+            # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
+            column_names = list(core_attr_plus_data_df.columns)
+            for attr_name in column_names:
+                if str(core_attr_plus_data_df.loc[r1, attr_name]) in ('nan', 'NaT'):
+                    core_attr_plus_data_df.loc[r1, attr_name] = core_attr_plus_data_df.loc[r1-2, attr_name]
+                else:
+                    pass
+
+    return core_attr_plus_data_df
+
+
+def legacy_parse_Church_HOT201_222_Tricho16S_seq_assoc_v2__xls(core_attr_plus_data_df):
+    """parse_Church_HOT201_222_Tricho16S_seq_assoc_v2__xls from before the parse rules, given the parsed
+    spreadsheet.
+    """
+    for (r1, row1), (r2, row2) in util.grouper(core_attr_plus_data_df.iterrows(), n=2):
+        # replace 'net tow' with '0' in the cast_num column
+        if core_attr_plus_data_df.loc[r1, 'cast_num'] == 'net tow':
+            core_attr_plus_data_df.loc[r1, 'cast_num'] = 0
+
+        # add 'HOT' to cruise_name
+        core_attr_plus_data_df.loc[r1, 'cruise_name'] = \
+            'HOT' + str(int(core_attr_plus_data_df.loc[r1, 'cruise_name']))
+
+        # use 999 for missing sample depth and change it to null with the admin console
+        if str(core_attr_plus_data_df.loc[r1, 'depth']) == 'nan':
+            core_attr_plus_data_df.loc[r1, 'depth'] = 999
+
+        if r1 == 0:
+            # copy time from first date column to first time column
+            core_attr_plus_data_df.loc[0, 'collection_time'] = core_attr_plus_data_df.collection_date[0].time()
+        else:
+            # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
+            column_names = list(core_attr_plus_data_df.columns)
+            # do not copy over missing values in the depth column
+            column_names.remove('depth')
+            for attr_name in column_names:
+                if str(core_attr_plus_data_df.loc[r1, attr_name]) in ('nan', 'NaT'):
+                    core_attr_plus_data_df.loc[r1, attr_name] = core_attr_plus_data_df.loc[r1 - 2, attr_name]
+                else:
+                    pass
+
+    return core_attr_plus_data_df
+
+
+def legacy_parse_Dyhrman_MS_incubation_assoc_data_v5__xls(core_attr_plus_data_df):
+    """parse_Dyhrman_MS_incubation_assoc_data_v5__xls from before the parse rules, given the parsed spreadsheet."""
+    time_re = re.compile(r'^(?P<hour>\d{1,2}):?(?P<minute>\d{1,2})(:(?P<second>)\d{1,2})?$')
+
+    for (r1, row1), (r2, row2), (r3, row3), (r4, row4) in util.grouper(core_attr_plus_data_df.iterrows(), n=4):
+        # change the cruise name to MESO-SCOPE
+        core_attr_plus_data_df.loc[r1, 'cruise_name'] = 'MESO-SCOPE'
+
+        if row1.data_type == 'mRNA reads':
+            core_attr_plus_data_df.loc[r1, 'data_type'] = 'mRNA Reads'
+        else:
+            raise Exception()
+        if row3.data_type == 'total RNA reads':
+            core_attr_plus_data_df.loc[r3, 'data_type'] = 'Total RNA Reads'
+        else:
+            raise Exception()
+
+        # convert the strings in collection_time to datetime.time objects
+        collection_time_match = time_re.search(str(row1.collection_time))
+        core_attr_plus_data_df.loc[row1.name, 'collection_time'] = datetime.time(
+            hour=int(collection_time_match.group('hour')),
+            minute=int(collection_time_match.group('minute')))
+
+        # copy attributes from previous sample ONLY IF THE ATTRIBUTE IS EMPTY
+        column_names = list(core_attr_plus_data_df.columns)
+        for attr_name in column_names:
+            if str(core_attr_plus_data_df.loc[r3, attr_name]) in ('nan', 'NaT'):
+                core_attr_plus_data_df.loc[r3, attr_name] = core_attr_plus_data_df.loc[r1, attr_name]
+            else:
+                pass
+
+    return core_attr_plus_data_df
+
+
+def spreadsheet_df(columns, object_columns=()):
+    """Build a DataFrame with the column types pandas.read_excel gives an attribute spreadsheet:
+    empty cells are NaN (NaT in date columns), numeric columns are float and text columns are object.
+    Columns in object_columns are left as object.
+    """
+    df = pd.DataFrame({
+        name: pd.Series([np.nan if v is None else v for v in values], dtype=object)
+        for name, values in columns.items()})
+    for name in df.columns:
+        if name == 'collection_date':
+            df[name] = pd.to_datetime(df[name]).astype('datetime64[ns]')
+        elif name not in object_columns and all(isinstance(v, float) for v in df[name]):
+            df[name] = df[name].astype(float)
+    return df
+
+
+def assert_rules_match_legacy_parser(file_name, legacy_parser, columns, legacy_object_columns=()):
+    rules = find_attribute_spreadsheet_rules(file_name)
+    expected_df = legacy_parser(spreadsheet_df(columns, object_columns=legacy_object_columns))
+    normalized_df = rules.normalize(spreadsheet_df(columns))
+    assert_same_cells(normalized_df, expected_df)
+
+
+def test_caron_hl2a_vertprof_rules_match_legacy_parser():
+    # one sample on two rows, R1 and R2, and most values only on the first row of the first sample
+    assert_rules_match_legacy_parser(
+        'Caron_HL2A_VertProf_seq_attrib_v3.xls',
+        legacy_parse_Caron_HL2A_VertProf_seq_attrib_v3__xls,
+        {
+            'sample_name': ['S1', None, 'S2', None, 'S3', None, 'S4', None],
+            'cruise_name': ['HL2A', None, None, None, None, None, None, None],
+            'station': [47.0, None, None, None, 48.0, None, None, None],
+            'cast_num': [1.0, None, 2.0, None, None, None, 1.0, None],
+            'collection_date': ['2016-03-10', None, None, None, '2016-03-11', None, None, None],
+            'collection_time': [datetime.time(12, 45), None, None, None, datetime.time(1, 5), None, None, None],
+            'depth': [5.0, None, 25.0, None, 5.0, None, None, None],
+            'seq_name': ['S1_R1.fastq.gz', 'S1_R2.fastq.gz', 'S2_R1.fastq.gz', 'S2_R2.fastq.gz',
+                         'S3_R1.fastq.gz', 'S3_R2.fastq.gz', 'S4_R1.fastq.gz', 'S4_R2.fastq.gz'],
+            'temperature': [25.1, None, 24.0, None, None, None, 23.5, None],
+        })
+
+
+def test_church_hot201_222_rules_match_legacy_parser():
+    # the cruise name is a number, cast_num can be 'net tow', some depths are missing
+    # and the collection_time column is empty
+    assert_rules_match_legacy_parser(
+        'Church_HOT201-222_Tricho16S_seq_assoc_v2.xls',
+        legacy_parse_Church_HOT201_222_Tricho16S_seq_assoc_v2__xls,
+        {
+            'sample_name': ['T1', None, 'T2', None, 'T3', None, 'T4', None],
+            'cruise_name': [201.0, None, 201.0, None, 202.0, None, 222.0, None],
+            'station': [2.0, None, None, None, 2.0, None, None, None],
+            'cast_num': ['net tow', None, 3, None, 'net tow', None, 'net tow', None],
+            'collection_date': ['2008-05-01 03:04:05', None, None, None, '2008-06-02 22:00:00', None, None, None],
+            'collection_time': [None] * 8,
+            'depth': [None, None, 25.0, None, 175.0, None, None, None],
+            'seq_name': ['T1_R1.fastq', 'T1_R2.fastq', 'T2_R1.fastq', 'T2_R2.fastq',
+                         'T3_R1.fastq', 'T3_R2.fastq', 'T4_R1.fastq', 'T4_R2.fastq'],
+        },
+        # the original parser relied on older pandas changing a float column to object when
+        # 'HOT201' was assigned to it, pandas 3 raises instead
+        legacy_object_columns=('cruise_name', 'collection_time'))
+
+
+def test_dyhrman_ms_incubation_rules_match_legacy_parser():
+    # two related samples in groups of 4 rows, the first collection times are times and the rest are text
+    assert_rules_match_legacy_parser(
+        'Dyhrman_MS_incubation_assoc_data_v5.xls',
+        legacy_parse_Dyhrman_MS_incubation_assoc_data_v5__xls,
+        {
+            'sample_name': ['M1', None, 'M2', None, 'M3', None, 'M4', None, 'M5', None, 'M6', None],
+            'cruise_name': ['MS', None, None, None, 'MS', None, 'MS', None, 'MS', None, None, None],
+            'station': [6.0, None, None, None, 12.0, None, None, None, 15.0, None, 15.0, None],
+            'collection_date': ['2017-07-01', None, None, None, '2017-07-03', None, None, None,
+                                '2017-07-05', None, None, None],
+            'collection_time': [datetime.time(12, 45), None, None, None, '1205', None, None, None,
+                                '9:30', None, None, None],
+            'depth': [15.0, None, None, None, 15.0, None, 125.0, None, 15.0, None, None, None],
+            'data_type': ['mRNA reads', None, 'total RNA reads', None] * 3,
+            'seq_name': ['M{}_{}.fastq.gz'.format(s, r) for s in range(1, 7) for r in (1, 2)],
+        })
+
+
+def test_fill_from_previous_sample_none():
+    # unlike the original loops, which only filled cells that printed as 'nan' or 'NaT', None is also empty
+    # pandas.read_excel gives NaN rather than None for empty cells so parsed spreadsheets are not affected
+    df = pd.DataFrame({'sample_name': ['S1', 'x', None, 'y']}, dtype=object)
+    fill_from_previous_sample(df, stride=2)
+    assert list(df.sample_name) == ['S1', 'x', 'S1', 'y']
+
+
+def random_attribute_df(row_count, seed):
+    """Build a DataFrame that looks like a parsed attribute spreadsheet with many empty cells."""
+    rng = np.random.RandomState(seed)
+
+    def with_holes(values):
+        values = pd.Series(values, dtype=object if isinstance(values[0], (str, datetime.time)) else None)
+        values[rng.rand(row_count) < 0.5] = np.nan
+        return values
+
+    return pd.DataFrame({
+        'sample_name': with_holes(['sample_{}'.format(i) for i in range(row_count)]),
+        'seq_name': ['file_{}.fastq.gz'.format(i) for i in range(row_count)],
+        'station': with_holes(rng.randint(1, 20, row_count).astype(float)),
+        'depth': with_holes(rng.rand(row_count) * 100.0),
+        'collection_date': with_holes(pd.date_range('2017-03-01', periods=row_count, freq='h')).astype('datetime64[ns]'),
+        'collection_time': with_holes([datetime.time(i % 24, 0) for i in range(row_count)]),
+    })
+
+
+def assert_same_cells(df_1, df_2):
+    assert list(df_1.columns) == list(df_2.columns)
+    for column in df_1.columns:
+        assert [str(v) for v in df_1[column]] == [str(v) for v in df_2[column]], column
+
+
+def test_fill_from_previous_sample_stride_2():
+    for seed in range(10):
+        expected_df = legacy_fill_from_previous_sample_n2(random_attribute_df(40, seed))
+        df = fill_from_previous_sample(random_attribute_df(40, seed), stride=2)
+        assert_same_cells(df, expected_df)
+
+
+def test_fill_from_previous_sample_stride_2_exclude_columns():
+    for seed in range(10):
+        expected_df = legacy_fill_from_previous_sample_n2(random_attribute_df(40, seed), exclude_columns=('depth', ))
+        df = fill_from_previous_sample(random_attribute_df(40, seed), stride=2, exclude_columns=('depth', ))
+        assert_same_cells(df, expected_df)
+
+
+def test_fill_from_previous_sample_stride_4():
+    for seed in range(10):
+        expected_df = legacy_fill_from_previous_sample_n4(random_attribute_df(40, seed))
+        df = fill_from_previous_sample(random_attribute_df(40, seed), stride=4, offset=2, lag=2)
+        assert_same_cells(df, expected_df)
+
+
+def test_find_attribute_spreadsheet_rules():
+    assert find_attribute_spreadsheet_rules('Dyhrman_MS_incubation_assoc_data_v5.xls').family == \
+        'Dyhrman_MS_incubation_assoc_data_v5'
+    assert find_attribute_spreadsheet_rules('Church_HOT201-222_Tricho16S_seq_assoc_v2.xls').family == \
+        'Church_HOT201-222_Tricho16S_seq_assoc_v2'
+    assert find_attribute_spreadsheet_rules('Chisholm_HOT.BATS_seq_attrib.xls').family == \
+        'Chisholm_HOT.BATS_seq_attrib'
+    # the file name must match completely
+    assert find_attribute_spreadsheet_rules('Chisholm_HOTxBATS_seq_attrib.xls') is None
+    assert find_attribute_spreadsheet_rules('Dyhrman_MS_incubation_assoc_data_v5.xlsx') is None
+    assert find_attribute_spreadsheet_rules('Dyhrman_MS_incubation_assoc_data_v4.xls') is None
+
+
+def test_ms_incubation_rules():
+    core_attr_plus_data_df = pd.DataFrame({
+        'cruise_name': ['MS', None, 'MS', None, 'MS', None, 'MS', None],
+        'data_type': ['mRNA reads', None, 'total RNA reads', None] * 2,
+        'collection_time': [datetime.time(12, 45), None, None, None, '1205', None, None, None],
+        'seq_name': ['a_1.fastq', 'a_2.fastq', 'b_1.fastq', 'b_2.fastq',
+                     'c_1.fastq', 'c_2.fastq', 'd_1.fastq', 'd_2.fastq'],
+    }, dtype=object)
+    rules = find_attribute_spreadsheet_rules('Dyhrman_MS_incubation_assoc_data_v5.xls')
+    normalized_df = rules.normalize(core_attr_plus_data_df)
+
+    assert list(normalized_df.cruise_name) == ['MESO-SCOPE', None, 'MS', None] * 2
+    assert list(normalized_df.data_type) == ['mRNA Reads', None, 'Total RNA Reads', None] * 2
+    assert list(normalized_df.collection_time) == [
+        datetime.time(12, 45), None, datetime.time(12, 45), None,
+        datetime.time(12, 5), None, datetime.time(12, 5), None]
+
+
+def test_strict_replace_values():
+    core_attr_plus_data_df = pd.DataFrame({'data_type': ['mRNA reads', 'reads', 'total RNA reads', None]})
+    with pytest.raises(ValueError):
+        ReplaceValues('data_type', {'mRNA reads': 'mRNA Reads'}, rows=slice(0, None, 2), strict=True).apply(
+            core_attr_plus_data_df)
+
+
+def test_tricho_rules():
+    core_attr_plus_data_df = pd.DataFrame({
+        'station': [1.0] * 16,
+        'cast_num': [2.0] * 16,
+        'data_type': ['reads'] * 16,
+        'seq_name': ['a_1.fastq', 'a_2.fastq', 'b_1.fastq.gz', 'b_2.fastq.gz'] * 4,
+        'latitude': ['22 45.0', None, '22 30.0', None] * 4,
+        'longitude': ['158 6.0', None, '158 12.0', None] * 4,
+    }, dtype=object)
+    rules = find_attribute_spreadsheet_rules('Dyhrman_HL2A_Tricho_seq_attrib_v2.xls')
+    normalized_df = rules.normalize(core_attr_plus_data_df)
+
+    assert list(normalized_df.station) == [0] * 16
+    assert list(normalized_df.data_type) == ['Reads'] * 16
+    assert list(normalized_df.seq_name) == ['a_1.fastq.gz', 'a_2.fastq.gz', 'b_1.fastq.gz', 'b_2.fastq.gz'] * 4
+    assert list(normalized_df.latitude[:4]) == [22.75, None, 22.5, None]
+    assert list(normalized_df.longitude[:4]) == [-158.0 + 0.1, None, -158.0 + 0.2, None]
+    assert normalized_df.latitude[12] is None
+    assert normalized_df.longitude[14] is None
+
+
+def test_church_rules():
+    core_attr_plus_data_df = pd.DataFrame({
+        'cruise_name': [201.0, np.nan, 202.0, np.nan],
+        'cast_num': ['net tow', np.nan, 3, np.nan],
+        'depth': [np.nan, np.nan, 25.0, np.nan],
+        'collection_date': pd.to_datetime(['2008-01-02 03:04:05', None, '2008-02-03 00:00:00', None]),
+        'collection_time': [None] * 4,
+    })
+    rules = find_attribute_spreadsheet_rules('Church_HOT201-222_Tricho16S_seq_assoc_v2.xls')
+    normalized_df = rules.normalize(core_attr_plus_data_df)
+
+    assert list(normalized_df.cruise_name[::2]) == ['HOT201', 'HOT202']
+    assert list(normalized_df.cast_num[::2]) == [0, 3]
+    assert list(normalized_df.depth[::2]) == [999, 25.0]
+    # depth is not filled from the previous sample
+    assert np.isnan(normalized_df.depth.iloc[1])
+    assert normalized_df.collection_time.iloc[0] == datetime.time(3, 4, 5)
+
+
+def test_parse_cache_version_follows_rules():
+    rules = find_attribute_spreadsheet_rules('Caron_HOTquarterly_18Sv4_seq_assoc_data_v2.xls')
+    changed_rules = SpreadsheetRules(rules.family, rules.file_name_pattern, [PrefixColumn('cruise_name', 'HOT ')])
+    assert parser_version(*rules.dependencies()) == parser_version(*rules.dependencies())
+    assert parser_version(*rules.dependencies()) != parser_version(*changed_rules.dependencies())
+    # the code shared by all rules is part of the version too
+    assert SpreadsheetRules.normalize in rules.dependencies()
+    assert SpreadsheetOperation in rules.dependencies()
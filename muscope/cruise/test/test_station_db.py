@@ -0,0 +1,103 @@
+import pandas as pd
+
+import muscope.cruise.station_db as station_db
+import muscope.util.db as db
+from muscope.cruise.station_db import extract_stations
+from muscope.util.db import session_manager_from_db_uri
+
+
+def test_extract_stations():
+    watercolumn_df = pd.DataFrame({
+        'Cruise': ['MS', 'MS', 'MS', 'HOT273', 'HOT273'],
+        'station': [1.0, 1.0, 2.0, 1.0, 1.0],
+        'latitude': [22.5, 22.6, 23.0, 22.75, 22.75],
+        'longitude': [158.0, 158.1, 157.5, 158.0, 158.0],
+        'rosette_position': [1, 2, 1, 1, 2],
+    })
+
+    stations_df = extract_stations(watercolumn_df)
+
+    assert list(stations_df.cruise_name) == ['MESO-SCOPE', 'MESO-SCOPE', 'HOT273']
+    assert list(stations_df.station_number) == [1, 2, 1]
+    # the first bottle row gives the station position
+    assert list(stations_df.latitude) == [22.5, 23.0, 22.75]
+    assert list(stations_df.longitude) == [-158.0, -157.5, -158.0]
+
+
+def stations(rows):
+    return pd.DataFrame(rows, columns=['cruise_name', 'station_number', 'latitude', 'longitude'])
+
+
+def station_table(db_session):
+    return {
+        (s.cruise_name, s.station_number): (s.latitude, s.source_path)
+        for s in db_session.query(station_db.Station).all()}
+
+
+def new_station_db():
+    db_uri = 'sqlite://'
+    db.dispose_engine(db_uri)
+    station_db.create_db(db_uri)
+    return db_uri
+
+
+def test_update_station_sources_shared_station():
+    db_uri = new_station_db()
+
+    with session_manager_from_db_uri(db_uri) as db_session:
+        # HOT273 station 1 is in both spreadsheets
+        station_db.update_station_sources(
+            [
+                ('/core/a.xlsx', 'a1', stations([('HOT273', 1, 22.75, -158.0), ('HOT273', 2, 23.0, -158.0)])),
+                ('/core/b.xlsx', 'b1', stations([('HOT273', 1, 22.70, -158.0), ('HOT274', 1, 22.5, -158.0)]))],
+            [],
+            db_session)
+        assert station_table(db_session) == {
+            ('HOT273', 1): (22.75, '/core/a.xlsx'),
+            ('HOT273', 2): (23.0, '/core/a.xlsx'),
+            ('HOT274', 1): (22.5, '/core/b.xlsx')}
+
+        # a.xlsx changes and no longer has HOT273 station 1, b.xlsx is unchanged
+        station_db.update_station_sources(
+            [('/core/a.xlsx', 'a2', stations([('HOT273', 2, 23.1, -158.0)]))],
+            ['/core/a.xlsx'],
+            db_session)
+        assert station_table(db_session) == {
+            ('HOT273', 1): (22.70, '/core/b.xlsx'),
+            ('HOT273', 2): (23.1, '/core/a.xlsx'),
+            ('HOT274', 1): (22.5, '/core/b.xlsx')}
+
+        # b.xlsx is removed
+        station_db.update_station_sources([], ['/core/b.xlsx'], db_session)
+        assert station_table(db_session) == {('HOT273', 2): (23.1, '/core/a.xlsx')}
+        assert db_session.query(station_db.StationSource).count() == 1
+
+
+def test_update_station_sources_matches_rebuild():
+    db_uri = new_station_db()
+    with session_manager_from_db_uri(db_uri) as db_session:
+        station_db.update_station_sources(
+            [
+                ('/core/a.xlsx', 'a1', stations([('HOT273', 1, 22.75, -158.0)])),
+                ('/core/b.xlsx', 'b1', stations([('HOT273', 1, 22.70, -158.0)]))],
+            [],
+            db_session)
+        # a.xlsx changes, it is loaded again after b.xlsx but still comes first
+        station_db.update_station_sources(
+            [('/core/a.xlsx', 'a2', stations([('HOT273', 1, 22.76, -158.0)]))],
+            ['/core/a.xlsx'],
+            db_session)
+        incremental_station_table = station_table(db_session)
+
+    db_uri = new_station_db()
+    with session_manager_from_db_uri(db_uri) as db_session:
+        # a rebuild loads every spreadsheet, in whatever order the collection lists them
+        station_db.update_station_sources(
+            [
+                ('/core/b.xlsx', 'b1', stations([('HOT273', 1, 22.70, -158.0)])),
+                ('/core/a.xlsx', 'a2', stations([('HOT273', 1, 22.76, -158.0)]))],
+            [],
+            db_session)
+        rebuilt_station_table = station_table(db_session)
+
+    assert incremental_station_table == rebuilt_station_table == {('HOT273', 1): (22.76, '/core/a.xlsx')}
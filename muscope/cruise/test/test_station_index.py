@@ -0,0 +1,96 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from muscope.cruise.station_index import StationIndex, EARTH_RADIUS_KM
+
+
+def get_station_index(**kwargs):
+    return StationIndex(
+        cruise_names=['HOT273', 'HOT273', 'MESO-SCOPE', 'MESO-SCOPE'],
+        station_numbers=[1, 2, 1, 2],
+        latitudes=[22.75, 21.0, 24.0, np.nan],
+        longitudes=[-158.0, -157.0, -156.0, -155.0],
+        times=[
+            datetime.datetime(2015, 3, 1),
+            datetime.datetime(2015, 3, 2),
+            datetime.datetime(2017, 6, 1),
+            datetime.datetime(2017, 6, 2)],
+        **kwargs)
+
+
+def test_nearest():
+    # chunk_size=2 so the query points are compared in more than one chunk
+    station_index = get_station_index(chunk_size=2)
+    # the station without a latitude is left out
+    assert len(station_index) == 3
+
+    nearest_df = station_index.nearest(
+        latitudes=[22.76, 21.1, 24.0, np.nan],
+        longitudes=[-158.0, -157.0, -156.01, -158.0])
+
+    assert list(nearest_df.station_index) == [0, 1, 2, -1]
+    assert list(nearest_df.cruise_name[:3]) == ['HOT273', 'HOT273', 'MESO-SCOPE']
+    assert pd.isna(nearest_df.cruise_name[3])
+    assert list(nearest_df.station_number) == [1, 2, 1, -1]
+    # 0.01 degree of latitude
+    assert np.isclose(nearest_df.distance_km[0], EARTH_RADIUS_KM * np.radians(0.01))
+    assert np.isnan(nearest_df.distance_km[3])
+
+
+def test_chunk_size_is_bounded():
+    assert get_station_index().chunk_size == 1024
+    # 3 entries with positions
+    station_index = get_station_index(max_chunk_elements=7)
+    assert station_index.chunk_size == 2
+    assert get_station_index(max_chunk_elements=2).chunk_size == 1
+
+    nearest_df = station_index.nearest(latitudes=[22.76, 21.1, 24.0], longitudes=[-158.0, -157.0, -156.01])
+    assert list(nearest_df.station_index) == [0, 1, 2]
+
+
+def test_nearest_within_limits():
+    station_index = get_station_index()
+
+    nearest_df = station_index.nearest(
+        latitudes=[22.76, 22.76, 22.76, 23.5],
+        longitudes=[-158.0, -158.0, -158.0, -156.5],
+        times=[
+            datetime.datetime(2015, 3, 1, 12),
+            datetime.datetime(2015, 3, 2, 12),
+            datetime.datetime(2015, 3, 1, 12),
+            datetime.datetime(2017, 6, 1)],
+        cruise_names=['HOT273', 'HOT273', 'MESO-SCOPE', 'HOT273'],
+        max_distance_km=50.0,
+        max_time_delta=datetime.timedelta(days=1))
+
+    # station 1 is close but station 2 is the only station within the time window and it is too far away
+    # there is no MESO-SCOPE station nearby
+    # the last point is closest to a MESO-SCOPE station
+    assert list(nearest_df.station_index) == [0, -1, -1, -1]
+    assert nearest_df.time_delta[0] == 12 * 60 * 60
+
+
+def test_empty_index():
+    station_index = StationIndex(cruise_names=[], station_numbers=[], latitudes=[], longitudes=[])
+    nearest_df = station_index.nearest(latitudes=[22.0], longitudes=[-158.0])
+    assert list(nearest_df.station_index) == [-1]
+
+
+def test_time_window_without_times():
+    # like an index built from the station database
+    station_index = StationIndex(
+        cruise_names=['HOT273'], station_numbers=[1], latitudes=[22.75], longitudes=[-158.0])
+
+    with pytest.raises(ValueError, match='from_samples'):
+        station_index.nearest(
+            latitudes=[22.76],
+            longitudes=[-158.0],
+            times=[datetime.datetime(2015, 3, 1)],
+            max_time_delta=datetime.timedelta(days=1))
+
+    with pytest.raises(ValueError, match='times for the points'):
+        get_station_index().nearest(
+            latitudes=[22.76], longitudes=[-158.0], max_time_delta=datetime.timedelta(days=1))
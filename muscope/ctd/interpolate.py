@@ -0,0 +1,164 @@
+"""
+Interpolate water column measurements at sample depths.
+
+Instead of copying the row of the nearest rosette bottle, every numeric column is
+interpolated in predicted_bottle_depth at the sample depths, either linearly or with a
+monotone piecewise cubic (PCHIP, Fritsch and Carlson) that does not overshoot the
+bottle values. Depths outside the bottle range get the value of the shallowest or
+deepest bottle.
+
+The value -9.0 means 'missing' in the water column spreadsheets. Columns are
+interpolated only through their non-missing bottles. Columns with the same missing
+bottles are interpolated together as one array, so a station costs a handful of array
+operations no matter how many columns or samples it has.
+"""
+import numpy as np
+import pandas as pd
+
+
+MISSING_VALUE = -9.0
+
+INTERPOLATION_METHODS = ('linear', 'pchip')
+
+
+def pchip_slopes(x, y):
+    """Return the PCHIP derivatives at the points x for each column of y.
+
+    :param x: (k, ) strictly increasing array with k >= 2
+    :param y: (k, m) array
+    :return: (k, m) array
+    """
+    h = np.diff(x)[:, np.newaxis]
+    delta = np.diff(y, axis=0) / h
+    if len(x) == 2:
+        return np.vstack((delta, delta))
+
+    slopes = np.zeros_like(y)
+
+    # interior points get a weighted harmonic mean of the neighboring secant slopes
+    # or 0 where the data has a local extremum
+    w1 = 2.0 * h[1:] + h[:-1]
+    w2 = h[1:] + 2.0 * h[:-1]
+    same_sign = (np.sign(delta[:-1]) * np.sign(delta[1:])) > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        harmonic_mean = (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:])
+    slopes[1:-1] = np.where(same_sign, harmonic_mean, 0.0)
+
+    # end points use a shape preserving three point estimate
+    def end_slope(h0, h1, delta0, delta1):
+        d = ((2.0 * h0 + h1) * delta0 - h0 * delta1) / (h0 + h1)
+        d = np.where(np.sign(d) != np.sign(delta0), 0.0, d)
+        return np.where(
+            (np.sign(delta0) != np.sign(delta1)) & (np.abs(d) > np.abs(3.0 * delta0)),
+            3.0 * delta0,
+            d)
+
+    slopes[0] = end_slope(h[0], h[1], delta[0], delta[1])
+    slopes[-1] = end_slope(h[-1], h[-2], delta[-1], delta[-2])
+
+    return slopes
+
+
+def interpolate_columns(x, y, x_new, method='linear'):
+    """Interpolate each column of y at x_new, clamping x_new to the range of x.
+
+    :param x: (k, ) strictly increasing array
+    :param y: (k, m) array
+    :param x_new: (n, ) array
+    :param method: (str) 'linear' or 'pchip'
+    :return: (n, m) array
+    """
+    if method not in INTERPOLATION_METHODS:
+        raise ValueError('unknown interpolation method "{}"'.format(method))
+    if len(x) == 1:
+        return np.repeat(y, len(x_new), axis=0)
+
+    x_new = np.clip(x_new, x[0], x[-1])
+    # interval i is [x[i], x[i+1]]
+    i = np.clip(np.searchsorted(x, x_new, side='right') - 1, 0, len(x) - 2)
+    h = (x[i + 1] - x[i])[:, np.newaxis]
+    t = (x_new - x[i])[:, np.newaxis] / h
+
+    if method == 'linear':
+        return y[i] + t * (y[i + 1] - y[i])
+    else:
+        slopes = pchip_slopes(x, y)
+        return \
+            (1.0 + 2.0 * t) * (1.0 - t) ** 2 * y[i] + \
+            t * (1.0 - t) ** 2 * h * slopes[i] + \
+            t ** 2 * (3.0 - 2.0 * t) * y[i + 1] + \
+            t ** 2 * (t - 1.0) * h * slopes[i + 1]
+
+
+def interpolate_station(bottle_depths, bottle_values, sample_depths, method='linear'):
+    """Interpolate the bottle values of one station at the sample depths.
+
+    :param bottle_depths: (k, ) array of predicted bottle depths
+    :param bottle_values: (k, m) array of bottle values, NaN or MISSING_VALUE where missing
+    :param sample_depths: (n, ) array
+    :param method: (str) 'linear' or 'pchip'
+    :return: (n, m) array, NaN where a column has no values at this station
+    """
+    bottle_values = np.where(bottle_values == MISSING_VALUE, np.nan, bottle_values)
+    # sort by depth and keep the first bottle at each depth
+    order = np.argsort(bottle_depths, kind='stable')
+    x, first = np.unique(bottle_depths[order], return_index=True)
+    y = bottle_values[order][first]
+    valid = np.isfinite(y) & np.isfinite(x)[:, np.newaxis]
+
+    interpolated = np.full((len(sample_depths), y.shape[1]), np.nan)
+    # columns with the same valid bottles are interpolated together
+    mask_groups, column_group = np.unique(valid, axis=1, return_inverse=True)
+    column_group = column_group.reshape(-1)
+    for g in range(mask_groups.shape[1]):
+        rows = mask_groups[:, g]
+        if rows.any():
+            columns = column_group == g
+            interpolated[:, columns] = interpolate_columns(x[rows], y[rows][:, columns], sample_depths, method)
+
+    return interpolated
+
+
+def interpolate_samples(samples_df, water_column_df, attribute_columns, method='linear'):
+    """
+    Interpolate water column attributes at each sample depth using the bottles from the sample's station.
+
+    :param samples_df: pandas.DataFrame with columns cruise_name, station_number and depth
+    :param water_column_df: pandas.DataFrame with columns cruise_name, station, predicted_bottle_depth
+                            and attribute_columns
+    :param attribute_columns: list of numeric column names in water_column_df
+    :param method: (str) 'linear' or 'pchip'
+    :return: pandas.DataFrame with the index of samples_df and attribute_columns, samples without depth or
+             without bottles at their station are not included
+    """
+    samples_df = samples_df[samples_df.depth.notna() & samples_df.station_number.notna()]
+    sample_keys = pd.MultiIndex.from_arrays(
+        [samples_df.cruise_name.values, samples_df.station_number.astype(np.int64).values])
+    bottle_keys = pd.MultiIndex.from_arrays(
+        [water_column_df.cruise_name.values, water_column_df.station.astype(np.int64).values])
+
+    bottle_depths = water_column_df.predicted_bottle_depth.to_numpy(dtype=float)
+    bottle_values = water_column_df[attribute_columns].to_numpy(dtype=float)
+    sample_depths = samples_df.depth.to_numpy(dtype=float)
+
+    interpolated_frames = []
+    bottle_groups = pd.Series(np.arange(len(water_column_df))).groupby(bottle_keys).indices
+    sample_groups = pd.Series(np.arange(len(samples_df))).groupby(sample_keys).indices
+    for station_key, sample_rows in sample_groups.items():
+        if station_key not in bottle_groups:
+            continue
+        bottle_rows = bottle_groups[station_key]
+        interpolated_frames.append(
+            pd.DataFrame(
+                interpolate_station(
+                    bottle_depths[bottle_rows],
+                    bottle_values[bottle_rows],
+                    sample_depths[sample_rows],
+                    method),
+                index=samples_df.index[sample_rows],
+                columns=attribute_columns))
+
+    if len(interpolated_frames) == 0:
+        return pd.DataFrame(columns=attribute_columns, index=samples_df.index[:0], dtype=float)
+    else:
+        return pd.concat(interpolated_frames).sort_index()
@@ -8,178 +8,218 @@ for data recorded at each station from the rosette.
 
 Then the data are applied as attributes to all samples in the muscope database.
 
+By default each sample gets the values of the bottle closest to the sample depth. With
+--attribution linear or --attribution pchip every numeric column is interpolated in
+predicted bottle depth at the sample depth instead.
+
 """
+import argparse
 import os
 import sys
 
-from irods.keywords import FORCE_FLAG_KW
-from irods.session import iRODSSession
-
 import numpy as np
 
 import pandas as pd
+import sqlalchemy as sa
+
+import muscope.ctd.interpolate as interpolate
+import muscope.ctd.match as match
+import muscope.ctd.water_column as water_column
+import muscope.util.db as db
+import muscope.util.irods as irods
+import muscope.util.sample_attr as sample_attr
+import muscope.models as models
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
-from orminator import session_manager
-import muscope
-import muscope.models as models
+ATTRIBUTION_METHODS = ('nearest', ) + interpolate.INTERPOLATION_METHODS
+
+
+def get_args(argv):
+    arg_parser = argparse.ArgumentParser()
+
+    arg_parser.add_argument('--attribution', required=False, choices=ATTRIBUTION_METHODS, default='nearest',
+                            help='use the values of the nearest bottle or interpolate between bottles '
+                                 'linearly or with a monotone cubic')
+
+    args = arg_parser.parse_args(argv)
+    print('command line args: {}'.format(args))
+
+    return args
 
 
 def main(argv):
-    for water_column_df in get_all_water_column_spreadsheets():
-        cruise_name = water_column_df.cruise_name[0]
-        print(water_column_df.head())
-        # calculate expected depth based on pressure for all rosette positions
-        # this calculation is found at http://www.seabird.com/document/an69-conversion-pressure-depth
-        x = np.power(np.sin(water_column_df.latitude / 57.29578), 2.0)
-        p = water_column_df.pressure
-        g = 9.780318 * (1.0 + (5.2788e-3 + 2.36e-5 * x) * x) + 1.092e-6 * p
-        water_column_df['predicted_bottle_depth'] = ((((-1.82e-15 * p + 2.279e-10) * p - 2.2512e-5) * p + 9.72659) * p) / g
-
-        # rearrange columns so predicted_bottle_depth is to the left of pressure
-        # pressure is the first attribute column and all columns to the right of it will be treated as attributes
-        columns = list(water_column_df.columns.values)
-        columns.remove('predicted_bottle_depth')
-        columns.insert(columns.index('pressure'), 'predicted_bottle_depth')
-        print(columns[:10])
-        water_column_df = water_column_df[columns]
-        pressure_column_index = water_column_df.columns.get_loc('pressure')
-
-        # get the stations
-        for station in water_column_df.station.unique():
-            print('processing cruise "{}" station "{}"'.format(water_column_df.cruise_name[0], station))
-            # get all rows for this station
-            station_water_column_df = water_column_df[water_column_df.station == station]
-
-            # look up all samples with this cruise and station
-            # connect to database on server
-            # e.g. mysql+pymysql://imicrobe:<password>@localhost/muscope2
-            Session_class = sessionmaker(
-                bind=create_engine(
-                    os.environ.get('MUSCOPE_DB_URI'), echo=False))
-            with session_manager(Session_class) as session:
-                samples_for_cruise_and_station_query = session.query(models.Sample).join(models.Cruise).filter(
-                    models.Cruise.cruise_name == station_water_column_df.cruise_name.iloc[0]).filter(
-                    models.Sample.station_number == int(station_water_column_df.station.iloc[0]))
-
-                samples_for_cruise_and_station_count = samples_for_cruise_and_station_query.count()
-
-                print('found {} samples for cruise "{}" and station {}'.format(
-                    samples_for_cruise_and_station_count,
-                    station_water_column_df.cruise_name.iloc[0],
-                    station_water_column_df.station.iloc[0]))
-
-                for sample in samples_for_cruise_and_station_query.all():
-
-                    print('processing sample "{}" with\n\tlat: {:8.5f}\t{:8.5f} (station)\n\tlong: {:8.5f}\t{:8.5f} (station)'.format(
-                        sample.sample_name,
-                        sample.latitude_start if sample.latitude_start is not None else float('nan'),
-                        station_water_column_df.latitude.iloc[0],
-                        sample.longitude_start if sample.longitude_start is not None else float('nan'),
-                        station_water_column_df.longitude.iloc[0]))
-
-                    if sample.latitude_start is None:
-                        print('\tupdating latitude to "{:8.5f}"'.format(station_water_column_df.latitude.iloc[0]))
-                        sample.latitude_start = str(station_water_column_df.latitude.iloc[0])
-                    else:
-                        pass
-
-                    if sample.longitude_start is None:
-                        station_longitude = -1.0 * station_water_column_df.longitude.iloc[0]
-                        print('\tupdating longitude to "{:8.5f}"'.format(station_longitude))
-                        sample.longitude_start = str(station_longitude)
-                    else:
-                        pass
-
-                    # which rosette position has predicted_depth closest to the sample depth?
-                    depth_difference = np.abs(sample.depth - station_water_column_df.predicted_bottle_depth)
-                    best_bottle_index = depth_difference.values.argmin()
-                    print('closest bottle to sample "{}" at depth {:5.2f}m is bottle {} with predicted depth {:5.2f}m ({:5.2f} dbar)\n\tdifference is {:5.2f}m'.format(
-                        sample.sample_name,
-                        sample.depth,
-                        station_water_column_df.rosette_position.iloc[best_bottle_index],
-                        station_water_column_df.predicted_bottle_depth.iloc[best_bottle_index],
-                        station_water_column_df.pressure.iloc[best_bottle_index],
-                        depth_difference.iloc[best_bottle_index]))
-
-                    if depth_difference.iloc[best_bottle_index] >= 1.0:
-                        print('  {} {} station {} sample {} large depth difference: {:5.2f}'.format(
-                            ','.join([i.last_name for i in sample.investigator_list]),
-                            cruise_name,
-                            station,
-                            sample.sample_name,
-                            depth_difference.iloc[best_bottle_index]))
-
-                    best_ctd_row = station_water_column_df.iloc[best_bottle_index, :]
-
-                    # remove columns to the left of pressure - they are not attributes
-                    # remove columns with value -9.0 - they are 'missing'
-                    best_ctd_attributes = best_ctd_row[pressure_column_index:][best_ctd_row[pressure_column_index:] != -9.0]
-
-                    # build a table of sample attribute type to sample attribute value
-                    #  'pressure': 50.0
-                    #  'temperature_CTD': 3.0
-                    #  ...
-                    sample_attribute_table = {
-                        a.sample_attr_type.type_: a
-                        for a
-                        in sample.sample_attr_list}
-                    print(sample_attribute_table)
-                    # columns to the right of pressure inclusive are attributes
-                    # check all attributes for this sample
-                    for column_name, column_value in best_ctd_attributes.iteritems():
-
-                        sample_attr = sample_attribute_table.get(column_name.strip().lower(), None)
-                        if sample_attr is None:
-                            print('  ## sample "{}" does not have attribute "{}"'.format(sample.sample_name, column_name))
-                            print('     adding new attribute with type "{}" and value "{}"'.format(column_name, column_value))
-                            sample_attr_type = session.query(models.Sample_attr_type).filter(
-                                models.Sample_attr_type.type_ == column_name).one()
-                            print('     found attribute type "{}"'.format(sample_attr_type.type_))
-                            new_sample_attribute = models.Sample_attr(value=str(column_value))
-                            new_sample_attribute.sample_attr_type = sample_attr_type
-                            sample.sample_attr_list.append(new_sample_attribute)
-                        else:
-                            # update it
-                            print('  @@ sample "{}" has attribute "{}" with value "{}"'.format(
-                                sample.sample_name,
-                                sample_attr.sample_attr_type.type_,
-                                sample_attr.value))
-                            print('     updating value to "{}"'.format(column_value))
-                            sample_attr.value = str(column_value)
+    args = get_args(argv)
+
+    # connect to database on server
+    # e.g. mysql+pymysql://imicrobe:<password>@localhost/muscope2
+    with db.session_manager_from_db_uri(os.environ.get('MUSCOPE_DB_URI')) as session:
+        # sample attribute types are looked up once for all cruises
+        sample_attr_types = {
+            sample_attr_type.type_: sample_attr_type
+            for sample_attr_type
+            in session.query(models.Sample_attr_type).all()}
+
+        for water_column_df in get_all_water_column_spreadsheets():
+            load_cruise_ctd_data(water_column_df, sample_attr_types, session, attribution=args.attribution)
+            # each cruise is written in its own transaction
+            session.commit()
+
+
+def load_cruise_ctd_data(water_column_df, sample_attr_types, session, attribution='nearest'):
+    """
+    Apply the water column data for one cruise as attributes of the samples from that cruise.
+
+    :param water_column_df: pandas.DataFrame from muscope.ctd.water_column.get_water_column_table
+    :param sample_attr_types: dict of type_ -> models.Sample_attr_type
+    :param session: SQLAlchemy session for the muSCOPE database
+    :param attribution: (str) 'nearest' to use the closest bottle, 'linear' or 'pchip' to interpolate
+    """
+    cruise_name = water_column_df.cruise_name[0]
+    print(water_column_df.head())
+    # predicted_bottle_depth is to the left of pressure
+    # pressure is the first attribute column and all columns to the right of it will be treated as attributes
+    print(list(water_column_df.columns.values[:10]))
+    pressure_column_index = water_column_df.columns.get_loc('pressure')
+
+    # the first row for each station has the station position
+    station_position_df = water_column_df.drop_duplicates('station').set_index('station')
+
+    # look up all samples with this cruise with their attributes and investigators in one query
+    samples_for_cruise = session.query(models.Sample).join(models.Cruise).filter(
+        models.Cruise.cruise_name == cruise_name).options(
+            sa.orm.subqueryload(models.Sample.sample_attr_list).joinedload(models.Sample_attr.sample_attr_type),
+            sa.orm.subqueryload(models.Sample.investigator_list)).all()
+
+    print('found {} samples for cruise "{}"'.format(len(samples_for_cruise), cruise_name))
+
+    sample_attr_writer = sample_attr.SampleAttrDiffWriter(session=session)
+
+    samples_df = pd.DataFrame({
+        'cruise_name': cruise_name,
+        'station_number': [s.station_number for s in samples_for_cruise],
+        'depth': [np.nan if s.depth is None else float(s.depth) for s in samples_for_cruise]})
+    for station, station_samples_df in samples_df.groupby('station_number'):
+        print('found {} samples for cruise "{}" and station {}'.format(
+            len(station_samples_df), cruise_name, station))
+
+    if attribution == 'nearest':
+        # match every sample to the closest bottle at its station in one step
+        match_df = match.match_samples_to_bottles(samples_df, water_column_df)
+        print('matched {} of {} samples to bottles'.format(len(match_df), len(samples_for_cruise)))
+
+        for sample_i, match_row in match_df.iterrows():
+            sample = samples_for_cruise[sample_i]
+            station = sample.station_number
+            best_ctd_row = water_column_df.loc[match_row.bottle_index, :]
+
+            update_sample_position(sample, station_position_df.loc[station])
+
+            print('closest bottle to sample "{}" at depth {:5.2f}m is bottle {} with predicted depth {:5.2f}m ({:5.2f} dbar)\n\tdifference is {:5.2f}m'.format(
+                sample.sample_name,
+                match_row.depth,
+                best_ctd_row.rosette_position,
+                best_ctd_row.predicted_bottle_depth,
+                best_ctd_row.pressure,
+                match_row.depth_difference))
+
+            if match_row.depth_difference >= 1.0:
+                print('  {} {} station {} sample {} large depth difference: {:5.2f}'.format(
+                    ','.join([i.last_name for i in sample.investigator_list]),
+                    cruise_name,
+                    station,
+                    sample.sample_name,
+                    match_row.depth_difference))
+
+            # remove columns to the left of pressure - they are not attributes
+            # remove columns with value -9.0 - they are 'missing'
+            best_ctd_attributes = best_ctd_row[pressure_column_index:][best_ctd_row[pressure_column_index:] != -9.0]
+
+            write_sample_attributes(sample, best_ctd_attributes, sample_attr_types, sample_attr_writer, session)
+    else:
+        # columns to the right of pressure inclusive are attributes, only numeric columns can be interpolated
+        attribute_columns = [
+            column_name
+            for column_name
+            in water_column_df.columns[pressure_column_index:]
+            if pd.api.types.is_numeric_dtype(water_column_df[column_name])]
+        # interpolate all columns for all samples of each station at once
+        interpolated_df = interpolate.interpolate_samples(
+            samples_df, water_column_df, attribute_columns, method=attribution)
+        print('interpolated {} attributes for {} of {} samples'.format(
+            len(attribute_columns), len(interpolated_df), len(samples_for_cruise)))
+
+        for sample_i, interpolated_row in interpolated_df.iterrows():
+            sample = samples_for_cruise[sample_i]
+            update_sample_position(sample, station_position_df.loc[sample.station_number])
+
+            print('interpolated {} values for sample "{}" at depth {:5.2f}m'.format(
+                attribution, sample.sample_name, samples_df.depth[sample_i]))
+
+            # columns with no values at this station are NaN
+            write_sample_attributes(
+                sample, interpolated_row.dropna(), sample_attr_types, sample_attr_writer, session)
+
+    sample_attr_writer.flush()
+    print('cruise "{}": {}'.format(cruise_name, sample_attr_writer.report()))
+
+
+def update_sample_position(sample, station_water_column_row):
+    """Set missing sample latitude and longitude from the first row for the sample's station."""
+    print('processing sample "{}" with\n\tlat: {:8.5f}\t{:8.5f} (station)\n\tlong: {:8.5f}\t{:8.5f} (station)'.format(
+        sample.sample_name,
+        float(sample.latitude_start) if sample.latitude_start is not None else float('nan'),
+        station_water_column_row.latitude,
+        float(sample.longitude_start) if sample.longitude_start is not None else float('nan'),
+        station_water_column_row.longitude))
+
+    if sample.latitude_start is None:
+        print('\tupdating latitude to "{:8.5f}"'.format(station_water_column_row.latitude))
+        sample.latitude_start = str(station_water_column_row.latitude)
+    else:
+        pass
+
+    if sample.longitude_start is None:
+        station_longitude = -1.0 * station_water_column_row.longitude
+        print('\tupdating longitude to "{:8.5f}"'.format(station_longitude))
+        sample.longitude_start = str(station_longitude)
+    else:
+        pass
+
+
+def write_sample_attributes(sample, ctd_attributes, sample_attr_types, sample_attr_writer, session):
+    """Check all attributes for this sample and write only the values that changed.
+
+    :param ctd_attributes: pandas.Series of column name -> value
+    """
+    for column_name, column_value in ctd_attributes.items():
+        sample_attr_type = find_sample_attr_type(column_name, sample_attr_types, session)
+        change = sample_attr_writer.set_value(sample, sample_attr_type, column_value)
+        if change != 'unchanged':
+            print('  sample "{}" attribute "{}" {} with value "{}"'.format(
+                sample.sample_name, sample_attr_type.type_, change, column_value))
+
+
+def find_sample_attr_type(column_name, sample_attr_types, session):
+    """Return the sample attribute type for a water column spreadsheet column header.
+    Existing attributes are found by the lower case header as before, new attribute types by the header itself.
+    """
+    for type_ in (column_name.strip().lower(), column_name):
+        if type_ in sample_attr_types:
+            return sample_attr_types[type_]
+
+    sample_attr_types[column_name] = session.query(models.Sample_attr_type).filter(
+        models.Sample_attr_type.type_ == column_name).one()
+    return sample_attr_types[column_name]
 
 
 def get_all_water_column_spreadsheets():
-    with iRODSSession(irods_env_file=os.path.expanduser('~/.irods/irods_environment.json')) as irods_session:
+    with irods.irods_session_manager() as irods_session:
         scope_data_core_collection = irods_session.collections.get('/iplant/home/scope/data/core')
         print('loading station and cast data')
         for data_object in scope_data_core_collection.data_objects:
             print('\t{}'.format(data_object.path))
-            # get the file
-            local_file_fp = os.path.join(
-                os.path.dirname(muscope.__file__),
-                'downloads',
-                data_object.name)
-
-            irods_session.data_objects.get(
-                data_object.path,
-                local_file_fp,
-                **{FORCE_FLAG_KW: True})
-
-            watercolumn_df = pd.read_excel(
-                local_file_fp,
-                skiprows=(0, 2))
-
-            # normalize column names that vary across spreadsheets
-            watercolumn_df.rename(
-                columns={
-                    'Pressure': 'pressure',
-                    'Cruise': 'cruise_name'},
-                inplace=True)
-
-            yield watercolumn_df
+            # the table has predicted bottle depths and is only parsed again if the spreadsheet changes
+            yield water_column.get_water_column_table(irods_session, data_object)
 
 
 def cli():
@@ -0,0 +1,50 @@
+"""
+Match samples to the rosette bottle closest in depth at the same station.
+
+All samples and bottles are matched in one pandas.merge_asof on depth grouped by
+cruise and station, instead of one argmin per sample.
+"""
+import numpy as np
+import pandas as pd
+
+
+def match_samples_to_bottles(samples_df, water_column_df):
+    """
+    Find the bottle with predicted_bottle_depth closest to each sample depth at the same cruise and station.
+    When two bottles are equally close the shallower bottle is chosen.
+
+    :param samples_df: pandas.DataFrame with columns cruise_name, station_number and depth, other columns are kept
+    :param water_column_df: pandas.DataFrame with columns cruise_name, station and predicted_bottle_depth
+    :return: pandas.DataFrame with the rows and index of samples_df plus columns
+             bottle_index (index label of the matched water_column_df row),
+             predicted_bottle_depth and depth_difference (absolute, in meters),
+             samples without depth or without bottles at their station are not included
+    """
+    left_df = samples_df.copy()
+    left_df['_sample_index'] = samples_df.index
+    left_df = left_df[left_df.depth.notna() & left_df.station_number.notna()]
+    left_df['depth'] = left_df.depth.astype(float)
+    left_df['station_number'] = left_df.station_number.astype(np.int64)
+
+    right_df = pd.DataFrame({
+        'cruise_name': water_column_df.cruise_name.values,
+        'station_number': water_column_df.station.astype(np.int64).values,
+        'predicted_bottle_depth': water_column_df.predicted_bottle_depth.astype(float).values,
+        'bottle_index': water_column_df.index})
+    right_df = right_df[right_df.predicted_bottle_depth.notna()]
+
+    match_df = pd.merge_asof(
+        left_df.sort_values('depth'),
+        right_df.sort_values('predicted_bottle_depth'),
+        left_on='depth',
+        right_on='predicted_bottle_depth',
+        by=['cruise_name', 'station_number'],
+        direction='nearest')
+    match_df = match_df[match_df.bottle_index.notna()]
+
+    match_df['depth_difference'] = (match_df.depth - match_df.predicted_bottle_depth).abs()
+    match_df.index = match_df.pop('_sample_index').values
+    match_df.index.name = samples_df.index.name
+    match_df['bottle_index'] = match_df.bottle_index.astype(water_column_df.index.dtype)
+
+    return match_df.sort_index()
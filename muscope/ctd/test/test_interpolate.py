@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+from muscope.ctd.interpolate import interpolate_columns, interpolate_station, interpolate_samples
+
+
+def test_linear_matches_numpy_interp():
+    rng = np.random.RandomState(0)
+    x = np.sort(rng.uniform(0.0, 500.0, size=12))
+    y = rng.normal(size=(12, 3))
+    x_new = rng.uniform(-50.0, 550.0, size=40)
+
+    interpolated = interpolate_columns(x, y, x_new, method='linear')
+
+    for j in range(y.shape[1]):
+        assert np.allclose(interpolated[:, j], np.interp(x_new, x, y[:, j]))
+
+
+def test_pchip_is_monotone_and_passes_through_bottles():
+    x = np.array([0.0, 10.0, 25.0, 50.0, 100.0, 200.0])
+    # temperature decreasing with depth, and a column with a flat section
+    y = np.column_stack((
+        [25.0, 24.9, 24.0, 20.0, 15.0, 10.0],
+        [1.0, 1.0, 1.0, 2.0, 5.0, 5.0]))
+    x_new = np.linspace(0.0, 200.0, 401)
+
+    interpolated = interpolate_columns(x, y, x_new, method='pchip')
+
+    assert np.allclose(interpolate_columns(x, y, x, method='pchip'), y)
+    assert np.all(np.diff(interpolated[:, 0]) <= 1e-12)
+    assert np.all(np.diff(interpolated[:, 1]) >= -1e-12)
+    # no overshoot on the flat sections
+    assert np.allclose(interpolated[x_new <= 10.0, 1], 1.0)
+    assert np.allclose(interpolated[x_new >= 100.0, 1], 5.0)
+
+
+def test_pchip_reproduces_linear_data():
+    x = np.array([0.0, 5.0, 30.0, 100.0])
+    y = (2.0 * x + 1.0)[:, np.newaxis]
+    x_new = np.linspace(0.0, 100.0, 11)
+
+    assert np.allclose(interpolate_columns(x, y, x_new, method='pchip')[:, 0], 2.0 * x_new + 1.0)
+
+
+def test_interpolate_station_missing_values():
+    bottle_depths = np.array([100.0, 0.0, 50.0, 50.0])
+    bottle_values = np.array([
+        [10.0, -9.0, -9.0],
+        [20.0, 1.0, -9.0],
+        [15.0, 3.0, -9.0],
+        [99.0, 99.0, 99.0]])
+    sample_depths = np.array([-5.0, 25.0, 75.0, 150.0])
+
+    interpolated = interpolate_station(bottle_depths, bottle_values, sample_depths, method='linear')
+
+    # the first bottle at 50m is used, the second is ignored
+    assert np.allclose(interpolated[:, 0], [20.0, 17.5, 12.5, 10.0])
+    # the bottle at 100m is missing for the second column so it is clamped below 50m
+    assert np.allclose(interpolated[:, 1], [1.0, 2.0, 3.0, 3.0])
+    assert np.all(np.isnan(interpolated[:, 2]))
+
+
+def test_interpolate_samples():
+    water_column_df = pd.DataFrame({
+        'cruise_name': ['HOT273'] * 6,
+        'station': [1.0, 1.0, 1.0, 2.0, 2.0, 2.0],
+        'predicted_bottle_depth': [0.0, 100.0, 200.0, 0.0, 100.0, 200.0],
+        'temperature': [25.0, 20.0, 10.0, 24.0, 18.0, 8.0],
+        'oxygen': [200.0, -9.0, 150.0, 210.0, 190.0, 170.0]})
+    samples_df = pd.DataFrame({
+        'cruise_name': ['HOT273'] * 5,
+        'station_number': [2, 1, 3, 1, 1],
+        'depth': [50.0, 150.0, 50.0, None, 100.0]},
+        index=pd.Index(np.arange(10, 15), name='sample_id'))
+
+    interpolated_df = interpolate_samples(samples_df, water_column_df, ['temperature', 'oxygen'])
+
+    # station 3 has no bottles and one sample has no depth
+    assert list(interpolated_df.index) == [10, 11, 14]
+    assert np.allclose(interpolated_df.temperature, [21.0, 15.0, 20.0])
+    assert np.allclose(interpolated_df.oxygen, [200.0, 162.5, 175.0])
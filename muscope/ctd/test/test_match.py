@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from muscope.ctd.match import match_samples_to_bottles
+
+
+def legacy_best_bottle_index(sample_depth, station_water_column_df):
+    """The bottle choice from the original per-sample loop in load_sample_ctd_data.main."""
+    depth_difference = np.abs(sample_depth - station_water_column_df.predicted_bottle_depth)
+    return station_water_column_df.index[depth_difference.values.argmin()]
+
+
+def test_match_samples_to_bottles():
+    rng = np.random.RandomState(0)
+    water_column_df = pd.DataFrame({
+        'cruise_name': ['HOT273'] * 24,
+        'station': np.repeat([1.0, 2.0], 12),
+        'predicted_bottle_depth': rng.uniform(0.0, 500.0, size=24),
+        'rosette_position': np.tile(np.arange(1, 13), 2)})
+    samples_df = pd.DataFrame({
+        'cruise_name': ['HOT273'] * 8 + ['HOT274'],
+        'station_number': [1, 1, 2, 2, 1, 2, 3, 1, 1],
+        'depth': [5.0, 250.0, 25.0, 499.0, 0.0, 1000.0, 25.0, None, 25.0]},
+        index=pd.Index(np.arange(100, 109), name='sample_id'))
+
+    match_df = match_samples_to_bottles(samples_df, water_column_df)
+
+    # station 3 has no bottles, one sample has no depth and HOT274 has no bottles
+    assert list(match_df.index) == [100, 101, 102, 103, 104, 105]
+    assert match_df.index.name == 'sample_id'
+    for sample_id, match_row in match_df.iterrows():
+        station_water_column_df = water_column_df[water_column_df.station == match_row.station_number]
+        assert match_row.bottle_index == legacy_best_bottle_index(match_row.depth, station_water_column_df)
+        assert np.isclose(
+            match_row.depth_difference,
+            abs(match_row.depth - water_column_df.predicted_bottle_depth[match_row.bottle_index]))
+
+
+def test_match_tie_goes_to_shallower_bottle():
+    water_column_df = pd.DataFrame({
+        'cruise_name': ['HOT273', 'HOT273'],
+        'station': [1, 1],
+        'predicted_bottle_depth': [20.0, 10.0]})
+    samples_df = pd.DataFrame({'cruise_name': ['HOT273'], 'station_number': [1], 'depth': [15.0]})
+
+    match_df = match_samples_to_bottles(samples_df, water_column_df)
+
+    assert list(match_df.bottle_index) == [1]
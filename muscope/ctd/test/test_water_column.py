@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+import muscope.ctd.water_column as water_column
+import muscope.util.parse_cache as parse_cache
+from muscope.ctd.water_column import add_predicted_bottle_depth, pressure_to_depth
+
+
+def an69_depth(latitude, pressure):
+    """The calculation from the original load_sample_ctd_data.main."""
+    x = np.power(np.sin(latitude / 57.29578), 2.0)
+    p = pressure
+    g = 9.780318 * (1.0 + (5.2788e-3 + 2.36e-5 * x) * x) + 1.092e-6 * p
+    return ((((-1.82e-15 * p + 2.279e-10) * p - 2.2512e-5) * p + 9.72659) * p) / g
+
+
+def test_pressure_to_depth():
+    rng = np.random.RandomState(0)
+    pressure = rng.uniform(0.0, 5000.0, size=50)
+    latitude = rng.uniform(-80.0, 80.0, size=50)
+    expected = an69_depth(pd.Series(latitude), pd.Series(pressure)).values
+
+    assert np.allclose(pressure_to_depth(pressure, latitude), expected, rtol=1e-12)
+    assert np.allclose(pressure_to_depth(pressure, 22.75), an69_depth(22.75, pressure), rtol=1e-12)
+    # Sea-Bird's example: 10000 dbar at 30 degrees is 9712.653 m
+    assert np.isclose(pressure_to_depth(np.array([10000.0]), 30.0)[0], 9712.653, atol=1e-3)
+
+    out = np.empty_like(pressure)
+    assert pressure_to_depth(pressure, latitude, out=out) is out
+    assert np.allclose(out, expected, rtol=1e-12)
+
+    # the result can overwrite pressure
+    pressure_copy = pressure.copy()
+    assert pressure_to_depth(pressure_copy, latitude, out=pressure_copy) is pressure_copy
+    assert np.allclose(pressure_copy, expected, rtol=1e-12)
+
+
+def test_add_predicted_bottle_depth():
+    water_column_df = pd.DataFrame({
+        'cruise_name': ['HOT273'] * 3,
+        'station': [1, 1, 2],
+        'latitude': [22.75, 22.75, 23.0],
+        'longitude': [158.0, 158.0, 158.5],
+        'pressure': [5.0, 150.0, 500.0],
+        'temperature': [25.0, 20.0, 10.0]})
+
+    add_predicted_bottle_depth(water_column_df)
+
+    assert list(water_column_df.columns) == [
+        'cruise_name', 'station', 'latitude', 'longitude', 'predicted_bottle_depth', 'pressure', 'temperature']
+    assert np.allclose(
+        water_column_df.predicted_bottle_depth,
+        an69_depth(water_column_df.latitude, water_column_df.pressure))
+
+    # adding the column again replaces it
+    add_predicted_bottle_depth(water_column_df)
+    assert list(water_column_df.columns).count('predicted_bottle_depth') == 1
+
+
+def test_cached_water_column_tables(tmpdir, monkeypatch):
+    monkeypatch.setattr(parse_cache, '_parse_cache', parse_cache.ParseCache(str(tmpdir)))
+
+    def water_column_table(cruise_name):
+        return add_predicted_bottle_depth(pd.DataFrame({
+            'cruise_name': [cruise_name],
+            'latitude': [22.75],
+            'pressure': [5.0]}))
+
+    name = '{}.{}'.format(
+        water_column.parse_water_column_table.__module__, water_column.parse_water_column_table.__name__)
+    version = parse_cache.parser_version(
+        water_column.parse_water_column_table, *water_column.water_column_table_dependencies)
+    tables = (
+        ('old', '/iplant/home/scope/data/core/HOT273_watercolumn.xlsx', 'HOT273 old'),
+        ('abc', '/iplant/home/scope/data/core/HOT272_watercolumn.xlsx', 'HOT272'),
+        # HOT273_watercolumn.xlsx changed
+        ('new', '/iplant/home/scope/data/core/HOT273_watercolumn.xlsx', 'HOT273'))
+    for source_key, source_path, cruise_name in tables:
+        parse_cache.get_parse_cache().put(
+            name, source_key, version, water_column_table(cruise_name), source_path=source_path)
+
+    water_column_tables = water_column.cached_water_column_tables()
+    assert list(water_column_tables.keys()) == [
+        '/iplant/home/scope/data/core/HOT272_watercolumn.xlsx',
+        '/iplant/home/scope/data/core/HOT273_watercolumn.xlsx']
+    assert [df.cruise_name[0] for df in water_column_tables.values()] == ['HOT272', 'HOT273']
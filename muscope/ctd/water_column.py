@@ -0,0 +1,129 @@
+"""
+Water column tables with predicted bottle depths.
+
+pressure_to_depth converts rosette pressure to depth with the formula in Sea-Bird
+application note 69 (http://www.seabird.com/document/an69-conversion-pressure-depth).
+It works on numpy arrays with in-place operations and two scratch arrays.
+
+A water column table is a water column spreadsheet with a predicted_bottle_depth column
+inserted to the left of pressure. Tables are stored in the parse cache, one per
+spreadsheet, so the depths are calculated once. A changed spreadsheet replaces its old
+table. Code that needs bottle depths can read the current table of every spreadsheet,
+keyed by the spreadsheet's iRODS path, with cached_water_column_tables() without
+downloading or parsing the spreadsheets again:
+
+    for spreadsheet_path, water_column_df in cached_water_column_tables().items():
+        ...
+"""
+import collections
+
+import numpy as np
+import pandas as pd
+
+import muscope.util.download_cache as download_cache
+import muscope.util.parse_cache as parse_cache
+
+
+def pressure_to_depth(pressure, latitude, out=None):
+    """
+    Return depth in meters for pressure in decibars at latitude in decimal degrees.
+
+    :param pressure: array of pressures (dbar)
+    :param latitude: array of latitudes (decimal degrees) or a single latitude
+    :param out: optional float array with the shape of pressure for the result, may be pressure itself
+    :return: array of depths (m)
+    """
+    p = np.asarray(pressure, dtype=float)
+
+    # x = sin(latitude)^2
+    x = np.empty_like(p)
+    np.divide(latitude, 57.29578, out=x)
+    np.sin(x, out=x)
+    np.square(x, out=x)
+
+    # g = 9.780318 * (1.0 + (5.2788e-3 + 2.36e-5 * x) * x) + 1.092e-6 * p
+    g = np.multiply(x, 2.36e-5)
+    g += 5.2788e-3
+    g *= x
+    g += 1.0
+    g *= 9.780318
+    g += np.multiply(p, 1.092e-6, out=x)
+
+    # depth = ((((-1.82e-15 * p + 2.279e-10) * p - 2.2512e-5) * p + 9.72659) * p) / g
+    # p is still needed so x is used for the result when out is pressure
+    depth = x if out is None or out is p else out
+    np.multiply(p, -1.82e-15, out=depth)
+    depth += 2.279e-10
+    depth *= p
+    depth -= 2.2512e-5
+    depth *= p
+    depth += 9.72659
+    depth *= p
+    depth /= g
+
+    if out is None:
+        return depth
+    elif depth is not out:
+        out[...] = depth
+    return out
+
+
+def add_predicted_bottle_depth(water_column_df):
+    """
+    Insert a predicted_bottle_depth column to the left of pressure.
+    Pressure is the first attribute column and all columns to the right of it are treated as attributes.
+
+    :param water_column_df: pandas.DataFrame with columns latitude and pressure, modified in place
+    :return: water_column_df
+    """
+    predicted_bottle_depth = pressure_to_depth(
+        water_column_df.pressure.to_numpy(dtype=float),
+        water_column_df.latitude.to_numpy(dtype=float))
+    if 'predicted_bottle_depth' in water_column_df.columns:
+        del water_column_df['predicted_bottle_depth']
+    water_column_df.insert(
+        water_column_df.columns.get_loc('pressure'), 'predicted_bottle_depth', predicted_bottle_depth)
+    return water_column_df
+
+
+def parse_water_column_spreadsheet(spreadsheet_fp):
+    watercolumn_df = pd.read_excel(
+        spreadsheet_fp,
+        skiprows=(0, 2))
+
+    # normalize column names that vary across spreadsheets
+    watercolumn_df.rename(
+        columns={
+            'Pressure': 'pressure',
+            'Cruise': 'cruise_name'},
+        inplace=True)
+
+    return watercolumn_df
+
+
+def parse_water_column_table(spreadsheet_fp):
+    return add_predicted_bottle_depth(parse_water_column_spreadsheet(spreadsheet_fp))
+
+
+water_column_table_dependencies = (parse_water_column_spreadsheet, add_predicted_bottle_depth, pressure_to_depth)
+
+
+def get_water_column_table(irods_session, data_object):
+    """Return the water column table for a spreadsheet in the data store, from the parse cache if possible."""
+    # get the file unless an unchanged copy has been downloaded already
+    with download_cache.get_download_cache().local_file(irods_session, data_object) as local_file_fp:
+        return parse_cache.get_parse_cache().parse(
+            parse_water_column_table,
+            local_file_fp,
+            source_key=download_cache.cache_key(data_object),
+            depends_on=water_column_table_dependencies,
+            source_path=data_object.path)
+
+
+def cached_water_column_tables():
+    """Return an OrderedDict of spreadsheet iRODS path -> water column table with the current table of every
+    spreadsheet in the parse cache made by the current code.
+    """
+    return collections.OrderedDict(parse_cache.get_parse_cache().cached(
+        parse_water_column_table,
+        depends_on=water_column_table_dependencies))
@@ -1,30 +1,117 @@
 """
 Delete all samples associated with the specified investigator.
+
+By default samples are deleted with bulk DELETE statements, a batch of samples at a time,
+together with their rows in the tables that refer to samples (sample attributes, sample files
+and the association tables of the many-to-many relationships of Sample). Each batch is
+committed separately. Rows in other tables that refer to the sample attributes or sample files
+are not deleted, if there are any nothing is deleted and they must be removed first. Use
+--preview to print the number of rows that would be deleted and the number of rows that would
+stop the delete, and --orm to delete the samples one at a time through the ORM as before.
+
+usage:
+    python delete_investigator_samples.py Chisholm --preview
+    python delete_investigator_samples.py Chisholm --batch-size 200
 """
+import argparse
 import os
 import sys
+import time
+
+import sqlalchemy as sa
 
-from orminator import session_manager_from_db_uri
+from muscope.util.db import session_manager_from_db_uri
+import muscope.util.bulk_delete as bulk_delete
 import muscope.models as models
 
 
-investigator_last_name = sys.argv[1]
-print('removing all samples associated with investigator "{}"'.format(investigator_last_name))
+def get_args(argv):
+    arg_parser = argparse.ArgumentParser()
+
+    arg_parser.add_argument('investigator_last_name',
+                            help='last name of the investigator whose samples will be deleted')
+    arg_parser.add_argument('--db-uri', required=False, default=os.environ.get('MUSCOPE_DB_URI'),
+                            help='muSCOPE database URI, the default is environment variable MUSCOPE_DB_URI')
+    arg_parser.add_argument('--batch-size', required=False, type=int, default=500,
+                            help='number of samples deleted in each transaction')
+    arg_parser.add_argument('--preview', required=False, action='store_true', default=False,
+                            help='print the number of rows that would be deleted and delete nothing')
+    arg_parser.add_argument('--orm', required=False, action='store_true', default=False,
+                            help='delete samples one at a time through the ORM')
+
+    args = arg_parser.parse_args(argv)
+    print('command line args: {}'.format(args))
+
+    return args
+
+
+def main(argv):
+    args = get_args(argv)
+    investigator_last_name = args.investigator_last_name
+    print('removing all samples associated with investigator "{}"'.format(investigator_last_name))
+
+    t0 = time.time()
+    with session_manager_from_db_uri(args.db_uri) as db_session:
+        investigator = db_session.query(
+            models.Investigator).filter(
+                models.Investigator.last_name == investigator_last_name).one()
 
-with session_manager_from_db_uri(os.environ['MUSCOPE_DB_URI']) as db_session:
-    investigator_query = db_session.query(
-        models.Investigator).filter(
-            models.Investigator.last_name == investigator_last_name)
+        if args.orm:
+            investigator_sample_count = orm_delete_investigator_samples(investigator, db_session)
+        else:
+            sample_id_column = sa.inspect(models.Sample).primary_key[0]
+            sample_ids = [
+                sample_id
+                for sample_id,
+                in db_session.query(sample_id_column).join(models.Sample.investigator_list).filter(
+                    models.Investigator.last_name == investigator_last_name).distinct()]
+            investigator_sample_count = len(sample_ids)
+            print('found {} samples associated with investigator "{}"'.format(
+                investigator_sample_count,
+                investigator_last_name))
 
-    investigator = investigator_query.one()
+            if args.preview:
+                row_counts = bulk_delete.count_with_dependents(
+                    db_session, models.Sample, sample_ids, batch_size=args.batch_size)
+                for table_name, row_count in row_counts.items():
+                    print('  would delete {} row(s) from table {}'.format(row_count, table_name))
+                referencing_counts = bulk_delete.count_second_level_references(
+                    db_session, models.Sample, sample_ids, batch_size=args.batch_size)
+                for referencing_column, row_count in referencing_counts.items():
+                    if row_count > 0:
+                        print('  {} row(s) in {} refer to these rows and must be deleted first'.format(
+                            row_count, referencing_column))
+                    else:
+                        pass
+                print('preview done in {:5.2f}s'.format(time.time() - t0))
+                return
+            else:
+                row_counts = bulk_delete.delete_with_dependents(
+                    db_session, models.Sample, sample_ids, batch_size=args.batch_size)
+                for table_name, row_count in row_counts.items():
+                    print('  deleted {} row(s) from table {}'.format(row_count, table_name))
+
+    print('deleted {} samples associated with investigator "{}" in {:5.2f}s'.format(
+        investigator_sample_count,
+        investigator_last_name,
+        time.time() - t0))
+
+
+def orm_delete_investigator_samples(investigator, db_session):
     investigator_sample_count = len(investigator.sample_list)
     print('found {} samples associated with investigator "{}"'.format(
         investigator_sample_count,
-        investigator_last_name))
+        investigator.last_name))
     for s in investigator.sample_list:
         print('deleting {}'.format(s.sample_name))
         db_session.delete(s)
 
-    print('deleted {} samples associated with investigator "{}"'.format(
-        investigator_sample_count,
-        investigator_last_name))
+    return investigator_sample_count
+
+
+def cli():
+    return main(sys.argv[1:])
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,34 +1,241 @@
+"""
+Check that every file_ in table sample_file exists in the /iplant data store.
+
+The sample_file table is streamed from the database in batches. There are two modes.
+
+In probe mode (the default) paths are checked one at a time but concurrently, each check
+borrowing a session from the iRODS session pool. The result is written as a JSON report:
+
+    {
+        "summary": {
+            "sample_file_rows": 12345,
+            "paths": 12000,
+            "missing": 10,
+            "present_as_object": 11900,
+            "present_as_collection": 90,
+            "error": 0,
+            "concurrency": 8,
+            "elapsed_seconds": 150.2,
+            "paths_per_second": 79.9
+        },
+        "missing": ["/iplant/home/...", ...],
+        "present_as_object": [...],
+        "present_as_collection": [...],
+        "error": {"/iplant/home/...": "NetworkException: ...", ...}
+    }
+
+In reconcile mode the collection trees holding the sample files are listed with a few bulk
+catalog queries and compared with the sample_file paths as sets. This also finds data
+objects that were never registered in table sample_file. The collection roots are given
+with --collection-roots or are the distinct first --root-depth components of the paths.
+The report has the same form with lists "present", "missing", "collection" (registered
+paths that are collections), "orphan" (data objects that are not registered) and
+"not_listed" (registered paths outside the collection roots).
+
+usage:
+    python find_sample_file_rows_not_in_iplant_data_store.py --concurrency 16 --report sample_file_report.json
+    python find_sample_file_rows_not_in_iplant_data_store.py --mode reconcile --collection-roots /iplant/home/scope/data
+"""
+import argparse
+import concurrent.futures
+import json
 import os
+import sys
 import time
 
 import muscope.models as models
-import muscope.util as util
+import muscope.util.catalog as catalog
 import muscope.util.irods as irods
-from orminator import session_manager_from_db_uri
-
-
-# check every row in table sample_file
-t0 = time.time()
-with session_manager_from_db_uri(db_uri=os.environ['MUSCOPE_DB_URI']) as muscope_db_session:
-    sample_file_list = [
-        sample_file.file_
-        for sample_file
-        in muscope_db_session.query(models.Sample_file).all()]
-
-print('found {} sample file table rows in {:5.2f}s'.format(len(sample_file_list), time.time()-t0))
-
-t0 = time.time()
-sample_file_i = 0
-for sample_file_group in util.grouper(sample_file_list, n=100):
-    with irods.irods_session_manager() as irods_session:
-        for sample_file in [f for f in sample_file_group if f is not None]:
-            sample_file_i += 1
-            if irods.irods_data_object_exists(irods_session=irods_session, target_path=sample_file):
-                pass
-            elif irods.irods_collection_exists(irods_session=irods_session, collection_path=sample_file):
-                pass
-            else:
-                print('{} found "{}" in table sample_file but not in /iplant data store'.format(sample_file_i, sample_file))
-    print('   checked {} rows in {:5.2f}s'.format(sample_file_i, time.time()-t0))
-
-print('done in {:5.2f}s'.format(time.time()-t0))
+from muscope.util.db import session_manager_from_db_uri
+
+
+PATH_STATUSES = ('missing', 'present_as_object', 'present_as_collection', 'error')
+
+
+def get_args(argv):
+    arg_parser = argparse.ArgumentParser()
+
+    arg_parser.add_argument('--db-uri', required=False, default=os.environ.get('MUSCOPE_DB_URI'),
+                            help='muSCOPE database URI, the default is environment variable MUSCOPE_DB_URI')
+    arg_parser.add_argument('--concurrency', required=False, type=int, default=8,
+                            help='number of paths checked at the same time and iRODS sessions in the pool')
+    arg_parser.add_argument('--report', required=False, default='sample_file_rows_not_in_iplant_data_store.json',
+                            help='JSON report file, - for standard output')
+    arg_parser.add_argument('--progress-interval', required=False, type=int, default=1000,
+                            help='print progress after this many paths')
+    arg_parser.add_argument('--mode', required=False, choices=('probe', 'reconcile'), default='probe',
+                            help='check each path or compare bulk listings of the data store with the table')
+    arg_parser.add_argument('--collection-roots', required=False, default=None,
+                            help='comma-separated collections to list in reconcile mode')
+    arg_parser.add_argument('--root-depth', required=False, type=int, default=5,
+                            help='number of path components in collection roots found from the sample file paths, '
+                                 'for example 5 gives /iplant/home/scope/data/chisholm')
+    arg_parser.add_argument('--batch-size', required=False, type=int, default=10000,
+                            help='number of sample_file rows fetched from the database at a time')
+
+    args = arg_parser.parse_args(argv)
+    print('command line args: {}'.format(args))
+
+    return args
+
+
+def main(argv):
+    args = get_args(argv)
+
+    # check every row in table sample_file
+    sample_file_row_count, paths = read_sample_file_paths(args.db_uri, batch_size=args.batch_size)
+
+    irods.configure_irods_session_pool(size=args.concurrency)
+    if args.mode == 'probe':
+        report = check_sample_file_paths(
+            paths,
+            sample_file_row_count=sample_file_row_count,
+            concurrency=args.concurrency,
+            progress_interval=args.progress_interval)
+    else:
+        if args.collection_roots is None:
+            collection_roots = catalog.collection_roots(paths, depth=args.root_depth)
+        else:
+            collection_roots = args.collection_roots.split(',')
+        report = reconcile_sample_file_paths(
+            paths,
+            sample_file_row_count=sample_file_row_count,
+            collection_roots=collection_roots,
+            concurrency=args.concurrency)
+
+    if args.report == '-':
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.report, 'wt') as report_file:
+            json.dump(report, report_file, indent=2)
+        print('wrote report to "{}"'.format(args.report))
+
+    print(json.dumps(report['summary'], indent=2))
+
+
+def read_sample_file_paths(db_uri, batch_size=10000):
+    """
+    Read every file_ in table sample_file a batch of rows at a time.
+
+    :return: (number of rows, set of distinct paths not including None)
+    """
+    t0 = time.time()
+    sample_file_row_count = 0
+    paths = set()
+    with session_manager_from_db_uri(db_uri=db_uri) as muscope_db_session:
+        sample_file_query = muscope_db_session.query(models.Sample_file.file_).execution_options(
+            stream_results=True).yield_per(batch_size)
+        for file_, in sample_file_query:
+            sample_file_row_count += 1
+            if file_ is not None:
+                paths.add(file_)
+
+    print('found {} sample file table rows with {} distinct paths in {:5.2f}s'.format(
+        sample_file_row_count, len(paths), time.time()-t0))
+    return sample_file_row_count, paths
+
+
+def check_sample_file_paths(paths, sample_file_row_count, concurrency, progress_interval=1000):
+    """
+    Check each path and return a report dictionary.
+
+    :param paths: set of distinct Sample_file.file_ values
+    :param sample_file_row_count: (int) number of rows in table sample_file
+    :param concurrency: (int) number of paths checked at the same time
+    :param progress_interval: (int) print progress after this many paths
+    :return: dictionary with a summary and a sorted list of paths for each status
+    """
+    paths = sorted(paths)
+
+    t0 = time.time()
+    paths_by_status = {status: [] for status in PATH_STATUSES}
+    errors = dict()
+    for path_i, (path, status, error) in enumerate(irods.check_paths(paths, concurrency=concurrency)):
+        paths_by_status[status].append(path)
+        if status == 'missing':
+            print('{} found "{}" in table sample_file but not in /iplant data store'.format(path_i + 1, path))
+        elif status == 'error':
+            print('{} failed to check "{}": {}'.format(path_i + 1, path, error))
+            errors[path] = error
+        else:
+            pass
+
+        if (path_i + 1) % progress_interval == 0:
+            elapsed_seconds = time.time() - t0
+            print('   checked {} of {} paths in {:5.2f}s ({:5.1f} paths/s)'.format(
+                path_i + 1, len(paths), elapsed_seconds, (path_i + 1) / elapsed_seconds))
+
+    elapsed_seconds = time.time() - t0
+    print('done in {:5.2f}s'.format(elapsed_seconds))
+
+    summary = {
+        'sample_file_rows': sample_file_row_count,
+        'paths': len(paths)}
+    summary.update({status: len(paths_by_status[status]) for status in PATH_STATUSES})
+    summary.update({
+        'concurrency': concurrency,
+        'elapsed_seconds': round(elapsed_seconds, 3),
+        'paths_per_second': round(len(paths) / elapsed_seconds, 3) if elapsed_seconds > 0.0 else None})
+
+    report = {'summary': summary}
+    for status in PATH_STATUSES[:-1]:
+        report[status] = sorted(paths_by_status[status])
+    report['error'] = {path: errors[path] for path in sorted(errors)}
+
+    return report
+
+
+def reconcile_sample_file_paths(paths, sample_file_row_count, collection_roots, concurrency):
+    """
+    List the collection trees under collection_roots in bulk and compare them with paths.
+
+    :param paths: set of distinct Sample_file.file_ values
+    :param sample_file_row_count: (int) number of rows in table sample_file
+    :param collection_roots: list of collection paths
+    :param concurrency: (int) number of collection trees listed at the same time
+    :return: dictionary with a summary and the sorted path lists from muscope.util.catalog.reconcile
+    """
+    print('listing collection roots:\n\t{}'.format('\n\t'.join(collection_roots)))
+
+    def list_collection_root(collection_root):
+        with irods.irods_session_manager() as irods_session:
+            return irods.build_catalog(irods_session, collection_root)
+
+    t0 = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        catalogs = list(executor.map(list_collection_root, collection_roots))
+    listing_seconds = time.time() - t0
+    data_object_count = sum(len(c) for c in catalogs)
+    print('listed {} data objects in {:5.2f}s'.format(data_object_count, listing_seconds))
+
+    t0 = time.time()
+    report = catalog.reconcile(paths, catalogs)
+    reconcile_seconds = time.time() - t0
+
+    for path in report['missing']:
+        print('found "{}" in table sample_file but not in /iplant data store'.format(path))
+    for path in report['collection']:
+        print('found "{}" in table sample_file but it is a collection'.format(path))
+
+    summary = {
+        'sample_file_rows': sample_file_row_count,
+        'paths': len(paths),
+        'collection_roots': collection_roots,
+        'data_objects': data_object_count}
+    summary.update({status: len(status_paths) for status, status_paths in report.items()})
+    summary.update({
+        'concurrency': concurrency,
+        'listing_seconds': round(listing_seconds, 3),
+        'reconcile_seconds': round(reconcile_seconds, 3)})
+    print('done in {:5.2f}s'.format(listing_seconds + reconcile_seconds))
+
+    report['summary'] = summary
+    return report
+
+
+def cli():
+    return main(sys.argv[1:])
+
+
+if __name__ == '__main__':
+    cli()
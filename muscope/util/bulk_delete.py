@@ -0,0 +1,167 @@
+"""
+Set-based deletes of mapped objects and the rows that depend on them.
+
+Deleting objects with session.delete() loads each object and its related collections and
+issues one statement per row. delete_with_dependents removes objects by primary key with a
+few DELETE ... WHERE ... IN statements for each batch of keys: first the association table
+rows of the many-to-many relationships of the mapped class, then the rows of its one-to-many
+relationships, then the objects themselves. Each batch is committed so locks are held only
+for the time it takes to delete one batch.
+
+Only rows that refer directly to the deleted objects are removed. Rows in other tables that
+refer to those rows, for example a many-to-many table of sample files, are not. Before
+deleting anything delete_with_dependents looks for such rows with count_second_level_references
+and raises ValueError if there are any, so a run never stops part way through with a foreign
+key error after some batches have been committed.
+"""
+import collections
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.orm.interfaces import ONETOMANY
+
+
+Dependent = collections.namedtuple('Dependent', ['relationship_key', 'table', 'column'])
+# a foreign key column of table referring to referred_column of a Dependent table
+SecondLevelDependent = collections.namedtuple(
+    'SecondLevelDependent', ['table', 'column', 'dependent', 'referred_column'])
+
+
+def find_dependents(mapped_class):
+    """Return a list of Dependent for every table with rows referring to the primary key of mapped_class
+    through a relationship, association tables first.
+    """
+    mapper = sa.inspect(mapped_class)
+    if len(mapper.primary_key) != 1:
+        raise ValueError('{} does not have a single column primary key'.format(mapped_class.__name__))
+
+    association_dependents = []
+    one_to_many_dependents = []
+    for relationship in mapper.relationships:
+        if relationship.secondary is not None:
+            # synchronize_pairs has (parent column, association table column) for many-to-many relationships
+            dependents = association_dependents
+            column_pairs = relationship.synchronize_pairs
+        elif relationship.direction is ONETOMANY:
+            dependents = one_to_many_dependents
+            column_pairs = relationship.local_remote_pairs
+        else:
+            continue
+
+        for parent_column, dependent_column in column_pairs:
+            if parent_column is mapper.primary_key[0]:
+                dependents.append(Dependent(relationship.key, dependent_column.table, dependent_column))
+
+    # relationships and their backrefs can share an association table
+    unique_dependents = collections.OrderedDict()
+    for dependent in association_dependents + one_to_many_dependents:
+        unique_dependents.setdefault((dependent.table.name, dependent.column.name), dependent)
+    return list(unique_dependents.values())
+
+
+def find_second_level_dependents(session, mapped_class):
+    """Return a list of SecondLevelDependent for every foreign key in the database referring to a table
+    returned by find_dependents. The foreign keys are read from the database so tables without a mapped
+    class are found too.
+    """
+    dependents_by_table_name = collections.OrderedDict()
+    for dependent in find_dependents(mapped_class):
+        dependents_by_table_name.setdefault(dependent.table.name, []).append(dependent)
+
+    second_level_dependents = []
+    inspector = sa.inspect(session.get_bind())
+    for table_name in sorted(inspector.get_table_names()):
+        for foreign_key in inspector.get_foreign_keys(table_name):
+            for dependent in dependents_by_table_name.get(foreign_key['referred_table'], []):
+                # a composite foreign key is checked one column at a time
+                for column_name, referred_column_name in zip(
+                        foreign_key['constrained_columns'], foreign_key['referred_columns']):
+                    table = sa.table(table_name, sa.column(column_name))
+                    second_level_dependents.append(SecondLevelDependent(
+                        table=table,
+                        column=table.c[column_name],
+                        dependent=dependent,
+                        referred_column=dependent.table.c[referred_column_name]))
+    return second_level_dependents
+
+
+def count_second_level_references(session, mapped_class, ids, batch_size=500):
+    """Return an OrderedDict of 'table.column' -> number of rows referring to rows that
+    delete_with_dependents would delete. These rows are not deleted and they would make the delete fail.
+    """
+    second_level_dependents = find_second_level_dependents(session, mapped_class)
+    counts = collections.OrderedDict(
+        ('{}.{}'.format(s.table.name, s.column.name), 0) for s in second_level_dependents)
+    for id_batch in batches(ids, batch_size):
+        for s in second_level_dependents:
+            referred_ids = session.query(s.referred_column).filter(s.dependent.column.in_(id_batch))
+            counts['{}.{}'.format(s.table.name, s.column.name)] += session.query(
+                sa.func.count()).select_from(s.table).filter(
+                    s.column.in_(referred_ids)).scalar()
+    return counts
+
+
+def batches(ids, batch_size):
+    ids = list(ids)
+    for b in range(0, len(ids), batch_size):
+        yield ids[b:b+batch_size]
+
+
+def count_with_dependents(session, mapped_class, ids, batch_size=500):
+    """Return an OrderedDict of table name -> number of rows delete_with_dependents would delete."""
+    primary_key_column = sa.inspect(mapped_class).primary_key[0]
+    targets = [(d.table, d.column) for d in find_dependents(mapped_class)]
+    targets.append((primary_key_column.table, primary_key_column))
+
+    counts = collections.OrderedDict((table.name, 0) for table, _ in targets)
+    for id_batch in batches(ids, batch_size):
+        for table, column in targets:
+            counts[table.name] += session.query(sa.func.count()).select_from(table).filter(
+                column.in_(id_batch)).scalar()
+    return counts
+
+
+def delete_with_dependents(session, mapped_class, ids, batch_size=500, commit=True):
+    """
+    Delete the objects of mapped_class with primary keys ids and the rows that refer to them.
+
+    :param session: SQLAlchemy session
+    :param mapped_class: ORM class such as models.Sample
+    :param ids: iterable of primary keys
+    :param batch_size: (int) number of primary keys in each DELETE ... WHERE ... IN statement
+    :param commit: (bool) commit after each batch
+    :return: OrderedDict of table name -> number of rows deleted
+    :raises ValueError: if rows in other tables refer to the rows that would be deleted, nothing is deleted
+    """
+    ids = list(ids)
+    referencing_counts = {
+        referencing_column: row_count
+        for referencing_column, row_count
+        in count_second_level_references(session, mapped_class, ids, batch_size=batch_size).items()
+        if row_count > 0}
+    if len(referencing_counts) > 0:
+        raise ValueError('rows referring to the dependents of {} must be deleted first:\n\t{}'.format(
+            mapped_class.__name__,
+            '\n\t'.join([
+                '{} row(s) in {}'.format(row_count, referencing_column)
+                for referencing_column, row_count
+                in referencing_counts.items()])))
+
+    primary_key_column = sa.inspect(mapped_class).primary_key[0]
+    targets = [(d.table, d.column) for d in find_dependents(mapped_class)]
+    targets.append((primary_key_column.table, primary_key_column))
+
+    deleted_counts = collections.OrderedDict((table.name, 0) for table, _ in targets)
+    for batch_i, id_batch in enumerate(batches(ids, batch_size)):
+        t0 = time.time()
+        for table, column in targets:
+            result = session.execute(table.delete().where(column.in_(id_batch)))
+            deleted_counts[table.name] += result.rowcount
+        if commit:
+            session.commit()
+        print('  deleted batch {} with {} {} in {:5.2f}s'.format(
+            batch_i + 1, len(id_batch), mapped_class.__name__, time.time() - t0))
+
+    # objects in the session may refer to deleted rows
+    session.expire_all()
+    return deleted_counts
@@ -0,0 +1,147 @@
+"""
+An in-memory snapshot of an iRODS collection tree.
+
+A Catalog holds the collections and data objects found under a root collection so
+that several passes over the tree (for example finding attribute spreadsheets and
+then finding sample data files) cost a single listing of the catalog.
+
+reconcile compares a set of registered paths with one or more catalogs to find
+registered paths that are missing and data objects that were never registered.
+"""
+import collections
+
+
+CollectionRecord = collections.namedtuple(
+    'CollectionRecord',
+    ['path', 'name'])
+
+DataObjectRecord = collections.namedtuple(
+    'DataObjectRecord',
+    ['path', 'collection_path', 'name', 'size', 'checksum', 'modify_time'])
+
+
+class Catalog:
+    def __init__(self, root_path, collection_records, data_object_records):
+        """
+
+        :param root_path: (str) path of the root collection
+        :param collection_records: iterable of CollectionRecord, the root collection is optional
+        :param data_object_records: iterable of DataObjectRecord
+        """
+        self.root_path = root_path.rstrip('/') or '/'
+
+        self._collections = {self.root_path: CollectionRecord(path=self.root_path, name=self.root_path.split('/')[-1])}
+        self._subcollections = collections.defaultdict(list)
+        for collection_record in collection_records:
+            if collection_record.path != self.root_path:
+                self._collections[collection_record.path] = collection_record
+                parent_path = collection_record.path.rsplit('/', 1)[0] or '/'
+                self._subcollections[parent_path].append(collection_record)
+
+        self._data_objects = collections.defaultdict(list)
+        for data_object_record in data_object_records:
+            self._data_objects[data_object_record.collection_path].append(data_object_record)
+
+        # keep listings in name order for reproducible behavior
+        for records in self._subcollections.values():
+            records.sort(key=lambda r: r.name)
+        for records in self._data_objects.values():
+            records.sort(key=lambda r: r.name)
+
+    def __len__(self):
+        return sum(len(data_objects) for data_objects in self._data_objects.values())
+
+    def collection(self, collection_path):
+        return self._collections[collection_path]
+
+    def subcollections(self, collection_path):
+        return list(self._subcollections.get(collection_path, ()))
+
+    def data_objects(self, collection_path):
+        return list(self._data_objects.get(collection_path, ()))
+
+    def collection_paths(self):
+        """Return all collection paths in breadth-first order starting with the root."""
+        return [collection_path for collection_path, _, _ in self.breadth_first()]
+
+    def breadth_first(self):
+        """Yield (collection path, subcollection records, data object records) for every
+        collection in the catalog, visiting collections in the same order as a breadth-first
+        search of the collection tree.
+        """
+        unprocessed_collection_paths = collections.deque([self.root_path])
+        while len(unprocessed_collection_paths) > 0:
+            collection_path = unprocessed_collection_paths.popleft()
+            subcollections = self.subcollections(collection_path)
+            yield collection_path, subcollections, self.data_objects(collection_path)
+            unprocessed_collection_paths.extend(s.path for s in subcollections)
+
+    def path_order(self):
+        """Yield (collection record, subcollection records, data object records) for every
+        collection in the catalog in sorted path order.
+        """
+        for collection_path in sorted(self._collections):
+            yield (
+                self._collections[collection_path],
+                self.subcollections(collection_path),
+                self.data_objects(collection_path))
+
+    def all_data_objects(self):
+        """Yield every data object record in breadth-first collection order."""
+        for _, _, data_objects in self.breadth_first():
+            yield from data_objects
+
+
+def parent_paths(path):
+    """Yield the parent collection paths of path from the nearest to '/'."""
+    while path not in ('/', ''):
+        path = path.rsplit('/', 1)[0] or '/'
+        yield path
+
+
+def collection_roots(paths, depth):
+    """Return the sorted collection paths with depth components that contain paths,
+    for example depth 3 gives '/iplant/home/scope' for '/iplant/home/scope/data/a.fa'.
+    Paths with fewer components are under their parent collection.
+    """
+    roots = set()
+    for path in paths:
+        components = path.rstrip('/').split('/')
+        roots.add('/'.join(components[:min(depth + 1, len(components) - 1)]) or '/')
+    # a root inside another root would be listed twice
+    return sorted(r for r in roots if not any(p in roots for p in parent_paths(r)))
+
+
+def reconcile(registered_paths, catalogs):
+    """Compare registered paths, for example every Sample_file.file_, with catalogs of the data store
+    using set operations rather than one query per path.
+
+    :param registered_paths: iterable of paths
+    :param catalogs: iterable of Catalog
+    :return: dictionary of sorted path lists
+        present: registered paths that are data objects
+        missing: registered paths under a catalog root that are neither data objects nor collections
+        collection: registered paths that are collections rather than data objects
+        orphan: data objects in the catalogs that are not registered
+        not_listed: registered paths that are not under any catalog root
+    """
+    root_paths = set()
+    collection_paths = set()
+    data_object_paths = set()
+    for catalog in catalogs:
+        root_paths.add(catalog.root_path)
+        collection_paths.update(catalog.collection_paths())
+        data_object_paths.update(r.path for r in catalog.all_data_objects())
+
+    registered_paths = set(registered_paths)
+    listed_paths = {
+        p
+        for p in registered_paths
+        if p in root_paths or any(parent_path in root_paths for parent_path in parent_paths(p))}
+
+    return {
+        'present': sorted(listed_paths & data_object_paths),
+        'missing': sorted(listed_paths - data_object_paths - collection_paths),
+        'collection': sorted(listed_paths & collection_paths),
+        'orphan': sorted(data_object_paths - registered_paths),
+        'not_listed': sorted(registered_paths - listed_paths)}
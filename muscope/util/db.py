@@ -0,0 +1,97 @@
+"""
+Shared SQLAlchemy engines.
+
+Creating an engine for every session opens a new connection pool each time. The engines
+here are created once per database URI and shared by every loader in the process.
+
+Pool settings for server databases such as MySQL can be set with environment variables:
+  MUSCOPE_DB_POOL_SIZE      connections kept open, default 5
+  MUSCOPE_DB_MAX_OVERFLOW   connections opened beyond pool size when needed, default 10
+  MUSCOPE_DB_POOL_RECYCLE   seconds before a connection is replaced, default 3600
+  MUSCOPE_DB_POOL_PRE_PING  test connections before use if not 0, default 1
+
+In-memory SQLite databases use one shared connection so every session sees the same database.
+"""
+import atexit
+import contextlib
+import os
+import threading
+
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from orminator import session_manager
+
+
+_engines = dict()
+_sessionmakers = dict()
+_engines_lock = threading.Lock()
+
+
+def is_in_memory_sqlite(db_uri):
+    url = sa.engine.url.make_url(db_uri)
+    return url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:')
+
+
+def create_engine(db_uri, echo=False):
+    url = sa.engine.url.make_url(db_uri)
+    if is_in_memory_sqlite(db_uri):
+        return sa.create_engine(
+            url,
+            echo=echo,
+            connect_args={'check_same_thread': False},
+            poolclass=StaticPool)
+    elif url.drivername.startswith('sqlite'):
+        # SQLite files get the default SQLAlchemy pool
+        return sa.create_engine(url, echo=echo)
+    else:
+        return sa.create_engine(
+            url,
+            echo=echo,
+            pool_size=int(os.environ.get('MUSCOPE_DB_POOL_SIZE', 5)),
+            max_overflow=int(os.environ.get('MUSCOPE_DB_MAX_OVERFLOW', 10)),
+            pool_recycle=int(os.environ.get('MUSCOPE_DB_POOL_RECYCLE', 3600)),
+            pool_pre_ping=int(os.environ.get('MUSCOPE_DB_POOL_PRE_PING', 1)) != 0)
+
+
+def get_engine(db_uri):
+    """Return the process-wide engine for db_uri."""
+    with _engines_lock:
+        if db_uri not in _engines:
+            _engines[db_uri] = create_engine(db_uri)
+            _sessionmakers[db_uri] = sessionmaker(bind=_engines[db_uri])
+        return _engines[db_uri]
+
+
+def get_sessionmaker(db_uri):
+    get_engine(db_uri)
+    return _sessionmakers[db_uri]
+
+
+def dispose_engine(db_uri):
+    """Close the connections for db_uri, for example before a SQLite file is deleted."""
+    with _engines_lock:
+        engine = _engines.pop(db_uri, None)
+        _sessionmakers.pop(db_uri, None)
+    if engine is not None:
+        engine.dispose()
+
+
+def dispose_engines():
+    with _engines_lock:
+        engines = list(_engines.values())
+        _engines.clear()
+        _sessionmakers.clear()
+    for engine in engines:
+        engine.dispose()
+
+
+atexit.register(dispose_engines)
+
+
+@contextlib.contextmanager
+def session_manager_from_db_uri(db_uri):
+    """Like orminator.session_manager_from_db_uri but the engine is shared."""
+    with session_manager(get_sessionmaker(db_uri)) as session:
+        yield session
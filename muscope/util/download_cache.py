@@ -0,0 +1,179 @@
+"""
+A local cache of files downloaded from the iRODS data store.
+
+Cached files are keyed by the iRODS checksum and modify time of the data object so
+an unchanged data object is not transferred again. The cache directory is bounded in
+size and the least recently used files are removed first. File locks make the cache
+safe to share between loader processes on the same machine: a file is downloaded under an
+exclusive lock and read under a shared lock, and evict() skips files that are locked.
+
+usage:
+    with get_download_cache().local_file(irods_session, data_object) as local_fp:
+        df = pd.read_excel(local_fp)
+"""
+import contextlib
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+
+from irods.keywords import FORCE_FLAG_KW
+
+import muscope
+
+
+def get_default_cache_dir():
+    return os.path.join(os.path.dirname(muscope.__file__), 'downloads', 'cache')
+
+
+def cache_key(data_object):
+    """Return a key for a data object record or iRODSDataObject that changes when its content changes.
+
+    Data objects without a checksum are keyed by path, size and modify time.
+    """
+    if data_object.checksum:
+        key_source = '{}|{}'.format(data_object.checksum, data_object.modify_time)
+    else:
+        key_source = '{}|{}|{}'.format(data_object.path, data_object.size, data_object.modify_time)
+    return hashlib.sha1(key_source.encode('utf-8')).hexdigest()
+
+
+@contextlib.contextmanager
+def file_lock(lock_fp, blocking=True, shared=False):
+    """Hold an exclusive (or shared) lock on lock_fp. Yield True, or False if blocking is False and the lock
+    is held by someone else.
+
+    Lock files can be removed by DownloadCache.evict while another process is waiting on them so the lock
+    is taken again if lock_fp was removed or replaced while waiting.
+    """
+    while True:
+        with open(lock_fp, 'a') as lock_file:
+            try:
+                lock_operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                fcntl.flock(lock_file, lock_operation if blocking else lock_operation | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                try:
+                    lock_file_is_current = os.stat(lock_fp).st_ino == os.fstat(lock_file.fileno()).st_ino
+                except FileNotFoundError:
+                    lock_file_is_current = False
+                if lock_file_is_current:
+                    yield True
+                    return
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class DownloadCache:
+    def __init__(self, cache_dir=None, max_bytes=2**30):
+        """
+
+        :param cache_dir: (str) directory for cached files, the default is muscope/downloads/cache
+        :param max_bytes: (int) cached files beyond this total size are removed, least recently used first
+        """
+        self.cache_dir = get_default_cache_dir() if cache_dir is None else cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(self.cache_dir, 'locks'), exist_ok=True)
+
+    def cached_file_path(self, data_object):
+        # keep the extension so pandas can choose a spreadsheet engine
+        return os.path.join(
+            self.cache_dir,
+            cache_key(data_object) + os.path.splitext(data_object.name)[1])
+
+    def lock_file_path(self, cached_fp):
+        return os.path.join(self.cache_dir, 'locks', os.path.basename(cached_fp) + '.lock')
+
+    @contextlib.contextmanager
+    def local_file(self, irods_session, data_object):
+        """Yield the path of a local copy of data_object, downloading it only if it is not cached.
+        The file is not removed from the cache until the with block ends.
+
+        :param irods_session: iRODSSession used for downloads
+        :param data_object: DataObjectRecord or iRODSDataObject with path, name, size, checksum and modify_time
+        """
+        cached_fp = self.cached_file_path(data_object)
+        lock_fp = self.lock_file_path(cached_fp)
+        while True:
+            with file_lock(lock_fp, shared=True):
+                if os.path.exists(cached_fp):
+                    print('found "{}" in download cache "{}"'.format(data_object.path, cached_fp))
+                    # mark this file recently used
+                    os.utime(cached_fp)
+                    yield cached_fp
+                    return
+
+            with file_lock(lock_fp):
+                # another process may have downloaded the file while this one waited for the lock
+                if not os.path.exists(cached_fp):
+                    self.download(irods_session, data_object, cached_fp)
+
+            self.evict(keep_fp=cached_fp)
+            # the file is read under a shared lock, it is downloaded again if it was evicted in the meantime
+
+    def local_file_by_path(self, irods_session, data_object_path):
+        """Look up the checksum and modify time of a data object then return local_file() for it."""
+        return self.local_file(irods_session, irods_session.data_objects.get(data_object_path))
+
+    def download(self, irods_session, data_object, cached_fp):
+        """Download data_object to cached_fp. Call with the lock for cached_fp held."""
+        print('downloading "{}" to "{}"'.format(data_object.path, cached_fp))
+        fd, download_fp = tempfile.mkstemp(dir=self.cache_dir, suffix='.download')
+        os.close(fd)
+        try:
+            irods_session.data_objects.get(data_object.path, download_fp, **{FORCE_FLAG_KW: True})
+            os.replace(download_fp, cached_fp)
+        finally:
+            if os.path.exists(download_fp):
+                os.remove(download_fp)
+
+    def evict(self, keep_fp=None):
+        """Remove least recently used files until the cache is no larger than max_bytes.
+        Locked files, for example files that are being downloaded or read in local_file(), are skipped.
+
+        :param keep_fp: (str) optional path of a cached file that must not be removed
+        """
+        with file_lock(os.path.join(self.cache_dir, 'locks', 'evict.lock')):
+            cached_files = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.endswith('.download'):
+                    entry_stat = entry.stat()
+                    cached_files.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+
+            cache_bytes = sum(size for _, size, _ in cached_files)
+            for _, size, cached_fp in sorted(cached_files):
+                if cache_bytes <= self.max_bytes:
+                    break
+                elif cached_fp == keep_fp:
+                    continue
+                lock_fp = self.lock_file_path(cached_fp)
+                with file_lock(lock_fp, blocking=False) as locked:
+                    if not locked:
+                        print('not removing "{}" from download cache, it is in use'.format(cached_fp))
+                        continue
+                    print('removing "{}" from download cache'.format(cached_fp))
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(cached_fp)
+                    # processes waiting on the lock file take a new one when they see it is gone
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(lock_fp)
+                cache_bytes -= size
+
+
+_download_cache = None
+_download_cache_lock = threading.Lock()
+
+
+def get_download_cache():
+    """Return the process-wide download cache. The cache size limit can be set with the environment
+    variable MUSCOPE_DOWNLOAD_CACHE_MAX_BYTES, the default is 1GB.
+    """
+    global _download_cache
+    with _download_cache_lock:
+        if _download_cache is None:
+            _download_cache = DownloadCache(
+                max_bytes=int(os.environ.get('MUSCOPE_DOWNLOAD_CACHE_MAX_BYTES', 2**30)))
+        return _download_cache
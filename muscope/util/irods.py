@@ -1,16 +1,203 @@
+import atexit
+import bisect
+import concurrent.futures
+import contextlib
+import heapq
 import os
+import threading
+import time
 
 from muscope.util import take
+from muscope.util.catalog import Catalog, CollectionRecord, DataObjectRecord
 
+from irods.column import Like
 from irods.keywords import FORCE_FLAG_KW
+from irods.models import Collection, DataObject
 from irods.session import iRODSSession
-from irods.exception import CAT_NO_ROWS_FOUND, CollectionDoesNotExist, DataObjectDoesNotExist
+from irods.exception import CAT_NO_ROWS_FOUND, CollectionDoesNotExist, DataObjectDoesNotExist, NetworkException
 
 
-def irods_session_manager():
+def irods_session_factory():
     return iRODSSession(irods_env_file=os.path.expanduser('~/.irods/irods_environment.json'))
 
 
+def irods_session_is_healthy(irods_session):
+    """Run a one-row catalog query to check that a session can still reach the server."""
+    try:
+        irods_session.query(Collection.id).filter(Collection.name == '/' + irods_session.zone).first()
+        return True
+    except Exception as e:
+        print('iRODS session failed health check: {}'.format(e))
+        return False
+
+
+class IrodsSessionPool:
+    """A thread-safe pool of authenticated iRODS sessions.
+
+    Sessions are created on demand up to size and returned to the pool when a borrower is done
+    with them. There is no background thread: sessions idle for longer than max_idle_seconds are
+    cleaned up the next time a session is borrowed or given back, and all idle sessions are cleaned
+    up by close(). Sessions idle for longer than health_check_seconds are checked with health_check
+    before they are lent out.
+    A session is discarded rather than returned if the borrower raised a NetworkException.
+
+    usage:
+        with pool.session() as irods_session:
+            irods_session.collections.get(...)
+    """
+    def __init__(
+            self,
+            size=4,
+            max_idle_seconds=300.0,
+            health_check_seconds=30.0,
+            health_check=irods_session_is_healthy,
+            session_factory=irods_session_factory):
+        self.size = size
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_seconds = health_check_seconds
+        self.health_check = health_check
+        self.session_factory = session_factory
+
+        self._condition = threading.Condition()
+        # (session, time returned to the pool) with the most recently used session last
+        self._idle_sessions = []
+        self._session_count = 0
+        self._closed = False
+
+    def _evict_idle_sessions(self):
+        """Remove sessions idle for too long and return them. Call with the lock held."""
+        now = time.monotonic()
+        evicted_sessions = [s for s, t in self._idle_sessions if now - t > self.max_idle_seconds]
+        self._idle_sessions = [(s, t) for s, t in self._idle_sessions if now - t <= self.max_idle_seconds]
+        self._session_count -= len(evicted_sessions)
+        return evicted_sessions
+
+    def _cleanup(self, irods_sessions):
+        for irods_session in irods_sessions:
+            try:
+                irods_session.cleanup()
+            except Exception as e:
+                print('failed to clean up iRODS session: {}'.format(e))
+
+    def borrow(self):
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise RuntimeError('iRODS session pool is closed')
+                evicted_sessions = self._evict_idle_sessions()
+                # close() wakes up borrowers waiting here
+                while not self._closed and len(self._idle_sessions) == 0 and self._session_count >= self.size:
+                    self._condition.wait()
+                pool_closed = self._closed
+                if pool_closed:
+                    irods_session, returned_time = None, None
+                elif len(self._idle_sessions) > 0:
+                    irods_session, returned_time = self._idle_sessions.pop()
+                else:
+                    irods_session, returned_time = None, None
+                    self._session_count += 1
+
+            self._cleanup(evicted_sessions)
+            if pool_closed:
+                raise RuntimeError('iRODS session pool is closed')
+
+            if irods_session is None:
+                try:
+                    return self.session_factory()
+                except Exception:
+                    self._discard(None)
+                    raise
+            elif self.health_check is None \
+                    or time.monotonic() - returned_time < self.health_check_seconds \
+                    or self.health_check(irods_session):
+                return irods_session
+            else:
+                self._discard(irods_session)
+
+    def give_back(self, irods_session):
+        with self._condition:
+            if not self._closed:
+                evicted_sessions = self._evict_idle_sessions()
+                self._idle_sessions.append((irods_session, time.monotonic()))
+                self._condition.notify_all()
+            else:
+                evicted_sessions = None
+        if evicted_sessions is None:
+            self._discard(irods_session)
+        else:
+            self._cleanup(evicted_sessions)
+
+    def _discard(self, irods_session):
+        with self._condition:
+            self._session_count -= 1
+            self._condition.notify()
+        if irods_session is not None:
+            self._cleanup([irods_session])
+
+    @contextlib.contextmanager
+    def session(self):
+        irods_session = self.borrow()
+        try:
+            yield irods_session
+        except NetworkException:
+            self._discard(irods_session)
+            raise
+        except BaseException:
+            self.give_back(irods_session)
+            raise
+        else:
+            self.give_back(irods_session)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle_sessions = [s for s, _ in self._idle_sessions]
+            self._session_count -= len(idle_sessions)
+            self._idle_sessions = []
+            self._condition.notify_all()
+        self._cleanup(idle_sessions)
+
+
+_irods_session_pool = None
+_irods_session_pool_lock = threading.Lock()
+
+
+def configure_irods_session_pool(**kwargs):
+    """Replace the process-wide session pool with one built from the keyword arguments
+    accepted by IrodsSessionPool. Idle sessions in the old pool are cleaned up.
+    """
+    global _irods_session_pool
+    with _irods_session_pool_lock:
+        old_pool = _irods_session_pool
+        _irods_session_pool = IrodsSessionPool(**kwargs)
+    if old_pool is not None:
+        old_pool.close()
+    return _irods_session_pool
+
+
+def get_irods_session_pool():
+    """Return the process-wide session pool. The pool size can be set with the environment
+    variable MUSCOPE_IRODS_SESSION_POOL_SIZE, the default is 4.
+    """
+    global _irods_session_pool
+    with _irods_session_pool_lock:
+        if _irods_session_pool is None:
+            _irods_session_pool = IrodsSessionPool(
+                size=int(os.environ.get('MUSCOPE_IRODS_SESSION_POOL_SIZE', 4)))
+            atexit.register(_irods_session_pool.close)
+        return _irods_session_pool
+
+
+def irods_session_manager():
+    """Borrow a session from the process-wide pool.
+
+    usage:
+        with irods_session_manager() as irods_session:
+            ...
+    """
+    return get_irods_session_pool().session()
+
+
 def irods_collection_exists(irods_session, collection_path):
     try:
         irods_session.collections.get(collection_path)
@@ -83,6 +270,53 @@ def irods_data_object_exists(irods_session, target_path):
         return False
 
 
+def irods_path_status(irods_session, path):
+    """Return 'present_as_object', 'present_as_collection' or 'missing' for path."""
+    if irods_data_object_exists(irods_session=irods_session, target_path=path):
+        return 'present_as_object'
+    elif irods_collection_exists(irods_session=irods_session, collection_path=path):
+        return 'present_as_collection'
+    else:
+        return 'missing'
+
+
+def check_paths(paths, concurrency=8, path_status=irods_path_status):
+    """Yield (path, status, error message) for each path in the order the checks finish.
+
+    The checks run on a pool of concurrency threads, each borrowing a session from the session
+    pool for every check, so the pool should have at least concurrency sessions. No more than
+    2 * concurrency checks are queued at a time so paths can be any iterable.
+
+    :param paths: iterable of iRODS paths
+    :param concurrency: (int) number of checks running at the same time
+    :param path_status: function (irods_session, path) -> status such as irods_path_status
+    :return: generator of (path, status, error message), status is 'error' if the check raised an
+             exception and the error message is None otherwise
+    """
+    def check(path):
+        try:
+            with irods_session_manager() as irods_session:
+                return path, path_status(irods_session, path), None
+        except Exception as e:
+            return path, 'error', '{}: {}'.format(type(e).__name__, e)
+
+    concurrency = max(1, concurrency)
+    paths = iter(paths)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    pending_futures = {executor.submit(check, path) for path in take(2 * concurrency, paths)}
+    try:
+        while len(pending_futures) > 0:
+            done_futures, pending_futures = concurrent.futures.wait(
+                pending_futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            pending_futures.update(executor.submit(check, path) for path in take(len(done_futures), paths))
+            for done_future in done_futures:
+                yield done_future.result()
+    finally:
+        for pending_future in pending_futures:
+            pending_future.cancel()
+        executor.shutdown(wait=True)
+
+
 def irods_delete(irods_session, target_path):
     try:
         irods_session.data_objects.unlink(path=target_path, force=True)
@@ -97,36 +331,202 @@ def irods_delete_collection(irods_session, target_collection_path):
         print('unable to delete collection "{}" because it does not exist'.format(target_collection_path))
 
 
-def walk(walk_root, verbose=False):
+def walk(walk_root, verbose=False, bulk_listing=False, prefetch=4):
+    """Yield (collection, subcollections, data objects) for walk_root and every collection
+    below it in sorted path order.
+
+    Collections waiting to be visited are kept in a heap of paths so the order is the same
+    as sorting the whole tree by path. The next prefetch paths are taken off the heap into a
+    short sorted list and their listings are fetched on a pool of prefetch threads, each borrowing
+    a session from the session pool, while the caller handles the current collection. A new
+    subcollection that sorts before the end of the list takes the place of the last path, which
+    goes back on the heap. Each collection costs a few heap operations however wide the tree is.
+    At most prefetch listings are held in memory at any time.
+
+    Listings borrow from the same session pool as the caller, who may be holding a session
+    already, so at most pool size - 1 listing threads are used and the pool must have room for
+    at least 2 sessions.
+
+    The two modes yield different types with the same attributes path and name:
+      - by default (iRODSCollection, [iRODSCollection, ...], [iRODSDataObject, ...])
+      - with bulk_listing=True (CollectionRecord, [CollectionRecord, ...], [DataObjectRecord, ...])
+        from muscope.util.catalog, data object records also have collection_path, size, checksum
+        and modify_time but are not iRODS objects and cannot be opened
+
+    :param walk_root: (str) path of the root collection
+    :param verbose: (bool) print the walk root
+    :param bulk_listing: (bool) list the whole tree with catalog queries and yield records
+                         rather than collection objects
+    :param prefetch: (int) maximum number of listings held in memory and number of listing threads, limited
+                     by the session pool size
+    :raises ValueError: if the session pool has room for only one session
+    """
     if verbose:
         print('walk root is "{}"'.format(walk_root))
 
-    with irods_session_manager() as irods_session:
-        collection_stack = list()
-        p = irods_session.collections.get(walk_root)
-        collection_stack.append(p)
-        while len(collection_stack) > 0:
-            parent_collection = collection_stack.pop(0)
-            yield parent_collection, parent_collection.subcollections, parent_collection.data_objects
-            for s in parent_collection.subcollections:
-                collection_stack.insert(0, s)
-            # keep the stack in sorted order for reproducible behavior
-            collection_stack.sort(key=lambda c: c.path)
+    irods_session_pool = get_irods_session_pool()
+    if irods_session_pool.size < 2:
+        raise ValueError(
+            'walk needs an iRODS session pool with room for 2 or more sessions, '
+            'set MUSCOPE_IRODS_SESSION_POOL_SIZE to at least 2')
+
+    if bulk_listing:
+        # yield records rather than collection objects in the same order
+        with irods_session_pool.session() as irods_session:
+            catalog = build_catalog(irods_session, walk_root)
+        yield from catalog.path_order()
+        return
+
+    def list_collection(collection_path):
+        with irods_session_pool.session() as irods_session:
+            collection = irods_session.collections.get(collection_path)
+            return collection, list(collection.subcollections), list(collection.data_objects)
+
+    prefetch = max(1, prefetch)
+    # leave one session for the caller
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(prefetch, irods_session_pool.size - 1))
+    listing_futures = dict()
+    # every path in next_collection_paths sorts before every path in collection_heap
+    next_collection_paths = [walk_root]
+    collection_heap = []
+    try:
+        while len(next_collection_paths) > 0:
+            collection_path = next_collection_paths.pop(0)
+            listing_future = listing_futures.pop(collection_path, None)
+            if listing_future is None:
+                listing_future = executor.submit(list_collection, collection_path)
+            parent_collection, subcollections, data_objects = listing_future.result()
+
+            for s in subcollections:
+                if len(next_collection_paths) > 0 and s.path < next_collection_paths[-1]:
+                    bisect.insort(next_collection_paths, s.path)
+                else:
+                    heapq.heappush(collection_heap, s.path)
+            while len(next_collection_paths) > prefetch:
+                # this path will be listed again when it comes back off the heap
+                overtaken_collection_path = next_collection_paths.pop()
+                overtaken_listing_future = listing_futures.pop(overtaken_collection_path, None)
+                if overtaken_listing_future is not None:
+                    overtaken_listing_future.cancel()
+                heapq.heappush(collection_heap, overtaken_collection_path)
+            while len(next_collection_paths) < prefetch and len(collection_heap) > 0:
+                next_collection_paths.append(heapq.heappop(collection_heap))
+
+            # the paths in next_collection_paths are the collections that will be visited next
+            for next_collection_path in next_collection_paths:
+                if next_collection_path not in listing_futures:
+                    listing_futures[next_collection_path] = executor.submit(list_collection, next_collection_path)
+
+            yield parent_collection, subcollections, data_objects
+    finally:
+        for listing_future in listing_futures.values():
+            listing_future.cancel()
+        executor.shutdown(wait=True)
+
+
+class GenQueryCatalogBackend:
+    """List collections and data objects with paged general queries against the iRODS catalog.
+
+    Each method yields one list of records per page of query results so a listing of
+    any size costs a few catalog round-trips rather than one per collection.
+    """
+    def __init__(self, irods_session):
+        self.irods_session = irods_session
+
+    def collection_batches(self, parent_like):
+        """Yield lists of CollectionRecord for collections whose parent path matches the SQL LIKE pattern."""
+        query = self.irods_session.query(Collection.name).filter(Like(Collection.parent_name, parent_like))
+        for result_set in query.get_batches():
+            yield [
+                CollectionRecord(path=row[Collection.name], name=os.path.basename(row[Collection.name]))
+                for row
+                in result_set]
+
+    def data_object_batches(self, collection_like):
+        """Yield lists of DataObjectRecord for data objects whose collection path matches the SQL LIKE pattern.
+        There is one record per replica.
+        """
+        query = self.irods_session.query(
+            Collection.name,
+            DataObject.name,
+            DataObject.size,
+            DataObject.checksum,
+            DataObject.modify_time).filter(Like(Collection.name, collection_like))
+        for result_set in query.get_batches():
+            yield [
+                DataObjectRecord(
+                    path=os.path.join(row[Collection.name], row[DataObject.name]),
+                    collection_path=row[Collection.name],
+                    name=row[DataObject.name],
+                    size=row[DataObject.size],
+                    checksum=row[DataObject.checksum],
+                    modify_time=row[DataObject.modify_time])
+                for row
+                in result_set]
+
+
+def list_collection_tree(collection_root, backend):
+    """Return flat lists of every collection and data object under collection_root.
+
+    :param collection_root: (str) path of the root collection
+    :param backend: an object with collection_batches and data_object_batches methods
+                    such as GenQueryCatalogBackend
+    :return: (list of CollectionRecord, list of DataObjectRecord) not including the root collection
+    """
+    collection_root = collection_root.rstrip('/')
+
+    def in_tree(path):
+        # LIKE patterns can match sibling collections such as "<root>2" so check the paths here
+        return path == collection_root or path.startswith(collection_root + '/')
+
+    collection_records = [
+        collection_record
+        for collection_batch in backend.collection_batches(collection_root + '%')
+        for collection_record in collection_batch
+        if in_tree(collection_record.path)]
+
+    # a data object with several replicas will be listed once for each replica
+    data_object_records = []
+    data_object_paths = set()
+    for data_object_batch in backend.data_object_batches(collection_root + '%'):
+        for data_object_record in data_object_batch:
+            if in_tree(data_object_record.collection_path) and data_object_record.path not in data_object_paths:
+                data_object_paths.add(data_object_record.path)
+                data_object_records.append(data_object_record)
+
+    return collection_records, data_object_records
+
+
+def build_catalog(irods_session, collection_root, backend=None):
+    """List the collection tree under collection_root with bulk catalog queries and return
+    an in-memory Catalog of its collections and data objects.
+
+    :param irods_session: an iRODSSession, ignored if backend is specified
+    :param collection_root: (str) path of the root collection
+    :param backend: optional listing backend, the default is GenQueryCatalogBackend(irods_session)
+    :return: muscope.util.catalog.Catalog
+    """
+    if backend is None:
+        backend = GenQueryCatalogBackend(irods_session)
+    collection_records, data_object_records = list_collection_tree(collection_root, backend)
+    return Catalog(collection_root, collection_records, data_object_records)
 
 
 def get_project_sample_collection_paths(
         collection_root='/iplant/home/shared/imicrobe/projects',
-        sample_limit=None):
+        sample_limit=None,
+        backend=None):
     """Return a dictionary of project paths to lists of sample paths.
 
     This function is intended to be used to get a complete listing of sample collection paths.
-    Walking the collections looking for specific files takes a lot of time so this is an attempt
-    at a faster solution.
+    Walking the collections looking for specific files takes a lot of time so this function lists
+    all project collections with one catalog query and all sample collections with another.
 
     The original application for this function was finding UProC results files.
 
     :param collection_root: the top of the collection tree to be searched
     :param sample_limit: maximum number of samples to return
+    :param backend: optional listing backend, the default is GenQueryCatalogBackend
     :return: dictionary such as
         {
             '/project/alice/': ['/project/alice/samples/abe', '/project/alice/samples/aoife', ...],
@@ -134,40 +534,63 @@ def get_project_sample_collection_paths(
             ...
         }
     """
+    if backend is None:
+        with irods_session_manager() as irods_session:
+            return get_project_sample_collection_paths(
+                collection_root=collection_root,
+                sample_limit=sample_limit,
+                backend=GenQueryCatalogBackend(irods_session))
+
+    collection_root = collection_root.rstrip('/')
+
+    # from the top
+    project_collections = sorted(
+        (
+            c
+            for collection_batch in backend.collection_batches(collection_root)
+            for c in collection_batch
+            if os.path.dirname(c.path) == collection_root),
+        key=lambda c: c.path)
+
+    project_to_sample_collection_list = {p.path: [] for p in project_collections}
+    for collection_batch in backend.collection_batches(collection_root + '/%/samples'):
+        for sample_collection in collection_batch:
+            samples_collection_path = os.path.dirname(sample_collection.path)
+            project_collection_path = os.path.dirname(samples_collection_path)
+            if os.path.basename(samples_collection_path) == 'samples' \
+                    and project_collection_path in project_to_sample_collection_list:
+                project_to_sample_collection_list[project_collection_path].append(sample_collection)
+
     sample_total = 0
     project_to_sample_collections = dict()
 
-    with irods_session_manager() as irods_session:
-        # from the top
-        project_collections = irods_session.collections.get(collection_root).subcollections
-        for project_collection in project_collections:
-            samples_collection_path = os.path.join(project_collection.path, 'samples')
-            try:
-                sample_collections_for_project = irods_session.collections.get(samples_collection_path).subcollections
-                print('{} sample collection(s) for project {}'.format(
-                    len(sample_collections_for_project),
-                    project_collection.name))
-                # '\n\t'.join([s.name for s in sample_collections_for_project])))
-            except CollectionDoesNotExist:
-                print('collection "{}" does not exist'.format(samples_collection_path))
-                sample_collections_for_project = []
-
-            if sample_limit is None:
-                sample_path_list = [
-                    s.path for s
-                    in sample_collections_for_project]
-            else:
-                sample_path_list = [
-                    s.path for s
-                    in take((sample_limit - sample_total), sample_collections_for_project)]
-
-            sample_total += len(sample_path_list)
-            project_to_sample_collections[project_collection.path] = sample_path_list
-
-            if sample_limit is not None and sample_limit <= sample_total:
-                print('sample limit {} has been reached'.format(sample_limit))
-                break
-            else:
-                pass
+    for project_collection in project_collections:
+        sample_collections_for_project = sorted(
+            project_to_sample_collection_list[project_collection.path],
+            key=lambda c: c.path)
+        if len(sample_collections_for_project) == 0:
+            print('no sample collections in "{}"'.format(os.path.join(project_collection.path, 'samples')))
+        else:
+            print('{} sample collection(s) for project {}'.format(
+                len(sample_collections_for_project),
+                project_collection.name))
+
+        if sample_limit is None:
+            sample_path_list = [
+                s.path for s
+                in sample_collections_for_project]
+        else:
+            sample_path_list = [
+                s.path for s
+                in take((sample_limit - sample_total), sample_collections_for_project)]
+
+        sample_total += len(sample_path_list)
+        project_to_sample_collections[project_collection.path] = sample_path_list
+
+        if sample_limit is not None and sample_limit <= sample_total:
+            print('sample limit {} has been reached'.format(sample_limit))
+            break
+        else:
+            pass
 
     return project_to_sample_collections
@@ -0,0 +1,236 @@
+"""
+A local cache of the pandas.DataFrames produced by spreadsheet parse functions.
+
+Parsing .xls and .xlsx files is slow so the result of each parse function is stored
+column by column: numeric and datetime columns as .npy files that are memory-mapped
+when they are loaded, all other columns as pickled Series.
+
+Entries are keyed by
+  - the parse function name,
+  - a key for the source file, for example muscope.util.download_cache.cache_key(data_object),
+  - any keyword arguments given to the parse function, and
+  - a version computed from the source code of the parse function and the functions it depends on.
+
+Entries can also record the path of their source, for example the iRODS path of a spreadsheet.
+When a source changes, its new entry replaces the entries made from the earlier content of the
+same path, so cached() yields one current entry for each source path.
+
+Changing the code of a parse function (or of a function listed in depends_on) changes its version
+so stale entries are never loaded. Increment PARSE_CACHE_VERSION to invalidate every entry, for
+example when a parse function changes behavior through code that is not listed in depends_on.
+"""
+import hashlib
+import inspect
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+import muscope
+
+
+PARSE_CACHE_VERSION = 1
+
+
+def get_default_cache_dir():
+    return os.path.join(os.path.dirname(muscope.__file__), 'downloads', 'parse_cache')
+
+
+def parser_version(*functions):
+    """Return a version string that changes when the source code of any of the functions changes.
+    Objects that are not functions or classes, for example parse rules, contribute their repr.
+    """
+    version_source = [str(PARSE_CACHE_VERSION), pd.__version__]
+    for f in functions:
+        if not (inspect.isroutine(f) or inspect.isclass(f)):
+            version_source.append(repr(f))
+            continue
+        try:
+            version_source.append(inspect.getsource(f))
+        except (OSError, TypeError):
+            # no source file is available so fall back to the byte code
+            version_source.append(repr((f.__code__.co_code, f.__code__.co_consts)))
+    return hashlib.sha1('\n'.join(version_source).encode('utf-8')).hexdigest()[:16]
+
+
+def concat_columns(column_list):
+    """Return a DataFrame of the Series in column_list without copying them, so memory-mapped columns stay
+    memory-mapped.
+    """
+    if int(pd.__version__.split('.')[0]) >= 3:
+        # pandas 3 does not copy here (copy-on-write) and deprecates the copy keyword
+        return pd.concat(column_list, axis=1)
+    else:
+        return pd.concat(column_list, axis=1, copy=False)
+
+
+def memory_mappable(series):
+    return isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biufmM'
+
+
+class ParseCache:
+    def __init__(self, cache_dir=None):
+        self.cache_dir = get_default_cache_dir() if cache_dir is None else cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def entry_dir(self, name, source_key, version, kwargs=None):
+        if kwargs:
+            source_key = hashlib.sha1(
+                '{}|{}'.format(source_key, sorted(kwargs.items())).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name, source_key, version)
+
+    def get(self, name, source_key, version, kwargs=None):
+        """Return the cached DataFrame or None if there is no entry."""
+        entry_dp = self.entry_dir(name, source_key, version, kwargs)
+        if not os.path.exists(entry_dp):
+            return None
+
+        with open(os.path.join(entry_dp, 'frame.pickle'), 'rb') as frame_file:
+            frame_info = pickle.load(frame_file)
+
+        column_list = []
+        for i, column_is_mapped in enumerate(frame_info['memory_mapped']):
+            if column_is_mapped:
+                # copy-on-write so callers can modify the DataFrame without touching the cache, and a plain
+                # ndarray view of the memory map so columns compare equal to freshly parsed ones
+                column_list.append(pd.Series(
+                    np.load(os.path.join(entry_dp, '{}.npy'.format(i)), mmap_mode='c').view(np.ndarray),
+                    index=frame_info['index'],
+                    copy=False))
+            else:
+                column_list.append(pd.read_pickle(os.path.join(entry_dp, '{}.pickle'.format(i))))
+
+        if len(column_list) == 0:
+            df = pd.DataFrame(index=frame_info['index'], columns=frame_info['columns'])
+        else:
+            df = concat_columns(column_list)
+            df.columns = frame_info['columns']
+        return df
+
+    def put(self, name, source_key, version, df, kwargs=None, source_path=None):
+        entry_dp = self.entry_dir(name, source_key, version, kwargs)
+        source_dp = os.path.dirname(entry_dp)
+        os.makedirs(source_dp, exist_ok=True)
+        if source_path is not None:
+            self.put_source_info(name, source_dp, source_key, source_path)
+
+        # write to a temporary directory then rename it so readers never see a partial entry
+        temp_entry_dp = tempfile.mkdtemp(dir=source_dp, prefix='.')
+        try:
+            memory_mapped = []
+            for i in range(df.shape[1]):
+                column = df.iloc[:, i]
+                if memory_mappable(column):
+                    np.save(os.path.join(temp_entry_dp, '{}.npy'.format(i)), column.values)
+                    memory_mapped.append(True)
+                else:
+                    column.to_pickle(os.path.join(temp_entry_dp, '{}.pickle'.format(i)))
+                    memory_mapped.append(False)
+            with open(os.path.join(temp_entry_dp, 'frame.pickle'), 'wb') as frame_file:
+                pickle.dump(
+                    {'columns': df.columns, 'index': df.index, 'memory_mapped': memory_mapped},
+                    frame_file)
+            os.rename(temp_entry_dp, entry_dp)
+        except OSError:
+            # another process stored the same entry first
+            if not os.path.exists(entry_dp):
+                raise
+        finally:
+            shutil.rmtree(temp_entry_dp, ignore_errors=True)
+
+        # remove entries written by older versions of the parse function
+        for other_version in os.listdir(source_dp):
+            if other_version == version or other_version.startswith('.'):
+                pass
+            elif os.path.isdir(os.path.join(source_dp, other_version)):
+                shutil.rmtree(os.path.join(source_dp, other_version), ignore_errors=True)
+
+    def source_info(self, name, source_dir_name):
+        """Return the dict stored by put_source_info for an entry directory or None."""
+        try:
+            with open(os.path.join(self.cache_dir, name, source_dir_name, 'source.pickle'), 'rb') as source_file:
+                return pickle.load(source_file)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def put_source_info(self, name, source_dp, source_key, source_path):
+        """Record the source path of the entries in source_dp and remove the entries made from earlier
+        content of the same path.
+        """
+        fd, temp_source_info_fp = tempfile.mkstemp(dir=source_dp, prefix='.')
+        with os.fdopen(fd, 'wb') as source_file:
+            pickle.dump({'source_key': source_key, 'source_path': source_path}, source_file)
+        os.replace(temp_source_info_fp, os.path.join(source_dp, 'source.pickle'))
+
+        for other_source_dir_name in os.listdir(os.path.join(self.cache_dir, name)):
+            other_source_info = self.source_info(name, other_source_dir_name)
+            if other_source_info is None:
+                pass
+            elif other_source_info['source_path'] == source_path and other_source_info['source_key'] != source_key:
+                print('removing superseded parse cache entry for "{}"'.format(source_path))
+                shutil.rmtree(os.path.join(self.cache_dir, name, other_source_dir_name), ignore_errors=True)
+
+    def parse(self, parse_function, source_fp, source_key, depends_on=(), source_path=None, **kwargs):
+        """Return parse_function(source_fp, **kwargs) from the cache if possible.
+
+        :param parse_function: function taking a file path and returning a pandas.DataFrame
+        :param source_fp: (str) path to the file to parse
+        :param source_key: (str) changes when the content of source_fp changes
+        :param depends_on: functions, classes or other objects used by parse_function whose changes should
+                           invalidate the cache
+        :param source_path: (str) optional path identifying the source, for example an iRODS path, entries for
+                            earlier content of this path are removed when a new entry is stored
+        :return: pandas.DataFrame
+        """
+        name = '{}.{}'.format(parse_function.__module__, parse_function.__name__)
+        version = parser_version(parse_function, *depends_on)
+
+        df = self.get(name, source_key, version, kwargs)
+        if df is None:
+            print('parsing "{}" with {}'.format(source_fp, name))
+            df = parse_function(source_fp, **kwargs)
+            self.put(name, source_key, version, df, kwargs, source_path=source_path)
+        else:
+            print('loaded parsed "{}" from parse cache'.format(source_fp))
+        return df
+
+    def cached(self, parse_function, depends_on=()):
+        """Yield (source_path, pandas.DataFrame) for every entry made by the current version of parse_function
+        with a source path, in source path order. Entries stored without a source path are not included.
+        """
+        name = '{}.{}'.format(parse_function.__module__, parse_function.__name__)
+        version = parser_version(parse_function, *depends_on)
+
+        name_dp = os.path.join(self.cache_dir, name)
+        if not os.path.exists(name_dp):
+            return
+        entries = []
+        for source_dir_name in os.listdir(name_dp):
+            source_info = self.source_info(name, source_dir_name)
+            if source_info is not None and os.path.exists(os.path.join(name_dp, source_dir_name, version)):
+                entries.append((source_info['source_path'], source_dir_name))
+        for source_path, source_dir_name in sorted(entries):
+            try:
+                df = self.get(name, source_dir_name, version)
+            except FileNotFoundError:
+                # another process replaced the entry
+                df = None
+            if df is not None:
+                yield source_path, df
+
+
+_parse_cache = None
+_parse_cache_lock = threading.Lock()
+
+
+def get_parse_cache():
+    """Return the process-wide parse cache."""
+    global _parse_cache
+    with _parse_cache_lock:
+        if _parse_cache is None:
+            _parse_cache = ParseCache()
+        return _parse_cache
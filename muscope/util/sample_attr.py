@@ -0,0 +1,197 @@
+"""
+Bulk insert of sample attributes.
+
+Adding a models.Sample_attr through the ORM costs one INSERT per attribute when the
+session flushes. SampleAttrWriter collects new attributes and inserts them with
+executemany in batches, and keeps an index of the attributes each sample already has
+so checking for an existing attribute does not scan sample.sample_attr_list.
+
+SampleAttrDiffWriter also compares new values with stored values and only writes
+attributes that have changed, with batched UPDATEs. If a sample is given two values for
+the same attribute type, for example from spreadsheet columns "Temp" and "temp", the first
+value is kept.
+"""
+import math
+
+import numpy as np
+import sqlalchemy as sa
+
+import muscope.models as models
+
+
+def foreign_key_values(mapped_class, relationship_name, related_object):
+    """Return {column name: value} for the foreign key columns of mapped_class that refer to related_object.
+
+    For example foreign_key_values(models.Sample_attr, 'sample', sample) returns {'sample_id': sample.sample_id}.
+    """
+    relationship = sa.inspect(mapped_class).relationships[relationship_name]
+    related_mapper = sa.inspect(related_object).mapper
+    return {
+        local_column.name: getattr(related_object, related_mapper.get_property_by_column(remote_column).key)
+        for local_column, remote_column
+        in relationship.local_remote_pairs}
+
+
+class SampleAttrWriter:
+    def __init__(self, session, batch_size=1000):
+        """
+
+        :param session: SQLAlchemy session for the muSCOPE database
+        :param batch_size: (int) number of rows in each executemany INSERT
+        """
+        self.session = session
+        self.batch_size = batch_size
+
+        # id(sample) -> (sample, {sample_attr_type: [existing Sample_attr or pending value, ...]})
+        self.sample_attr_index = dict()
+        self.pending = []
+
+        self.value_column_name = sa.inspect(models.Sample_attr).get_property('value').columns[0].name
+
+    def existing_sample_attrs(self, sample, sample_attr_type):
+        """Return a list of the attributes (or values waiting to be inserted) sample has with sample_attr_type."""
+        if id(sample) not in self.sample_attr_index:
+            sample_attrs_by_type = dict()
+            for sample_attr in sample.sample_attr_list:
+                sample_attrs_by_type.setdefault(sample_attr.sample_attr_type, []).append(sample_attr)
+            self.sample_attr_index[id(sample)] = (sample, sample_attrs_by_type)
+
+        _, sample_attrs_by_type = self.sample_attr_index[id(sample)]
+        return sample_attrs_by_type.get(sample_attr_type, [])
+
+    def add(self, sample, sample_attr_type, value):
+        """Queue a new attribute for sample. It is inserted by flush()."""
+        if isinstance(value, np.generic):
+            # database drivers do not all accept numpy scalars
+            value = value.item()
+        self.existing_sample_attrs(sample, sample_attr_type)
+        self.sample_attr_index[id(sample)][1].setdefault(sample_attr_type, []).append(value)
+        self.pending.append((sample, sample_attr_type, value))
+
+    def flush(self):
+        """Insert all queued attributes and return the number of rows inserted."""
+        if len(self.pending) == 0:
+            return 0
+
+        # new samples need primary keys before their attributes can be inserted
+        self.session.flush()
+
+        rows = []
+        for sample, sample_attr_type, value in self.pending:
+            row = {self.value_column_name: value}
+            row.update(foreign_key_values(models.Sample_attr, 'sample', sample))
+            row.update(foreign_key_values(models.Sample_attr, 'sample_attr_type', sample_attr_type))
+            rows.append(row)
+
+        sample_attr_table = models.Sample_attr.__table__
+        for b in range(0, len(rows), self.batch_size):
+            self.session.execute(sample_attr_table.insert(), rows[b:b+self.batch_size])
+
+        # the ORM does not know about the inserted rows
+        for sample in {id(s): s for s, _, _ in self.pending}.values():
+            self.session.expire(sample, ['sample_attr_list'])
+
+        print('inserted {} sample attribute(s) in {} batch(es)'.format(
+            len(rows), (len(rows) + self.batch_size - 1) // self.batch_size))
+        self.pending = []
+        self.sample_attr_index = dict()
+        return len(rows)
+
+
+def values_match(stored_value, new_value, rel_tol=1e-9, abs_tol=0.0):
+    """Return True if new_value is the same as the stored string value.
+    Numbers are compared with a tolerance and NaN matches NaN.
+    """
+    if stored_value is None:
+        return new_value is None
+    try:
+        stored_number = float(stored_value)
+        new_number = float(new_value)
+    except (TypeError, ValueError):
+        return str(stored_value) == str(new_value)
+    if math.isnan(stored_number) or math.isnan(new_number):
+        return math.isnan(stored_number) and math.isnan(new_number)
+    else:
+        return math.isclose(stored_number, new_number, rel_tol=rel_tol, abs_tol=abs_tol)
+
+
+class SampleAttrDiffWriter(SampleAttrWriter):
+    def __init__(self, session, batch_size=1000, rel_tol=1e-9, abs_tol=0.0):
+        """
+
+        :param session: SQLAlchemy session for the muSCOPE database
+        :param batch_size: (int) number of rows in each executemany INSERT or UPDATE
+        :param rel_tol: (float) relative tolerance for comparing numeric values
+        :param abs_tol: (float) absolute tolerance for comparing numeric values
+        """
+        super().__init__(session=session, batch_size=batch_size)
+        self.rel_tol = rel_tol
+        self.abs_tol = abs_tol
+        self.pending_updates = []
+        # (id(sample), id(sample_attr_type)) -> the first value given since the last flush
+        self.new_values = dict()
+        self.counts = {'unchanged': 0, 'updated': 0, 'inserted': 0, 'duplicate': 0}
+
+        sample_attr_mapper = sa.inspect(models.Sample_attr)
+        self.primary_key_column = sample_attr_mapper.primary_key[0]
+        self.primary_key_attribute = sample_attr_mapper.get_property_by_column(self.primary_key_column).key
+
+    def set_value(self, sample, sample_attr_type, value):
+        """Queue an INSERT or UPDATE if sample does not already have value for sample_attr_type.
+        A second value for the same sample and attribute type is ignored.
+
+        :return: (str) 'unchanged', 'updated', 'inserted' or 'duplicate'
+        """
+        value = str(value)
+        new_value_key = (id(sample), id(sample_attr_type))
+        existing_sample_attrs = self.existing_sample_attrs(sample, sample_attr_type)
+        if new_value_key in self.new_values:
+            first_value = self.new_values[new_value_key]
+            if not values_match(first_value, value, rel_tol=self.rel_tol, abs_tol=self.abs_tol):
+                print('sample "{}" was given two values for attribute "{}", keeping "{}" and ignoring "{}"'.format(
+                    sample.sample_name, sample_attr_type.type_, first_value, value))
+            change = 'duplicate'
+        elif len(existing_sample_attrs) == 0:
+            self.add(sample, sample_attr_type, value)
+            change = 'inserted'
+        else:
+            sample_attr = existing_sample_attrs[0]
+            stored_value = sample_attr if isinstance(sample_attr, str) else sample_attr.value
+            if values_match(stored_value, value, rel_tol=self.rel_tol, abs_tol=self.abs_tol):
+                change = 'unchanged'
+            elif isinstance(sample_attr, str):
+                # a value queued with add() is kept like the first value given to set_value
+                print('sample "{}" was given two values for attribute "{}", keeping "{}" and ignoring "{}"'.format(
+                    sample.sample_name, sample_attr_type.type_, sample_attr, value))
+                change = 'duplicate'
+            else:
+                self.pending_updates.append((sample_attr, value))
+                change = 'updated'
+        self.new_values.setdefault(new_value_key, value)
+        self.counts[change] += 1
+        return change
+
+    def flush(self):
+        """Insert and update all queued attributes and return the number of rows written."""
+        update_count = len(self.pending_updates)
+        if update_count > 0:
+            update_rows = [
+                {'_sample_attr_id': getattr(sample_attr, self.primary_key_attribute), '_value': value}
+                for sample_attr, value
+                in self.pending_updates]
+            update_statement = models.Sample_attr.__table__.update().where(
+                self.primary_key_column == sa.bindparam('_sample_attr_id')).values(
+                    {self.value_column_name: sa.bindparam('_value')})
+            for b in range(0, len(update_rows), self.batch_size):
+                self.session.execute(update_statement, update_rows[b:b+self.batch_size])
+            for sample_attr, _ in self.pending_updates:
+                self.session.expire(sample_attr, ['value'])
+            print('updated {} sample attribute(s)'.format(update_count))
+            self.pending_updates = []
+        self.new_values = dict()
+
+        return super().flush() + update_count
+
+    def report(self):
+        return ('{unchanged} unchanged, {updated} updated and {inserted} inserted sample attribute(s), '
+                '{duplicate} duplicate value(s) ignored').format(**self.counts)
@@ -0,0 +1,139 @@
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm
+from sqlalchemy.ext.declarative import declarative_base
+
+from muscope.util.bulk_delete import \
+    count_second_level_references, count_with_dependents, delete_with_dependents, find_dependents
+
+
+Base = declarative_base()
+
+sample_to_investigator = sa.Table(
+    'sample_to_investigator',
+    Base.metadata,
+    sa.Column('sample_to_investigator_id', sa.Integer, primary_key=True),
+    sa.Column('sample_id', sa.Integer, sa.ForeignKey('sample.sample_id')),
+    sa.Column('investigator_id', sa.Integer, sa.ForeignKey('investigator.investigator_id')))
+
+
+class Cruise(Base):
+    __tablename__ = 'cruise'
+    cruise_id = sa.Column(sa.Integer, primary_key=True)
+
+
+class Investigator(Base):
+    __tablename__ = 'investigator'
+    investigator_id = sa.Column(sa.Integer, primary_key=True)
+    last_name = sa.Column(sa.String(50))
+    sample_list = sa.orm.relationship('Sample', secondary=sample_to_investigator, back_populates='investigator_list')
+
+
+class Sample(Base):
+    __tablename__ = 'sample'
+    sample_id = sa.Column(sa.Integer, primary_key=True)
+    sample_name = sa.Column(sa.String(50))
+    cruise_id = sa.Column(sa.Integer, sa.ForeignKey('cruise.cruise_id'))
+    cruise = sa.orm.relationship(Cruise)
+    investigator_list = sa.orm.relationship(
+        Investigator, secondary=sample_to_investigator, back_populates='sample_list')
+    sample_attr_list = sa.orm.relationship('Sample_attr')
+    sample_file_list = sa.orm.relationship('Sample_file')
+
+
+class Sample_attr(Base):
+    __tablename__ = 'sample_attr'
+    sample_attr_id = sa.Column(sa.Integer, primary_key=True)
+    sample_id = sa.Column(sa.Integer, sa.ForeignKey('sample.sample_id'))
+    value = sa.Column(sa.String(50))
+
+
+class Sample_file(Base):
+    __tablename__ = 'sample_file'
+    sample_file_id = sa.Column(sa.Integer, primary_key=True)
+    sample_id = sa.Column(sa.Integer, sa.ForeignKey('sample.sample_id'))
+    file_ = sa.Column(sa.String(200))
+
+
+# refers to sample_file, not to sample
+sample_file_to_project = sa.Table(
+    'sample_file_to_project',
+    Base.metadata,
+    sa.Column('sample_file_to_project_id', sa.Integer, primary_key=True),
+    sa.Column('sample_file_id', sa.Integer, sa.ForeignKey('sample_file.sample_file_id')),
+    sa.Column('project_id', sa.Integer))
+
+
+def test_find_dependents():
+    dependents = find_dependents(Sample)
+    assert [(d.table.name, d.column.name) for d in dependents] == [
+        ('sample_to_investigator', 'sample_id'),
+        ('sample_attr', 'sample_id'),
+        ('sample_file', 'sample_id')]
+
+
+def get_session():
+    engine = sa.create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    return sa.orm.sessionmaker(bind=engine)()
+
+
+def test_delete_with_dependents():
+    session = get_session()
+
+    cruise = Cruise()
+    alice = Investigator(last_name='Alice')
+    bob = Investigator(last_name='Bob')
+    for s in range(10):
+        sample = Sample(sample_name='S{}'.format(s), cruise=cruise)
+        sample.investigator_list.append(alice if s < 7 else bob)
+        sample.sample_attr_list.extend([Sample_attr(value='1.0'), Sample_attr(value='2.0')])
+        sample.sample_file_list.append(Sample_file(file_='/iplant/S{}.fa'.format(s)))
+        session.add(sample)
+    session.commit()
+
+    sample_ids = [
+        sample_id
+        for sample_id,
+        in session.query(Sample.sample_id).join(Sample.investigator_list).filter(Investigator.last_name == 'Alice')]
+
+    expected_counts = {'sample_to_investigator': 7, 'sample_attr': 14, 'sample_file': 7, 'sample': 7}
+    assert count_with_dependents(session, Sample, sample_ids, batch_size=3) == expected_counts
+    assert delete_with_dependents(session, Sample, sample_ids, batch_size=3) == expected_counts
+
+    assert session.query(Sample).count() == 3
+    assert session.query(Sample_attr).count() == 6
+    assert session.query(Sample_file).count() == 3
+    assert len(alice.sample_list) == 0
+    assert len(bob.sample_list) == 3
+    assert session.query(Cruise).count() == 1
+
+
+def test_delete_with_second_level_references():
+    session = get_session()
+
+    for s in range(4):
+        sample = Sample(sample_name='S{}'.format(s))
+        sample.sample_attr_list.append(Sample_attr(value='1.0'))
+        sample.sample_file_list.append(Sample_file(file_='/iplant/S{}.fa'.format(s)))
+        session.add(sample)
+    session.commit()
+    sample_file_ids = [sample_file_id for sample_file_id, in session.query(Sample_file.sample_file_id)]
+    # only the last sample file belongs to a project
+    session.execute(sample_file_to_project.insert(), [{'sample_file_id': sample_file_ids[-1], 'project_id': 1}])
+    session.commit()
+
+    sample_ids = [sample_id for sample_id, in session.query(Sample.sample_id).order_by(Sample.sample_id)]
+    assert count_second_level_references(session, Sample, sample_ids, batch_size=3) == {
+        'sample_file_to_project.sample_file_id': 1}
+
+    # nothing is deleted, not even the batch before the sample file that belongs to a project
+    with pytest.raises(ValueError, match='sample_file_to_project.sample_file_id'):
+        delete_with_dependents(session, Sample, sample_ids, batch_size=3)
+    assert session.query(Sample).count() == 4
+    assert session.query(Sample_file).count() == 4
+
+    assert count_second_level_references(session, Sample, sample_ids[:3]) == {
+        'sample_file_to_project.sample_file_id': 0}
+    delete_with_dependents(session, Sample, sample_ids[:3])
+    assert session.query(Sample).count() == 1
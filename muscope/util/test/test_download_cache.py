@@ -0,0 +1,117 @@
+import fcntl
+import os
+
+from muscope.util.catalog import DataObjectRecord
+from muscope.util.download_cache import DownloadCache, file_lock
+
+
+class LocalSession:
+    """A stand-in for iRODSSession that downloads data objects from a dict of path -> content."""
+    class DataObjects:
+        def __init__(self, contents):
+            self.contents = contents
+            self.downloads = []
+
+        def get(self, path, local_fp, **kwargs):
+            self.downloads.append(path)
+            with open(local_fp, 'wt') as local_file:
+                local_file.write(self.contents[path])
+
+    def __init__(self, contents):
+        self.data_objects = LocalSession.DataObjects(contents)
+
+
+def data_object(path, checksum, modify_time):
+    return DataObjectRecord(
+        path=path,
+        collection_path=os.path.dirname(path),
+        name=os.path.basename(path),
+        size=10,
+        checksum=checksum,
+        modify_time=modify_time)
+
+
+def test_local_file(tmpdir):
+    download_cache = DownloadCache(cache_dir=str(tmpdir))
+    irods_session = LocalSession({'/zone/HOT273.xlsx': 'version 1'})
+
+    # a miss downloads the file
+    x = data_object('/zone/HOT273.xlsx', 'sha2:1', 1000)
+    with download_cache.local_file(irods_session, x) as local_fp:
+        assert local_fp.endswith('.xlsx')
+        with open(local_fp) as local_file:
+            assert local_file.read() == 'version 1'
+    assert irods_session.data_objects.downloads == ['/zone/HOT273.xlsx']
+
+    # a hit does not
+    with download_cache.local_file(irods_session, x) as cached_fp:
+        assert cached_fp == local_fp
+    assert len(irods_session.data_objects.downloads) == 1
+
+    # a new checksum or a new modify time means the data object changed
+    irods_session.data_objects.contents['/zone/HOT273.xlsx'] = 'version 2'
+    for changed_x in (data_object(x.path, 'sha2:2', 1000), data_object(x.path, 'sha2:1', 2000)):
+        with download_cache.local_file(irods_session, changed_x) as changed_fp:
+            assert changed_fp != local_fp
+            with open(changed_fp) as changed_file:
+                assert changed_file.read() == 'version 2'
+    assert len(irods_session.data_objects.downloads) == 3
+
+    # data objects without a checksum are keyed by path, size and modify time
+    no_checksum_x = data_object(x.path, None, 1000)
+    with download_cache.local_file(irods_session, no_checksum_x):
+        pass
+    with download_cache.local_file(irods_session, no_checksum_x):
+        pass
+    assert len(irods_session.data_objects.downloads) == 4
+
+
+def test_evict_skips_files_in_use(tmpdir):
+    download_cache = DownloadCache(cache_dir=str(tmpdir), max_bytes=0)
+    irods_session = LocalSession({'/zone/a.xlsx': 'a' * 10, '/zone/b.xlsx': 'b' * 10})
+
+    a = data_object('/zone/a.xlsx', 'sha2:a', 1000)
+    b = data_object('/zone/b.xlsx', 'sha2:b', 1000)
+    with download_cache.local_file(irods_session, a) as a_fp:
+        # downloading b evicts every other file that is not in use
+        with download_cache.local_file(irods_session, b) as b_fp:
+            assert os.path.exists(a_fp)
+            assert os.path.exists(b_fp)
+        download_cache.evict()
+        assert os.path.exists(a_fp)
+        assert not os.path.exists(b_fp)
+    download_cache.evict()
+    assert not os.path.exists(a_fp)
+
+
+def test_evict_skips_locked_files(tmpdir):
+    download_cache = DownloadCache(cache_dir=str(tmpdir), max_bytes=10)
+    cached_fps = []
+    for i, name in enumerate(('a.xls', 'b.xls', 'c.xls')):
+        cached_fp = os.path.join(str(tmpdir), name)
+        with open(cached_fp, 'wt') as cached_file:
+            cached_file.write('01234567')
+        # a.xls is the least recently used
+        os.utime(cached_fp, (1000.0 + i, 1000.0 + i))
+        with file_lock(download_cache.lock_file_path(cached_fp)) as locked:
+            assert locked
+        cached_fps.append(cached_fp)
+    a_fp, b_fp, c_fp = cached_fps
+
+    # another process is reading a.xls
+    with open(download_cache.lock_file_path(a_fp), 'a') as a_lock_file:
+        fcntl.flock(a_lock_file, fcntl.LOCK_EX)
+        download_cache.evict(keep_fp=c_fp)
+        fcntl.flock(a_lock_file, fcntl.LOCK_UN)
+
+    assert os.path.exists(a_fp)
+    assert os.path.exists(download_cache.lock_file_path(a_fp))
+    # the evicted file and its lock file are removed
+    assert not os.path.exists(b_fp)
+    assert not os.path.exists(download_cache.lock_file_path(b_fp))
+    assert os.path.exists(c_fp)
+
+    # a removed lock file is created again
+    with file_lock(download_cache.lock_file_path(b_fp)) as locked:
+        assert locked
+    assert os.path.exists(download_cache.lock_file_path(b_fp))
@@ -0,0 +1,343 @@
+import posixpath
+import re
+import threading
+import time
+
+import pytest
+
+from muscope.util.catalog import CollectionRecord, DataObjectRecord, collection_roots, reconcile
+import muscope.util.irods as irods
+
+
+class LocalCatalogBackend:
+    """A stand-in for GenQueryCatalogBackend that answers LIKE queries from in-memory tables.
+
+    Every page of results counts as one catalog round-trip.
+    """
+    def __init__(self, collection_paths, data_object_rows, page_size=500):
+        self.collection_paths = sorted(collection_paths)
+        # one row per replica (collection path, data object name, size, checksum, modify time)
+        self.data_object_rows = data_object_rows
+        self.page_size = page_size
+        self.round_trips = 0
+
+    @staticmethod
+    def like_re(like_pattern):
+        return re.compile(''.join(
+            '.*' if c == '%' else '.' if c == '_' else re.escape(c)
+            for c in like_pattern) + '$')
+
+    def pages(self, records):
+        for i in range(0, max(len(records), 1), self.page_size):
+            self.round_trips += 1
+            yield records[i:i + self.page_size]
+
+    def collection_batches(self, parent_like):
+        parent_re = self.like_re(parent_like)
+        yield from self.pages([
+            CollectionRecord(path=p, name=posixpath.basename(p))
+            for p in self.collection_paths
+            if parent_re.match(posixpath.dirname(p))])
+
+    def data_object_batches(self, collection_like):
+        collection_re = self.like_re(collection_like)
+        yield from self.pages([
+            DataObjectRecord(
+                path=posixpath.join(c, n), collection_path=c, name=n, size=size, checksum=checksum, modify_time=t)
+            for c, n, size, checksum, t in self.data_object_rows
+            if collection_re.match(c)])
+
+
+def build_tree(root, project_count, samples_per_project, files_per_sample):
+    collection_paths = [root]
+    data_object_rows = []
+    for p in range(project_count):
+        project_path = '{}/project_{}'.format(root, p)
+        samples_path = project_path + '/samples'
+        collection_paths.extend([project_path, samples_path])
+        for s in range(samples_per_project):
+            sample_path = '{}/sample_{}'.format(samples_path, s)
+            collection_paths.append(sample_path)
+            for f in range(files_per_sample):
+                data_object_rows.append((sample_path, 'reads_{}.fastq.gz'.format(f), 100, 'sha2:{}'.format(f), None))
+    return collection_paths, data_object_rows
+
+
+def test_build_catalog():
+    collection_paths, data_object_rows = build_tree('/zone/data', 3, 4, 2)
+    # a sibling of the root that a LIKE pattern will also match
+    collection_paths.append('/zone/data2')
+    data_object_rows.append(('/zone/data2', 'not_in_tree.txt', 1, None, None))
+    # a second replica of one data object
+    data_object_rows.append(data_object_rows[0])
+    data_object_rows.append(('/zone/data', 'top.xls', 10, 'sha2:top', None))
+
+    backend = LocalCatalogBackend(collection_paths, data_object_rows)
+    catalog = irods.build_catalog(None, '/zone/data', backend=backend)
+
+    assert len(catalog) == 3 * 4 * 2 + 1
+    assert [r.name for r in catalog.data_objects('/zone/data')] == ['top.xls']
+    assert [r.name for r in catalog.subcollections('/zone/data')] == ['project_0', 'project_1', 'project_2']
+    assert catalog.collection_paths()[:4] == [
+        '/zone/data', '/zone/data/project_0', '/zone/data/project_1', '/zone/data/project_2']
+    assert [c.path for c, _, _ in catalog.path_order()] == sorted(set(collection_paths) - {'/zone/data2'})
+    assert '/zone/data2/not_in_tree.txt' not in {r.path for r in catalog.all_data_objects()}
+
+
+def test_build_catalog_round_trips():
+    collection_paths, data_object_rows = build_tree('/zone/data', 20, 50, 4)
+    backend = LocalCatalogBackend(collection_paths, data_object_rows, page_size=500)
+
+    t0 = time.time()
+    catalog = irods.build_catalog(None, '/zone/data', backend=backend)
+    print('listed {} data objects in {} collections in {:5.2f}s'.format(
+        len(catalog), len(collection_paths), time.time() - t0))
+
+    assert len(catalog) == 20 * 50 * 4
+    # one query for collections and one for data objects, each paged
+    assert backend.round_trips == -(-len(collection_paths) // 500) + -(-len(data_object_rows) // 500)
+
+
+def test_get_project_sample_collection_paths():
+    collection_paths, data_object_rows = build_tree('/zone/projects', 3, 4, 1)
+    # a project without a samples collection
+    collection_paths.append('/zone/projects/project_9')
+    backend = LocalCatalogBackend(collection_paths, data_object_rows)
+
+    project_to_samples = irods.get_project_sample_collection_paths('/zone/projects', backend=backend)
+    assert len(project_to_samples) == 4
+    assert project_to_samples['/zone/projects/project_9'] == []
+    assert project_to_samples['/zone/projects/project_1'] == [
+        '/zone/projects/project_1/samples/sample_{}'.format(s) for s in range(4)]
+    assert backend.round_trips == 2
+
+    limited = irods.get_project_sample_collection_paths('/zone/projects', sample_limit=6, backend=backend)
+    assert sum(len(v) for v in limited.values()) == 6
+
+
+class LocalSession:
+    """A stand-in for iRODSSession that answers collections.get from in-memory tables."""
+    class Collections:
+        def __init__(self, collection_paths, data_object_rows):
+            self.collection_paths = collection_paths
+            self.subcollection_paths = dict()
+            for p in collection_paths:
+                self.subcollection_paths.setdefault(posixpath.dirname(p), []).append(p)
+            self.data_object_rows = dict()
+            for row in data_object_rows:
+                self.data_object_rows.setdefault(row[0], []).append(row)
+
+        def get(self, path, list_subcollections=True):
+            class LocalCollection:
+                pass
+            c = LocalCollection()
+            c.path = path
+            c.name = posixpath.basename(path)
+            c.subcollections = [
+                self.get(p, list_subcollections=False)
+                for p in self.subcollection_paths.get(path, [])] if list_subcollections else []
+            c.data_objects = [
+                DataObjectRecord(posixpath.join(cp, n), cp, n, size, checksum, t)
+                for cp, n, size, checksum, t in self.data_object_rows.get(path, [])]
+            return c
+
+    def __init__(self, collection_paths, data_object_rows):
+        self.collections = LocalSession.Collections(collection_paths, data_object_rows)
+
+    def cleanup(self):
+        pass
+
+
+@pytest.fixture
+def restore_irods_session_pool():
+    """Put back the process-wide session pool replaced by a test with configure_irods_session_pool."""
+    previous_pool = irods._irods_session_pool
+    yield
+    with irods._irods_session_pool_lock:
+        test_pool = irods._irods_session_pool
+        irods._irods_session_pool = previous_pool
+    if test_pool is not None and test_pool is not previous_pool:
+        test_pool.close()
+
+
+def test_walk(restore_irods_session_pool):
+    collection_paths, data_object_rows = build_tree('/zone/data', 3, 12, 2)
+    pool = irods.configure_irods_session_pool(
+        size=2,
+        health_check=None,
+        session_factory=lambda: LocalSession(collection_paths, data_object_rows))
+
+    walked = [(c.path, len(s), len(d)) for c, s, d in irods.walk('/zone/data', prefetch=3)]
+    assert [path for path, _, _ in walked] == sorted(collection_paths)
+    assert sum(d for _, _, d in walked) == len(data_object_rows)
+
+    # the caller can hold a session while walking, the listings use the other session
+    with irods.irods_session_manager():
+        walked_with_session = [c.path for c, _, _ in irods.walk('/zone/data', prefetch=3)]
+    assert walked_with_session == sorted(collection_paths)
+
+    # stopping early must not leave listing threads behind
+    walker = irods.walk('/zone/data', prefetch=3)
+    next(walker)
+    walker.close()
+    assert pool._session_count <= 2
+    assert len(pool._idle_sessions) == pool._session_count
+
+
+class CountingPath(str):
+    """A path that counts the comparisons made by walk."""
+    comparison_count = 0
+
+    def __lt__(self, other):
+        CountingPath.comparison_count += 1
+        return str.__lt__(self, other)
+
+
+def test_walk_wide_tree(restore_irods_session_pool):
+    # one collection with many subcollections, some with subcollections of their own
+    sample_count = 5000
+    collection_paths = [CountingPath('/zone/data'), CountingPath('/zone/data/samples')]
+    for s in range(sample_count):
+        collection_paths.append(CountingPath('/zone/data/samples/sample_{}'.format(s)))
+        if s % 1000 == 0:
+            collection_paths.append(CountingPath('/zone/data/samples/sample_{}/reads'.format(s)))
+    irods.configure_irods_session_pool(
+        size=4,
+        health_check=None,
+        session_factory=lambda: LocalSession(collection_paths, []))
+
+    CountingPath.comparison_count = 0
+    walked = [c.path for c, _, _ in irods.walk('/zone/data', prefetch=3)]
+    assert walked == sorted(collection_paths)
+    # about log2(sample_count) comparisons for each collection, not sample_count
+    assert CountingPath.comparison_count < 50 * len(collection_paths)
+
+
+def test_walk_needs_two_sessions(restore_irods_session_pool):
+    collection_paths, data_object_rows = build_tree('/zone/data', 1, 1, 1)
+    irods.configure_irods_session_pool(
+        size=1,
+        health_check=None,
+        session_factory=lambda: LocalSession(collection_paths, data_object_rows))
+    with pytest.raises(ValueError, match='MUSCOPE_IRODS_SESSION_POOL_SIZE'):
+        next(irods.walk('/zone/data'))
+
+
+def test_close_wakes_waiting_borrowers():
+    pool = irods.IrodsSessionPool(size=1, health_check=None, session_factory=lambda: LocalSession([], []))
+    pool.borrow()
+
+    errors = []
+
+    def borrow():
+        try:
+            pool.borrow()
+        except RuntimeError as e:
+            errors.append(e)
+
+    borrower = threading.Thread(target=borrow)
+    borrower.start()
+    time.sleep(0.1)
+    pool.close()
+    borrower.join(timeout=5.0)
+    assert not borrower.is_alive()
+    assert len(errors) == 1
+
+
+def test_session_pool():
+    created = []
+
+    def session_factory():
+        created.append(LocalSession([], []))
+        return created[-1]
+
+    pool = irods.IrodsSessionPool(size=2, health_check=None, session_factory=session_factory)
+    with pool.session() as s1:
+        with pool.session() as s2:
+            assert s1 is not s2
+    with pool.session() as s3:
+        assert s3 in (s1, s2)
+    assert len(created) == 2
+
+    # a session that fails the health check is replaced
+    pool = irods.IrodsSessionPool(
+        size=1, health_check_seconds=0.0, health_check=lambda s: False, session_factory=session_factory)
+    with pool.session() as s1:
+        pass
+    with pool.session() as s2:
+        assert s2 is not s1
+
+    # idle sessions are evicted
+    pool = irods.IrodsSessionPool(size=1, max_idle_seconds=0.0, health_check=None, session_factory=session_factory)
+    with pool.session() as s1:
+        pass
+    with pool.session() as s2:
+        assert s2 is not s1
+
+    # idle sessions are also evicted when a session is given back
+    cleaned_up = []
+    pool = irods.IrodsSessionPool(size=2, max_idle_seconds=0.05, health_check=None, session_factory=session_factory)
+    s1 = pool.borrow()
+    s2 = pool.borrow()
+    s1.cleanup = lambda: cleaned_up.append(s1)
+    pool.give_back(s1)
+    time.sleep(0.1)
+    pool.give_back(s2)
+    assert cleaned_up == [s1]
+    assert pool._session_count == 1
+
+
+def test_check_paths(restore_irods_session_pool):
+    collection_paths, data_object_rows = build_tree('/zone/data', 2, 3, 2)
+    pool = irods.configure_irods_session_pool(
+        size=3,
+        health_check=None,
+        session_factory=lambda: LocalSession(collection_paths, data_object_rows))
+    data_object_paths = {posixpath.join(c, n) for c, n, _, _, _ in data_object_rows}
+
+    def path_status(irods_session, path):
+        if path.endswith('broken'):
+            raise irods.NetworkException('connection reset')
+        elif path in data_object_paths:
+            return 'present_as_object'
+        elif path in irods_session.collections.collection_paths:
+            return 'present_as_collection'
+        else:
+            return 'missing'
+
+    paths = sorted(data_object_paths) + ['/zone/data/project_0', '/zone/data/nothing', '/zone/data/broken']
+    results = {
+        path: (status, error)
+        for path, status, error
+        in irods.check_paths(iter(paths), concurrency=3, path_status=path_status)}
+
+    assert len(results) == len(paths)
+    assert all(results[p] == ('present_as_object', None) for p in data_object_paths)
+    assert results['/zone/data/project_0'] == ('present_as_collection', None)
+    assert results['/zone/data/nothing'] == ('missing', None)
+    assert results['/zone/data/broken'] == ('error', 'NetworkException: connection reset')
+    assert pool._session_count <= 3
+
+
+def test_reconcile():
+    collection_paths, data_object_rows = build_tree('/zone/data', 2, 2, 2)
+    backend = LocalCatalogBackend(collection_paths, data_object_rows)
+    data_catalog = irods.build_catalog(None, '/zone/data', backend=backend)
+
+    registered_paths = [
+        '/zone/data/project_0/samples/sample_0/reads_0.fastq.gz',
+        '/zone/data/project_0/samples/sample_0/reads_1.fastq.gz',
+        '/zone/data/project_0/samples/sample_1/reads_9.fastq.gz',
+        '/zone/data/project_1/samples/sample_1',
+        '/zone/other/reads_0.fastq.gz']
+    assert collection_roots(registered_paths, depth=2) == ['/zone/data', '/zone/other']
+    assert collection_roots(registered_paths, depth=3) == [
+        '/zone/data/project_0', '/zone/data/project_1', '/zone/other']
+
+    report = reconcile(registered_paths, [data_catalog])
+    assert report['present'] == registered_paths[:2]
+    assert report['missing'] == [registered_paths[2]]
+    assert report['collection'] == [registered_paths[3]]
+    assert report['not_listed'] == [registered_paths[4]]
+    assert len(report['orphan']) == len(data_object_rows) - 2
+    assert '/zone/data/project_1/samples/sample_1/reads_0.fastq.gz' in report['orphan']
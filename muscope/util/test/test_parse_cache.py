@@ -0,0 +1,94 @@
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+from muscope.util.parse_cache import ParseCache
+
+
+parse_count = 0
+
+
+def parse_spreadsheet(spreadsheet_fp, skiprows=(0, 2)):
+    global parse_count
+    parse_count += 1
+    return pd.DataFrame({
+        'sample_name': ['S1', np.nan, 'S2', np.nan],
+        'depth': [5.0, np.nan, 25.0, np.nan],
+        'cast_num': [1, 1, 2, 2],
+        'collection_date': pd.to_datetime(['2017-03-01', None, '2017-03-02', None]),
+        'collection_time': [datetime.time(12, 45), None, datetime.time(1, 5), None]})
+
+
+def is_memory_mapped(array):
+    # pandas may return a view of the column array so follow the chain of base arrays
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def test_parse_cache(tmpdir):
+    parse_cache = ParseCache(str(tmpdir))
+
+    expected_df = parse_spreadsheet('x.xls')
+    first_df = parse_cache.parse(parse_spreadsheet, 'x.xls', source_key='abc', skiprows=(1, ))
+    assert parse_count == 2
+
+    cached_df = parse_cache.parse(parse_spreadsheet, 'x.xls', source_key='abc', skiprows=(1, ))
+    assert parse_count == 2
+    pd.testing.assert_frame_equal(cached_df, expected_df)
+    pd.testing.assert_frame_equal(cached_df, first_df)
+    # numeric and datetime columns are memory-mapped, not copied
+    assert is_memory_mapped(cached_df.depth.values)
+    assert is_memory_mapped(cached_df.cast_num.values)
+    assert is_memory_mapped(cached_df.collection_date.values)
+    assert not is_memory_mapped(first_df.depth.values)
+    # the loaders look for the string 'nan' in empty cells
+    assert [str(s) for s in cached_df.sample_name] == ['S1', 'nan', 'S2', 'nan']
+
+    # changing the cached DataFrame does not change the cache
+    cached_df.loc[0, 'depth'] = 999.0
+    assert parse_cache.parse(parse_spreadsheet, 'x.xls', source_key='abc', skiprows=(1, )).depth[0] == 5.0
+
+    # a different source or different arguments are different entries
+    parse_cache.parse(parse_spreadsheet, 'x.xls', source_key='def', skiprows=(1, ))
+    parse_cache.parse(parse_spreadsheet, 'x.xls', source_key='abc', skiprows=(0, 2))
+    assert parse_count == 4
+
+
+def test_cached_entries(tmpdir):
+    parse_cache = ParseCache(str(tmpdir))
+    assert list(parse_cache.cached(parse_spreadsheet)) == []
+
+    parse_cache.parse(parse_spreadsheet, 'y.xls', source_key='def', source_path='/iplant/y.xls')
+    parse_cache.parse(parse_spreadsheet, 'x.xls', source_key='abc', source_path='/iplant/x.xls')
+    # entries without a source path are not included
+    parse_cache.parse(parse_spreadsheet, 'z.xls', source_key='ghi')
+
+    cached_entries = list(parse_cache.cached(parse_spreadsheet))
+    assert [source_path for source_path, _ in cached_entries] == ['/iplant/x.xls', '/iplant/y.xls']
+    pd.testing.assert_frame_equal(cached_entries[0][1], parse_spreadsheet('x.xls'))
+
+    # entries made by a different version are not included
+    assert list(parse_cache.cached(parse_spreadsheet, depends_on=(test_cached_entries, ))) == []
+
+
+def test_changed_source_replaces_entry(tmpdir):
+    parse_cache = ParseCache(str(tmpdir))
+
+    parse_cache.parse(parse_spreadsheet, 'x.xls', source_key='abc', source_path='/iplant/x.xls')
+    parse_cache.parse(parse_spreadsheet, 'x.xls', source_key='abc', source_path='/iplant/x.xls', skiprows=(1, ))
+    parse_cache.parse(parse_spreadsheet, 'y.xls', source_key='def', source_path='/iplant/y.xls')
+    # x.xls changed
+    parse_count_before = parse_count
+    parse_cache.parse(parse_spreadsheet, 'x.xls', source_key='xyz', source_path='/iplant/x.xls')
+    assert parse_count == parse_count_before + 1
+
+    assert [source_path for source_path, _ in parse_cache.cached(parse_spreadsheet)] == [
+        '/iplant/x.xls', '/iplant/y.xls']
+    name = '{}.{}'.format(parse_spreadsheet.__module__, parse_spreadsheet.__name__)
+    # both entries for the old content of x.xls are gone
+    assert sorted(os.listdir(os.path.join(str(tmpdir), name))) == ['def', 'xyz']
@@ -0,0 +1,148 @@
+import types
+
+import numpy as np
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm
+from sqlalchemy.ext.declarative import declarative_base
+
+import muscope.util.sample_attr as sample_attr
+from muscope.util.sample_attr import SampleAttrDiffWriter, values_match
+
+
+Base = declarative_base()
+
+
+class Sample(Base):
+    __tablename__ = 'sample'
+    sample_id = sa.Column(sa.Integer, primary_key=True)
+    sample_name = sa.Column(sa.String(50))
+    sample_attr_list = sa.orm.relationship('Sample_attr', back_populates='sample')
+
+
+class Sample_attr_type(Base):
+    __tablename__ = 'sample_attr_type'
+    sample_attr_type_id = sa.Column(sa.Integer, primary_key=True)
+    type_ = sa.Column('type', sa.String(50))
+
+
+class Sample_attr(Base):
+    __tablename__ = 'sample_attr'
+    sample_attr_id = sa.Column(sa.Integer, primary_key=True)
+    sample_attr_type_id = sa.Column(sa.Integer, sa.ForeignKey('sample_attr_type.sample_attr_type_id'))
+    sample_id = sa.Column(sa.Integer, sa.ForeignKey('sample.sample_id'))
+    value = sa.Column(sa.String(50))
+    sample = sa.orm.relationship(Sample, back_populates='sample_attr_list')
+    sample_attr_type = sa.orm.relationship(Sample_attr_type)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(
+        sample_attr,
+        'models',
+        types.SimpleNamespace(Sample=Sample, Sample_attr=Sample_attr, Sample_attr_type=Sample_attr_type))
+    engine = sa.create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sa.orm.sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def record_statements(session):
+    """Return a list that collects (statement, number of parameter sets) for every statement executed."""
+    statements = []
+
+    @sa.event.listens_for(session.get_bind(), 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement.split()[0], len(parameters) if executemany else 1))
+    return statements
+
+
+def test_values_match_nan():
+    assert values_match('nan', 'nan')
+    assert values_match('nan', str(np.nan))
+    assert not values_match('nan', '1.0')
+    assert not values_match('1.0', 'nan')
+
+
+def test_values_match_small_values():
+    assert values_match('24.5', '24.50000000001')
+    assert values_match('0.0000001', '1e-07')
+    # small measurements that changed are not the same value
+    assert not values_match('0.0000001', '0.0000009')
+    assert not values_match('0.0', '0.0000001')
+
+
+def test_values_match_strings():
+    assert values_match('Reads', 'Reads')
+    assert not values_match('Reads', 'Contigs')
+    assert values_match(None, None)
+    assert not values_match(None, '1.0')
+
+
+def test_sample_attr_diff_writer(session):
+    temperature = Sample_attr_type(type_='temperature')
+    salinity = Sample_attr_type(type_='salinity')
+    samples = [Sample(sample_name='S{}'.format(s)) for s in range(4)]
+    for s, sample in enumerate(samples):
+        sample.sample_attr_list.append(Sample_attr(sample_attr_type=temperature, value=str(20.0 + s)))
+    session.add_all(samples + [salinity])
+    session.commit()
+    temperature_ids = {sample.sample_name: sample.sample_attr_list[0].sample_attr_id for sample in samples}
+
+    statements = record_statements(session)
+    writer = SampleAttrDiffWriter(session=session, batch_size=2)
+    # S0 and S1 are unchanged, S2 and S3 are updated, every sample gets a new salinity
+    changes = [
+        writer.set_value(sample, temperature, value)
+        for sample, value in zip(samples, (20.0, np.float64(21.0), 22.5, 23.5))]
+    assert changes == ['unchanged', 'unchanged', 'updated', 'updated']
+    assert [writer.set_value(sample, salinity, 35.0) for sample in samples] == ['inserted'] * 4
+    assert writer.flush() == 6
+
+    # one executemany UPDATE and two executemany INSERTs of batch_size rows, nothing for unchanged values
+    assert [(statement, n) for statement, n in statements if statement in ('INSERT', 'UPDATE')] == [
+        ('UPDATE', 2), ('INSERT', 2), ('INSERT', 2)]
+    session.commit()
+    assert {
+        sample_attr.sample.sample_name: sample_attr.value
+        for sample_attr
+        in session.query(Sample_attr).filter(Sample_attr.sample_attr_type == temperature)} == {
+            'S0': '20.0', 'S1': '21.0', 'S2': '22.5', 'S3': '23.5'}
+    # the updated rows kept their primary keys
+    assert {
+        sample.sample_name: sample.sample_attr_list[0].sample_attr_id
+        for sample in samples} == temperature_ids
+    assert session.query(Sample_attr).filter(Sample_attr.sample_attr_type == salinity).count() == 4
+    assert writer.report() == (
+        '2 unchanged, 2 updated and 4 inserted sample attribute(s), 0 duplicate value(s) ignored')
+
+    # nothing is written when nothing changed
+    del statements[:]
+    writer = SampleAttrDiffWriter(session=session)
+    assert writer.set_value(samples[0], temperature, '20.0') == 'unchanged'
+    assert writer.flush() == 0
+    assert [statement for statement, _ in statements if statement in ('INSERT', 'UPDATE')] == []
+
+
+def test_sample_attr_diff_writer_duplicate_values(session):
+    temperature = Sample_attr_type(type_='temperature')
+    sample = Sample(sample_name='S0')
+    sample.sample_attr_list.append(Sample_attr(sample_attr_type=temperature, value='20.0'))
+    other_sample = Sample(sample_name='S1')
+    session.add_all([sample, other_sample])
+    session.commit()
+
+    writer = SampleAttrDiffWriter(session=session)
+    # columns "Temp" and "temp" are both the temperature attribute, the first value is kept
+    assert writer.set_value(sample, temperature, 21.0) == 'updated'
+    assert writer.set_value(sample, temperature, 22.0) == 'duplicate'
+    assert writer.set_value(other_sample, temperature, 21.0) == 'inserted'
+    assert writer.set_value(other_sample, temperature, 22.0) == 'duplicate'
+    assert writer.flush() == 2
+    session.commit()
+
+    assert [sample_attr.value for sample_attr in sample.sample_attr_list] == ['21.0']
+    assert [sample_attr.value for sample_attr in other_sample.sample_attr_list] == ['21.0']
+    assert writer.counts == {'unchanged': 0, 'updated': 1, 'inserted': 1, 'duplicate': 2}